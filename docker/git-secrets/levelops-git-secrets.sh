@@ -1,9 +1,13 @@
 #!/usr/bin/env bash
 
-# existing current
-# existing historic
-# new current
-# new historic
+# existing current <path>
+# existing historic <path>
+# existing incremental <commit> <path>
+# new current <path>
+# new historic <path>
+# new incremental <commit> <path>
+# setup <path>
+# cleanup <path>
 
 init_git_secrets(){
     git-secrets --install -f
@@ -23,9 +27,39 @@ scan(){
         historic)
             git secrets --scan-history 2>&1
             ;;
+        incremental)
+            # only the commits added since the last scanned commit
+            scan_commits HEAD "^$2" 2>&1
+            ;;
     esac
 }
 
+load_allowed(){
+    # same allowed patterns as git-secrets: the git config and the .gitallowed file (without empty lines and comments)
+    git config --get-all secrets.allowed
+    if [ -f .gitallowed ]; then
+        grep -Ev '^(#.*|[[:space:]]*)$' .gitallowed
+    fi
+}
+
+scan_commits(){
+    # same as "git secrets --scan-history" for the commits of the rev-list range passed as arguments
+    patterns=$( (git config --get-all secrets.patterns; git config --get-all secrets.providers | while read -r provider; do eval "$provider"; done) | grep -v '^$' | paste -sd '|' -)
+    if [ -z "$patterns" ]; then
+        return 0
+    fi
+    commits=$(git rev-list "$@")
+    if [ -z "$commits" ]; then
+        return 0
+    fi
+    allowed=$(load_allowed | paste -sd '|' -)
+    if [ -z "$allowed" ]; then
+        echo "$commits" | xargs git grep -nwHEI "$patterns"
+    else
+        echo "$commits" | xargs git grep -nwHEI "$patterns" | grep -Ev "$allowed"
+    fi
+}
+
 cleanup(){
     sed -i 's/git\ssecrets.*//g' .git/hooks/commit-msg
     sed -i 's/git\ssecrets.*//g' .git/hooks/pre-commit
@@ -35,23 +69,29 @@ cleanup(){
 no_git_secrets_scan(){
     log=$(init_git_secrets)
     log=$(init_providers)
-    scan $1
+    scan $1 $2
     cleanup
 }
 
 existing_git_secrets_scan(){
-    scan $1
+    scan $1 $2
 }
 
-# cd into work dir
-cd $3
+# cd into work dir (always the last argument)
+cd "${@: -1}"
 case "$1" in
+    setup)
+        # install once, then run the "existing" scans (current and historic can run at the same time)
+        log=$(init_git_secrets)
+        log=$(init_providers)
+        exit 0
+        ;;
     new)
-        no_git_secrets_scan $2
+        no_git_secrets_scan $2 $3
         exit 0
         ;;
     existing)
-        existing_git_secrets_scan $2
+        existing_git_secrets_scan $2 $3
         exit 0
         ;;
     cleanup)
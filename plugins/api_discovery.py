@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+##################################################################
+#  Copyright (C) 2019-2020 LevelOps Inc <support@levelops.io>
+#
+#  This file is part of the LevelOps Inc Tools.
+#
+#  This tool is licensed under Apache License, Version 2.0
+##################################################################
+
+import logging
+import sys
+import os
+import inspect
+import time
+from importlib import import_module
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+sys.path.insert(0,currentdir)
+
+from ujson import dump, dumps
+from argparse import ArgumentParser
+from sdk.types import Endpoint, API, Report
+from sdk.fs_processor import Scanner, PartialResults, get_prefilter, prefilter_matches
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, scanner_plugin_options, incremental_scan_plugin_options, streaming_plugin_options, get_scan_cache, get_report_sink, validate_stream_options, scan_targets, merge_previous_report
+
+
+log = logging.getLogger(__name__)
+plugin = Plugin(name="sast_api_discovery", version="1")
+
+# the api_discovery_<name> plugins used as extractors
+extractor_names = ["springmvc", "flask", "nodejs_express", "k8s", "aws_cloudformation", "apigee"]
+EXPRESS = "nodejs_express"
+
+
+class Dispatcher(object):
+  """ Scanner action that runs every extractor registered for the extension of the file.
+
+  The extractor modules are imported lazily so the dispatcher can be sent to the worker processes
+  of the process backend, where the modules get imported once per process.
+  Every extractor only gets the files that match its own prefilter.
+  If an extractor fails, the results of the other extractors are returned as PartialResults so the file is not cached.
+  """
+  def __init__(self, names):
+    self.names = names
+    self._extractors = None
+
+  def __getstate__(self):
+    return {'names': self.names}
+
+  def __setstate__(self, state):
+    self.names = state['names']
+    self._extractors = None
+
+  def get_extractors(self):
+    if self._extractors is None:
+      extractors = []
+      for name in self.names:
+        module = import_module("api_discovery_" + name)
+        filters = module.file_filters if isinstance(module.file_filters, list) else [module.file_filters]
+        extractors.append((module.plugin.name, tuple(filters), get_prefilter(getattr(module, 'file_prefilter', None)), module.process_file))
+      self._extractors = extractors
+    return self._extractors
+
+  def get_filters(self):
+    filters = []
+    for name, suffixes, prefilter, action in self.get_extractors():
+      filters.extend([x for x in suffixes if x not in filters])
+    return filters
+
+  def get_prefilter(self):
+    """ Any of the prefilters of the extractors, None if one of them doesn't have a prefilter (every file is processed). """
+    patterns = []
+    for name, suffixes, prefilter, action in self.get_extractors():
+      if prefilter is None:
+        return None
+      patterns.extend([x for x in prefilter if x not in patterns])
+    return patterns
+
+  def get_cache_plugin(self):
+    """ The plugin the results are cached as: the version includes the extractors (and their versions) that run. """
+    versions = sorted(set(["%s:%s" % (name, import_module("api_discovery_" + name).plugin.version) for name in self.names]))
+    return Plugin(name=plugin.name, version="%s;%s" % (plugin.version, ','.join(versions)))
+
+  def __call__(self, f_path, buffer=None):
+    results = []
+    failed = False
+    for name, suffixes, prefilter, action in self.get_extractors():
+      if not f_path.endswith(suffixes):
+        continue
+      if buffer is not None and prefilter is not None and not prefilter_matches(buffer, prefilter):
+        continue
+      try:
+        result = action(f_path, buffer)
+      except Exception as e:
+        log.error("[%s] Task failed: %s", name, f_path, exc_info=True)
+        failed = True
+        continue
+      if isinstance(result, API):
+        result.extractor = name
+      if result:
+        results.append(result)
+    return PartialResults(results) if failed else results
+
+
+class Collector(object):
+  """ Adds the APIs to the report (or writes them to the sink if there is one) and hands the express resources
+  to the express plugin so they can be bundled at the end.
+  """
+  def __init__(self, report, names, sink=None):
+    self.report = report
+    self.add_api = sink.emit if sink else report.add_api
+    self.express = import_module("api_discovery_" + EXPRESS) if EXPRESS in names else None
+
+  def __call__(self, result):
+    if self.express and isinstance(result, self.express.Resource):
+      self.express.register_resource(result)
+    else:
+      self.add_api(result)
+
+  def finish(self):
+    if not self.express:
+      return
+    for api in self.express.bundle_apis():
+      api.extractor = self.express.plugin.name
+      self.add_api(api)
+
+
+def validate_args(options, f_targets):
+  if options.debug:
+      log.setLevel('DEBUG')
+  if options.submit:
+    if not options.product or not options.token:
+      log.error("Both product and token options are required if the submit flag is present.")
+      sys.exit(1)
+  if options.json and options.csv:
+      log.error("Only one output format can be selected at one time. Either pass the flag --json or --csv or no flag for standard output.")
+      sys.exit(1)
+  if (options.json or options.csv) and not options.output_file and not options.print_results:
+      log.error("To use --csv or --json, either the --print-results flag (to print to the console) or the --out flag (to write to a file) must be specified.")
+      sys.exit(1)
+  validate_stream_options(options)
+  for name in options.extractors:
+    if name not in extractor_names:
+      log.error("Unknown extractor '%s', the available extractors are: %s", name, ','.join(extractor_names))
+      sys.exit(1)
+
+  if len(f_targets) < 1:
+    log.error("must provide a list of directories to scan (space separated)")
+    sys.exit(1)
+
+
+def get_options():
+  parser = ArgumentParser(prog="Levelops API discovery scanner.", usage="./api_discovery.py (optional <flags>) <directory to scan>")
+  parser.add_argument('--extractors', dest='extractors', help='Comma separated list of the extractors to run (default: all). Available extractors: %s' % ','.join(extractor_names), type=lambda x: [e.strip() for e in x.split(',') if e.strip()], default=extractor_names)
+  for parser_option in scanner_plugin_options + incremental_scan_plugin_options + streaming_plugin_options + default_plugin_options:
+    parser.add_argument(*parser_option['args'], **parser_option['kwords'])
+
+  return parser.parse_known_args()
+
+
+def handle_output(options, results):
+    if options.json:
+      if options.print_results:
+        log.info(dumps(results, indent=2, escape_forward_slashes=False))
+      if options.output_file:
+        with open(options.output_file, 'w') as f:
+          dump(results, f, indent=2, escape_forward_slashes=False)
+
+    elif options.csv:
+      if options.print_results:
+        log.info("reference, api_endpoint, extractor")
+        for api in results.apis:
+          for endpoint in api.endpoints:
+            log.info("%s,%s,%s", api.name, endpoint.path, api.extractor)
+      if options.output_file:
+        with open(options.output_file, 'w') as f:
+          f.write("reference, api_endpoint, extractor\n")
+          for api in results.apis:
+            for endpoint in api.endpoints:
+              f.write("%s,%s,%s\n" % (api.name, endpoint.path, api.extractor))
+
+    elif options.print_results or options.output_file:
+      if options.output_file:
+        with open(options.output_file, 'w') as f:
+          for api in results.apis:
+            for endpoint in api.endpoints:
+              f.write("%s     %s     %s\n" % (api.name, endpoint.path, api.extractor))
+      if options.print_results:
+        log.info("======================================")
+        log.info("Report:")
+        for api in results.apis:
+          for endpoint in api.endpoints:
+            log.info("%s     %s     %s", api.name, endpoint.path, api.extractor)
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level="INFO", format="[%(threadName)s] [%(levelname)s]: %(message)s")
+
+  options, f_targets = get_options()
+  validate_args(options, f_targets)
+
+  runner = Runner(base_url=options.endpoint)
+  success = False
+  start_time = time.time()
+  try:
+    dispatcher = Dispatcher(names=options.extractors)
+    sink = get_report_sink(options, extractor=True)
+    collector = Collector(report=Report(), names=options.extractors, sink=sink)
+    s = Scanner(thread_count=options.threads, backend=options.backend, queue_timeout=0.5, cache=get_scan_cache(options, dispatcher.get_cache_plugin()), collector=collector)
+    stale = scan_targets(scanner=s, f_targets=f_targets, filters=dispatcher.get_filters(), action=dispatcher, options=options, prefilter=dispatcher.get_prefilter())
+    s.wait_and_finish()
+    collector.finish()
+    success = True
+    if sink:
+      # already written while scanning
+      sink.close()
+      results = collector.report
+    else:
+      results = merge_previous_report(report=collector.report, options=options, stale=stale)
+      handle_output(options, results)
+  except Exception as e:
+    log.error("Couldn't successfully complete the scanning: %s", e, exc_info=True)
+    results = str(e)
+  except:
+    error = sys.exc_info()
+    log.error("Couldn't successfully complete the scanning: %s - %s", error[0], error[1], error[2])
+    results = str(error[1])
+  finally:
+    end_time = time.time()
+    if options.submit:
+      # post failure to levelops
+      runner.submit(success=success, results=results, product_id=options.product, token=options.token, plugin=plugin, elapsed_time=(end_time - start_time), labels=options.labels, tags=options.tags)
+  if success:
+    sys.exit(0)
+  else:
+    sys.exit(1)
@@ -23,12 +23,16 @@ sys.path.insert(0,parentdir)
 
 from argparse import ArgumentParser
 from sdk.types import Endpoint, API, Report
-from sdk.fs_processor import Scanner
-from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options
+from sdk.fs_processor import Scanner, get_content
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, scanner_plugin_options, incremental_scan_plugin_options, streaming_plugin_options, get_scan_cache, get_report_sink, validate_stream_options, scan_targets, merge_previous_report
 
 
 log = logging.getLogger(__name__)
-plugin = Plugin(name="sast_api_cloudformation", version="1")
+plugin = Plugin(name="sast_api_cloudformation", version="2")
+file_filters = [".json", ".yaml", ".yml", ".template"]
+# only the files with a resource type of our interest are parsed
+file_prefilter = re.compile(rb'(Custom|AWS::ApiGateway)::(ApiImport|Resource|Method|Stage|RestApi)', flags=re.I)
+type_pattern = re.compile(pattern='^\s*"?Type"?\s*:\s*"?(Custom|AWS::ApiGateway)::(ApiImport|Resource|Method|Stage|RestApi)"?[\,\s]*$', flags=(re.I | re.M))
 
 
 class Node(object):
@@ -80,7 +84,7 @@ class Tree(Node):
       return
 
 
-def process_file(f_path):
+def process_file(f_path, buffer=None):
   """
     Root (RestAPI) -> (Resource ->)+ Method
     Type: "AWS::ApiGateway::RestApi"
@@ -107,11 +111,14 @@ def process_file(f_path):
   """
   # filter by content, resurce types(Method, Stage, Recource, RestApi)
   log.debug("path: %s" % f_path)
-  content_found = content_filter(f_path=f_path)
+  content = get_content(f_path, buffer)
+  content_found = content_filter(content=content)
   if not content_found:
     return
   # parse file contents and collect APIs
-  resources = load_file(r_path=f_path)
+  resources = load_file(r_path=f_path, content=content)
+  if not resources:
+    return
   trees = {}
   # Assemble graph with matching restapiIds, resourcesId, and parents
   api = API(name=f_path)
@@ -182,25 +189,18 @@ def bundle_path(prefix, node):
   return paths
 
 
-def content_filter(f_path):
-  pattern = re.compile(pattern='^\s*"?Type"?\s*:\s*"?(Custom|AWS::ApiGateway)::(ApiImport|Resource|Method|Stage|RestApi)"?[\,\s]*$', flags=(re.I | re.M))
-  with open(f_path) as file:
-    line = file.readline()
-    while line:
-      if pattern.match(line):
-        return True
-      line = file.readline()
+def content_filter(content):
+  for line in content.splitlines():
+    if type_pattern.match(line):
+      return True
   return False
 
 
-def load_file(r_path):
-  with open(r_path, 'r') as resource:
-    if r_path.endswith('json'):
-      return loads(resource).get("Resources")
-    elif r_path.endswith('yaml') or r_path.endswith('yml'):
-      return yaml.full_load_all(resource).get("Resources")
-    elif r_path.endswith('template'):
-      return load(resource).get("Resources")
+def load_file(r_path, content):
+  if r_path.endswith('json') or r_path.endswith('template'):
+    return loads(content).get("Resources")
+  elif r_path.endswith('yaml') or r_path.endswith('yml'):
+    return (yaml.full_load(content) or {}).get("Resources")
 
 
 def validate_args(options, f_targets):
@@ -216,6 +216,7 @@ def validate_args(options, f_targets):
   if (options.json or options.csv) and not options.output_file and not options.print_results:
       log.error("To use --csv or --json, either the --print-results flag (to print to the console) or the --out flag (to write to a file) must be specified.")
       sys.exit(1)
+  validate_stream_options(options)
 
   if len(f_targets) < 1:
     log.error("must provide a list of directories to scan (space separated)")
@@ -224,8 +225,7 @@ def validate_args(options, f_targets):
 
 def get_options():
   parser = ArgumentParser(prog="Levelops cloudformation configuration scanner.", usage="./api_discovery_aws_cloudformation.py (optional <flags>) <directory to scan>")
-  parser.add_argument('-t', '--threads', dest='threads', help='Number of threads', type=int, default=5)
-  for parser_option in default_plugin_options:
+  for parser_option in scanner_plugin_options + incremental_scan_plugin_options + streaming_plugin_options + default_plugin_options:
     parser.add_argument(*parser_option['args'], **parser_option['kwords'])
 
   return parser.parse_known_args()
@@ -277,15 +277,18 @@ if __name__ == "__main__":
   success = False
   start_time = time.time()
   try:
-    s = Scanner(thread_count=3, queue_timeout=0.5)
-    for f_target in f_targets:
-      log.info("scanning path: %s" % f_target)
-      s.scan_directory(base_path=f_target, filters=[".json", ".yaml", ".yml", ".template"], action=process_file)
+    sink = get_report_sink(options)
+    s = Scanner(thread_count=options.threads, backend=options.backend, queue_timeout=0.5, cache=get_scan_cache(options, plugin), collector=sink.emit if sink else None)
+    stale = scan_targets(scanner=s, f_targets=f_targets, filters=file_filters, action=process_file, options=options, prefilter=file_prefilter)
     s.wait_and_finish()
     success = True
-    results =  s.get_report()
-
-    handle_output(options, results)
+    if sink:
+      # already written while scanning
+      sink.close()
+      results = s.get_report()
+    else:
+      results = merge_previous_report(report=s.get_report(), options=options, stale=stale)
+      handle_output(options, results)
   except Exception as e:
     log.error("Couldn't successfully complete the scanning.", e, exc_info=True)
     results = str(e)
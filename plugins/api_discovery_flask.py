@@ -21,15 +21,18 @@ sys.path.insert(0,parentdir)
 from ujson import dump, dumps
 from argparse import ArgumentParser
 from sdk.types import Endpoint, API, Report
-from sdk.fs_processor import Scanner
-from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options
+from sdk.fs_processor import Scanner, get_content
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, scanner_plugin_options, incremental_scan_plugin_options, streaming_plugin_options, get_scan_cache, get_report_sink, validate_stream_options, scan_targets, merge_previous_report
 
 
 log = logging.getLogger(__name__)
 plugin = Plugin(name="sast_api_flask", version="1")
+file_filters = ".py"
+file_prefilter = re.compile(b'route', flags=re.I)
+route_pattern = re.compile(pattern='^\s*(@(\w*\s*\.\s*route)\s*\(\s*(.*\,\s*)*(rule\s*=\s*)?[\"\']([\w\/\{\}\w\:\w\s\[\]\+\.\*\\\<\>\-]+)[\"\'](\s*,.*)*\s*\)).*$', flags=(re.I | re.M))
 
 
-def process_file(f_path):
+def process_file(f_path, buffer=None):
   # parse file contents and collect APIs
   # detect single line annotations
   # detect multi line annotations
@@ -52,17 +55,13 @@ def process_file(f_path):
   inside_class = False
   prefix = ""
   api = API(name=f_path)
-  pattern = re.compile(pattern='^\s*(@(\w*\s*\.\s*route)\s*\(\s*(.*\,\s*)*(rule\s*=\s*)?[\"\']([\w\/\{\}\w\:\w\s\[\]\+\.\*\\\<\>\-]+)[\"\'](\s*,.*)*\s*\)).*$', flags=(re.I | re.M))
   # class_pattern = re.compile(pattern='^\s*public\s*class\s*.+$', flags=(re.I | re.M))
-  with open(f_path) as file:
-    line = file.readline()
-    while line:
-      result = pattern.match(line)
-      if result:
-        api_found = True
-        log.debug("API!! %s, %s", f_path, result.group(5))
-        api.add_endpoint( Endpoint( path=(prefix+result.group(5)).replace('//', '/') ))
-      line = file.readline()
+  for line in get_content(f_path, buffer).splitlines():
+    result = route_pattern.match(line)
+    if result:
+      api_found = True
+      log.debug("API!! %s, %s", f_path, result.group(5))
+      api.add_endpoint( Endpoint( path=(prefix+result.group(5)).replace('//', '/') ))
   # if there was only the root mapping we add it as a single endpoint
   if prefix != "" and not api_found:
     api.add_endpoint( Endpoint(path=prefix))
@@ -84,6 +83,7 @@ def validate_args(options, f_targets):
   if (options.json or options.csv) and not options.output_file and not options.print_results:
       log.error("To use --csv or --json, either the --print-results flag (to print to the console) or the --out flag (to write to a file) must be specified.")
       sys.exit(1)
+  validate_stream_options(options)
 
   if len(f_targets) < 1:
     log.error("must provide a list of directories to scan (space separated)")
@@ -92,8 +92,7 @@ def validate_args(options, f_targets):
 
 def get_options():
   parser = ArgumentParser(prog="Levelops flask configuration scanner.", usage="./api_discovery_flask.py (optional <flags>) <directory to scan>")
-  parser.add_argument('-t', '--threads', dest='threads', help='Number of threads', type=int, default=5)
-  for parser_option in default_plugin_options:
+  for parser_option in scanner_plugin_options + incremental_scan_plugin_options + streaming_plugin_options + default_plugin_options:
     parser.add_argument(*parser_option['args'], **parser_option['kwords'])
   
   return parser.parse_known_args()
@@ -145,15 +144,18 @@ if __name__ == "__main__":
   success = False
   start_time = time.time()
   try:
-    s = Scanner(queue_timeout=0.5)
-    for f_target in f_targets:
-      log.info("scanning path: %s" % f_target)
-      s.scan_directory(base_path=f_target, filters=".py", action=process_file)
+    sink = get_report_sink(options)
+    s = Scanner(thread_count=options.threads, backend=options.backend, queue_timeout=0.5, cache=get_scan_cache(options, plugin), collector=sink.emit if sink else None)
+    stale = scan_targets(scanner=s, f_targets=f_targets, filters=file_filters, action=process_file, options=options, prefilter=file_prefilter)
     s.wait_and_finish()
     success = True
-    results =  s.get_report()
-
-    handle_output(options, results)
+    if sink:
+      # already written while scanning
+      sink.close()
+      results = s.get_report()
+    else:
+      results = merge_previous_report(report=s.get_report(), options=options, stale=stale)
+      handle_output(options, results)
   except Exception as e:
     log.error("Couldn't successfully complete the scanning.", e, exc_info=True)
     results = str(e)
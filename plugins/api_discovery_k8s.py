@@ -33,11 +33,15 @@ sys.path.insert(0,parentdir)
 
 from argparse import ArgumentParser
 from sdk.types import Endpoint, API, Report
-from sdk.fs_processor import Scanner
-from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options
+from sdk.fs_processor import Scanner, get_content
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, scanner_plugin_options, incremental_scan_plugin_options, streaming_plugin_options, get_scan_cache, get_report_sink, validate_stream_options, scan_targets, merge_previous_report
 
 log = logging.getLogger(__name__)
-plugin = Plugin(name="sast_api_k8s", version="1")
+plugin = Plugin(name="sast_api_k8s", version="2")
+file_filters = [".yml", ".yaml", ".json"]
+# only the files with a resource of our interest are parsed
+file_prefilter = re.compile(rb'kind"?\s*:\s*"?ingress', flags=re.I)
+kind_pattern = re.compile(pattern='^\s*("?kind"?\s*:\s*"?([Ii]ngress)"?).*$', flags=(re.I | re.M))
 
 
 # scan directory and subdirectories
@@ -50,7 +54,7 @@ plugin = Plugin(name="sast_api_k8s", version="1")
 r_types = ["ingress"]
 
 
-def process_file(f_path):
+def process_file(f_path, buffer=None):
   # filter by content. only parse if the file actually contains any reource that we are intesrested in.
   # parse file contnents.
   # analize resource definitinon.
@@ -58,25 +62,21 @@ def process_file(f_path):
   log.debug("path: %s" % f_path)
   api_found = False
   api = API(name=f_path)
-  pattern = re.compile(pattern='^\s*("?kind"?\s*:\s*"?([Ii]ngress)"?).*$', flags=(re.I | re.M))
+  content = get_content(f_path, buffer)
+  # check if the file contains any type of resource of our interest
   resource_found = False
-  with open(f_path) as file:
-    line = file.readline()
-    while line:
-      # check if the file contains any type of resource of our interest
-      result = pattern.match(line)
-      resource_found = result != None and result.group(2).lower() in r_types
-      if resource_found:
-        break
-      line = file.readline()
-      continue
+  for line in content.splitlines():
+    result = kind_pattern.match(line)
+    resource_found = result != None and result.group(2).lower() in r_types
+    if resource_found:
+      break
   if not resource_found:
     return
-  # Parse contents
+  # Parse contents (already in memory, the file is not read again)
   if f_path.endswith('yaml') or f_path.endswith('yml'):
-    resources = load_yaml_resource(f_path)
+    resources = load_yaml_resource(content)
   elif f_path.endswith('json'):
-    resources = load_json_resource(f_path)
+    resources = load_json_resource(content)
   else:
     log.error("Unsupported file type. No parser found for file '%s'", f_path)
     resources = None
@@ -104,14 +104,20 @@ def process_file(f_path):
     return api
 
 
-def load_yaml_resource(r_path):
-  with open(r_path, 'r') as resource:
-    return [ dic for dic in yaml.full_load_all(resource)]
+def load_yaml_resource(content):
+  return [ dic for dic in yaml.full_load_all(content)]
 
 
-def load_json_resource(r_path):
-  with open(r_path, 'r') as resource:
-    return loads(resource)
+def load_json_resource(content):
+  resource = loads(content)
+  # a single resource or a list of resources (kind: List)
+  if isinstance(resource, dict):
+    if isinstance(resource.get('items'), list):
+      return resource.get('items')
+    return [resource]
+  if isinstance(resource, list):
+    return resource
+  return []
 
 
 def validate_args(options, f_targets):
@@ -127,6 +133,7 @@ def validate_args(options, f_targets):
   if (options.json or options.csv) and not options.output_file and not options.print_results:
       log.error("To use --csv or --json, either the --print-results flag (to print to the console) or the --out flag (to write to a file) must be specified.")
       sys.exit(1)
+  validate_stream_options(options)
 
   if len(f_targets) < 1:
     log.error("must provide a list of directories to scan (space separated)")
@@ -135,8 +142,7 @@ def validate_args(options, f_targets):
 
 def get_options():
   parser = ArgumentParser(prog="Levelops k8s configuration scanner.", usage="./api_discovery_k8s.py (optional <flags>) <directory to scan>")
-  parser.add_argument('-t', '--threads', dest='threads', help='Number of threads', type=int, default=5)
-  for parser_option in default_plugin_options:
+  for parser_option in scanner_plugin_options + incremental_scan_plugin_options + streaming_plugin_options + default_plugin_options:
     parser.add_argument(*parser_option['args'], **parser_option['kwords'])
 
   return parser.parse_known_args()
@@ -188,15 +194,18 @@ if __name__ == "__main__":
   success = False
   start_time = time.time()
   try:
-    s = Scanner(queue_timeout=0.5)
-    for f_target in f_targets:
-      log.info("scanning path: %s" % f_target)
-      s.scan_directory(base_path=f_target, filters=[".yml", ".yaml", ".json"], action=process_file)
+    sink = get_report_sink(options)
+    s = Scanner(thread_count=options.threads, backend=options.backend, queue_timeout=0.5, cache=get_scan_cache(options, plugin), collector=sink.emit if sink else None)
+    stale = scan_targets(scanner=s, f_targets=f_targets, filters=file_filters, action=process_file, options=options, prefilter=file_prefilter)
     s.wait_and_finish()
     success = True
-    results =  s.get_report()
-
-    handle_output(options, results)
+    if sink:
+      # already written while scanning
+      sink.close()
+      results = s.get_report()
+    else:
+      results = merge_previous_report(report=s.get_report(), options=options, stale=stale)
+      handle_output(options, results)
   except Exception as e:
     log.error("Couldn't successfully complete the scanning.", e, exc_info=True)
     results = str(e)
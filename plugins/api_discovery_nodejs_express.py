@@ -15,6 +15,7 @@ import os
 import io
 import time
 import inspect
+from threading import Lock
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir) 
@@ -22,12 +23,15 @@ sys.path.insert(0,parentdir)
 from ujson import dump, dumps
 from argparse import ArgumentParser
 from sdk.types import Endpoint, API, Report
-from sdk.fs_processor import Scanner
-from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options
+from sdk.fs_processor import Scanner, get_content
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, scanner_plugin_options
 
 
 log = logging.getLogger(__name__)
 plugin = Plugin(name="sast_api_express", version="1")
+file_filters = ".js"
+# only the files that require express are parsed
+file_prefilter = re.compile(b'express', flags=re.I)
 
 express_pattern = re.compile(pattern='^\s*var\s*(\w*)\s*=\s*(require\(\s*\'express\'\s*\))\s*.*;?$', flags=(re.I | re.M))
 require_pattern = re.compile(pattern='^\s*var\s*(\w*)\s*=\s*(require\(\s*\'([\.\/\w]+)\'\s*\))\s*;?.*$', flags=(re.I | re.M))
@@ -36,9 +40,11 @@ use_pattern = re.compile(pattern='^.*\.\s*use\(\s*\'([\/\w]+)\'\s*,\s*(require\s
 endpoint_pattern1 = re.compile(pattern='^\s*.*\w+\s*\.\s*(get|post|delete|put)\s*\(\s*\'(\/[\/\w\:\}\{]*)\'\s*.*$', flags=(re.I | re.M))
 endpoint_pattern2 = re.compile(pattern='^\s*.*\w+\s*\.\s*route\s*\(\s*\'(\/[\/\w\:\}\{]*)\'\s*\)\s*\.\s*(get|post|delete|put)\s*\(.*$', flags=(re.I | re.M))
 resources = {}
+resources_lock = Lock()
+used_resource = set()
 
 
-def process_file(f_path):
+def process_file(f_path, buffer=None):
   """
   Supported annotations:
     require('express')
@@ -77,12 +83,11 @@ def process_file(f_path):
   api_found = False
   prefix = ""
   api = API(name=f_path)
-  with io.open(f_path) as file:
-    try:
-      content = file.read()
-    except Exception as e:
-      log.error('Error processing FILE: %s', f_path, exc_info=True)
-      return
+  try:
+    content = get_content(f_path, buffer)
+  except Exception as e:
+    log.error('Error processing FILE: %s', f_path, exc_info=True)
+    return
   
   result = express_pattern.findall(content)
   if not result:
@@ -123,13 +128,7 @@ def process_file(f_path):
       # Resource(name=path, method=None, endpoint=None)
       # api.add_endpoint(Endpoint(path=("%s - %s - %s"%('use', use_path, use_definition) ) ) )
   if len(resource.endpoints) > 0 or len(resource.imports)>0:
-    resources[resource.r_id]=resource
-    parent_resource = os.path.normpath(f_path + "/../")
-    parent = resources.get(parent_resource, None)
-    if not parent:
-      parent = Resource(r_id=parent_resource, path=parent_resource)
-      resources[parent_resource] = parent
-    parent.add_resource(resource)
+    return resource
   # api_found = True
   # log.debug("API!! %s, %s", f_path, result.group(5))
   # api.add_endpoint( Endpoint( path=(prefix+result.group(5)).replace('//', '/') ))
@@ -141,6 +140,21 @@ def process_file(f_path):
   #   return api
 
 
+def register_resource(resource):
+  """ Scanner collector, links the resources found by 'process_file' with their parent directory.
+
+  Runs in the scanner's process so the resources are available for 'bundle_resources' whatever the backend is.
+  """
+  with resources_lock:
+    resources[resource.r_id]=resource
+    parent_resource = os.path.normpath(resource.path + "/../")
+    parent = resources.get(parent_resource, None)
+    if not parent:
+      parent = Resource(r_id=parent_resource, path=parent_resource)
+      resources[parent_resource] = parent
+    parent.add_resource(resource)
+
+
 class Import(object):
   def __init__(self, id, target):
     self.id = id
@@ -192,8 +206,8 @@ def bundle_resources(prefix, resource):
     endpoints.extend(bundle_resources(prefix=path, resource=r))
     used_resource.add(r)
   if prefix and prefix != '':
-    for endpoint in resource.endpoints:
-      endpoint.path = os.path.normpath(prefix + "/" + endpoint.path)
+    # endpoints are immutable, the prefixed ones replace them
+    resource.endpoints = [Endpoint(path=os.path.normpath(prefix + "/" + endpoint.path), method=endpoint.method) for endpoint in resource.endpoints]
     for r in resource.resources:
       endpoints.extend(bundle_resources(prefix=prefix, resource=r))
       used_resource.add(r)
@@ -201,12 +215,21 @@ def bundle_resources(prefix, resource):
   return endpoints
 
 
+def bundle_apis():
+  """ Assembles the APIs from the resources collected by 'register_resource'. """
+  apis = []
+  for r_name in resources:
+    resource = resources[r_name]
+    endpoints = bundle_resources(prefix='',resource=resource)
+    apis.append(API(name=resource.path, endpoints=endpoints))
+  return apis
+
+
 if __name__ == "__main__":
   logging.basicConfig(level="INFO", format="[%(threadName)s] [%(levelname)s]: %(message)s")
 
   parser = ArgumentParser(prog="Levelops nodejs express configuration scanner.", usage="./api_discovery_nodejs_express.py (optional <flags>) <directory to scan>")
-  parser.add_argument('-t', '--threads', dest='threads', help='Number of threads', type=int, default=5)
-  for parser_option in default_plugin_options:
+  for parser_option in scanner_plugin_options + default_plugin_options:
     parser.add_argument(*parser_option['args'], **parser_option['kwords'])
 
   options, f_targets = parser.parse_known_args()
@@ -231,19 +254,16 @@ if __name__ == "__main__":
   success = False
   start_time = time.time()
   try:
-    s = Scanner(queue_timeout=0.5)
+    s = Scanner(thread_count=options.threads, backend=options.backend, queue_timeout=0.5, collector=register_resource)
     for f_target in f_targets:
       log.info("scanning path: %s" % f_target)
-      s.scan_directory(base_path=f_target, filters=".js", action=process_file)
+      s.scan_directory(base_path=f_target, filters=file_filters, action=process_file, prefilter=file_prefilter)
     s.wait_and_finish()
 
     # assemble report
     report = Report()
-    used_resource = set()
-    for r_name in resources:
-      resource = resources[r_name]
-      endpoints = bundle_resources(prefix='',resource=resource)
-      report.add_api(API(name=resource.path, endpoints=endpoints))
+    for api in bundle_apis():
+      report.add_api(api)
 
     success = True
     results =  report
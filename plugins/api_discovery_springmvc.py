@@ -21,18 +21,28 @@ sys.path.insert(0,parentdir)
 from ujson import dump, dumps
 from argparse import ArgumentParser
 from sdk.types import Endpoint, API, Report
-from sdk.fs_processor import Scanner
-from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options
+from sdk.fs_processor import Scanner, get_content
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, scanner_plugin_options, incremental_scan_plugin_options, streaming_plugin_options, get_scan_cache, get_report_sink, validate_stream_options, scan_targets, merge_previous_report
 
 
 log = logging.getLogger(__name__)
-plugin = Plugin(name="sast_api_springmvc", version="1")
+plugin = Plugin(name="sast_api_springmvc", version="3")
+file_filters = ".java"
+# files without any mapping are skipped before they are read
+file_prefilter = b'Mapping'
 
 
-def process_file(f_path):
+# annotations can span several lines, the arguments are parsed separately
+mapping_pattern = re.compile(pattern='^[ \t]*@(RequestMapping|PostMapping|GetMapping)\s*\(([^)]*)\)', flags=(re.I | re.M))
+named_path_pattern = re.compile(pattern='(?:^|,)\s*(?:value|path)\s*=\s*\{?\s*\"([\w\/\{\}\w\:\w\s\[\]\+\*\.\\\\-]+)\"', flags=re.I)
+# the path as the first (positional) argument: "/path" or {"/path", ...}
+positional_path_pattern = re.compile(pattern='^\s*\{?\s*\"([\w\/\{\}\w\:\w\s\[\]\+\*\.\\\\-]+)\"')
+class_pattern = re.compile(pattern='^\s*public\s+((abstract|final)\s+)*class\s', flags=(re.I | re.M))
+
+
+def process_file(f_path, buffer=None):
   # parse file contents and collect APIs
-  # detect single line annotations
-  # detect multi line annotations
+  # mappings found before the class definition are used as prefix for the subsequent mappings
   """
   Supported annotations:
     @RequestMapping("/rest/path")
@@ -40,40 +50,47 @@ def process_file(f_path):
     @RequestMapping(path="/rest/path")
     @RequestMapping(method= ,value="/rest/path", produces=)
     @PostMapping("/rest/path")
+    @RequestMapping(
+        method = RequestMethod.PUT,
+        value = "/rest/path")
   """
 
   log.debug("path: %s" % f_path)
-  api_found = False
-  inside_class = False
+  content = get_content(f_path, buffer)
+  # most files don't have any mapping at all
+  if 'Mapping' not in content:
+    return
+  class_match = class_pattern.search(content)
+  class_start = class_match.start() if class_match else len(content)
   prefix = ""
   api = API(name=f_path)
-  pattern = re.compile(pattern='^\s*(@(RequestMapping|PostMapping|GetMapping)\(\s*(.*\,\s*)*(value\s*=\s*|path\s*=\s*)?\"([\w\/\{\}\w\:\w\s\[\]\+\*\.\\\\-]+)\".*\)).*$', flags=(re.I | re.M))
-  class_pattern = re.compile(pattern='^\s*public\s*class\s*.+$', flags=(re.I | re.M))
-  with open(f_path) as file:
-    line = file.readline()
-    while line:
-      # check if we are inside the class definition or after it.
-      if not inside_class:
-        inside_class = class_pattern.match(line) != None
-      result = pattern.match(line)
-      if result:
-        # if the match happened before the class definition then it will be used as prefix for the subsequent matches.
-        if not inside_class:
-          prefix = (result.group(5) + "/").replace('//', '/')
-          line = file.readline()
-          continue
-        api_found = True
-        log.debug("API!! %s, %s", f_path, result.group(5))
-        api.add_endpoint( Endpoint( path=(prefix+result.group(5)).replace('//', '/') ))
-      line = file.readline()
+  for result in mapping_pattern.finditer(content):
+    m_path = get_mapping_path(result.group(2))
+    if m_path is None:
+      continue
+    # if the match happened before the class definition then it will be used as prefix for the subsequent matches.
+    if result.start() < class_start:
+      prefix = (m_path + "/").replace('//', '/')
+      continue
+    log.debug("API!! %s, %s", f_path, m_path)
+    api.add_endpoint( Endpoint( path=(prefix+m_path).replace('//', '/') ))
   # if there was only the root mapping we add it as a single endpoint
-  if prefix != "" and not api_found:
+  if prefix != "" and len(api.endpoints) == 0:
     api.add_endpoint( Endpoint(path=prefix))
-    api_found = True
-  if api_found:
+  if len(api.endpoints) > 0:
     return api
 
 
+def get_mapping_path(arguments):
+  # the path is either the named argument 'value' or 'path' or a string literal as first argument,
+  # other string literals (produces, consumes, headers...) are not paths
+  result = named_path_pattern.search(arguments)
+  if not result:
+    result = positional_path_pattern.match(arguments)
+  if result:
+    return result.group(1)
+  return None
+
 
 def validate_args(options, f_targets):
   if options.debug:
@@ -88,6 +105,7 @@ def validate_args(options, f_targets):
   if (options.json or options.csv) and not options.output_file and not options.print_results:
       log.error("To use --csv or --json, either the --print-results flag (to print to the console) or the --out flag (to write to a file) must be specified.")
       sys.exit(1)
+  validate_stream_options(options)
 
   if len(f_targets) < 1:
     log.error("must provide a list of directories to scan (space separated)")
@@ -96,8 +114,7 @@ def validate_args(options, f_targets):
 
 def get_options():
   parser = ArgumentParser(prog="Levelops springmvc configuration scanner.", usage="./api_discovery_springmvc.py (optional <flags>) <directory to scan>")
-  parser.add_argument('-t', '--threads', dest='threads', help='Number of threads', type=int, default=5)
-  for parser_option in default_plugin_options:
+  for parser_option in scanner_plugin_options + incremental_scan_plugin_options + streaming_plugin_options + default_plugin_options:
     parser.add_argument(*parser_option['args'], **parser_option['kwords'])
 
   return parser.parse_known_args()
@@ -149,15 +166,18 @@ if __name__ == "__main__":
   success = False
   start_time = time.time()
   try:
-    s = Scanner(queue_timeout=0.5)
-    for f_target in f_targets:
-      log.info("scanning path: %s" % f_target)
-      s.scan_directory(base_path=f_target, filters=".java", action=process_file)
+    sink = get_report_sink(options)
+    s = Scanner(thread_count=options.threads, backend=options.backend, queue_timeout=0.5, cache=get_scan_cache(options, plugin), collector=sink.emit if sink else None)
+    stale = scan_targets(scanner=s, f_targets=f_targets, filters=file_filters, action=process_file, options=options, prefilter=file_prefilter)
     s.wait_and_finish()
     success = True
-    results =  s.get_report()
-
-    handle_output(options, results)
+    if sink:
+      # already written while scanning
+      sink.close()
+      results = s.get_report()
+    else:
+      results = merge_previous_report(report=s.get_report(), options=options, stale=stale)
+      handle_output(options, results)
   except Exception as e:
     log.error("Couldn't successfully complete the scanning.", e, exc_info=True)
     results = str(e)
@@ -0,0 +1,65 @@
+import api_discovery_springmvc as springmvc
+
+
+def paths(tmp_path, content):
+  f_path = tmp_path / "Controller.java"
+  with open(f_path, 'w') as f:
+    f.write(content)
+  api = springmvc.process_file(str(f_path))
+  return sorted(e.path for e in api.endpoints) if api else None
+
+
+def test_split_annotation(tmp_path):
+  content = """public class Controller {
+  @RequestMapping(
+      method = RequestMethod.PUT,
+      value = "/items")
+  public void put() {}
+}
+"""
+  assert paths(tmp_path, content) == ["/items"]
+
+
+def test_class_prefix(tmp_path):
+  content = """@RestController
+@RequestMapping("/api/")
+public class Controller {
+  @GetMapping("/list")
+  public void list() {}
+
+  @PostMapping(value = "/add")
+  public void add() {}
+}
+"""
+  assert paths(tmp_path, content) == ["/api/add", "/api/list"]
+
+
+def test_class_prefix_only(tmp_path):
+  content = """@RequestMapping("/api")
+public class Controller {
+}
+"""
+  assert paths(tmp_path, content) == ["/api/"]
+
+
+def test_named_path_after_other_arguments(tmp_path):
+  content = """public class Controller {
+  @RequestMapping(method = RequestMethod.GET, produces = "application/json", path = "/items")
+  public void get() {}
+
+  @GetMapping(produces = {"application/json"}, value = {"/other", "/alias"})
+  public void other() {}
+}
+"""
+  assert paths(tmp_path, content) == ["/items", "/other"]
+
+
+def test_no_mappings(tmp_path):
+  content = """public class Controller {
+  @Autowired
+  private Service service;
+}
+"""
+  assert paths(tmp_path, content) is None
+  # mentions of the annotations without a path
+  assert paths(tmp_path, "import org.springframework.web.bind.annotation.RequestMapping;\npublic class Controller {\n  @RequestMapping(produces = \"text/plain\")\n  public void get() {}\n}\n") is None
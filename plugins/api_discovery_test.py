@@ -0,0 +1,61 @@
+import os
+import pickle
+
+import api_discovery_nodejs_express
+from api_discovery import Dispatcher, Collector
+from sdk.fs_processor import Scanner, ScanCache
+from sdk.types import Report
+
+
+def write(f_path, content):
+  os.makedirs(os.path.dirname(str(f_path)), exist_ok=True)
+  with open(f_path, 'w') as f:
+    f.write(content)
+
+
+def create_project(base_path):
+  write(base_path / "app.py", "@app.route('/login', methods=['GET', 'POST'])\ndef login():\n  pass\n")
+  write(base_path / "other.py", "print('nothing')\n")
+  write(base_path / "web" / "index.js", "var express = require('express');\nvar app = express();\napp.get('/home', function(req, res) {});\napp.use('/users', require('./users'));\n")
+  write(base_path / "web" / "users.js", "var express = require('express');\nvar router = express.Router();\nrouter.get('/list', function(req, res) {});\n")
+
+
+def scan(base_path, backend, names, cache=None):
+  # the express resources are module state of the collecting process
+  api_discovery_nodejs_express.resources.clear()
+  dispatcher = Dispatcher(names=names)
+  collector = Collector(report=Report(), names=names)
+  scanner = Scanner(thread_count=2, backend=backend, default_exclusions=[], collector=collector, cache=cache)
+  scanner.scan_directory(base_path=str(base_path), filters=dispatcher.get_filters(), action=dispatcher, prefilter=dispatcher.get_prefilter())
+  scanner.wait_and_finish()
+  collector.finish()
+  return sorted((os.path.relpath(api.name, str(base_path)), api.extractor, sorted(e.path for e in api.endpoints)) for api in collector.report.apis if api.endpoints)
+
+
+def test_dispatcher_pickle():
+  dispatcher = Dispatcher(names=["flask", "nodejs_express"])
+  dispatcher.get_extractors()
+  copy = pickle.loads(pickle.dumps(dispatcher))
+  assert copy.names == ["flask", "nodejs_express"]
+  assert [name for name, suffixes, prefilter, action in copy.get_extractors()] == ["sast_api_flask", "sast_api_express"]
+
+
+def test_process_backend(tmp_path):
+  create_project(tmp_path)
+  names = ["flask", "nodejs_express"]
+  expected = scan(tmp_path, 'thread', names)
+  assert ("app.py", "sast_api_flask", ["/login"]) in expected
+  assert ("web/users.js", "sast_api_express", ["/list"]) in expected
+  assert any(name == "web/index.js" and paths[0].endswith("/users/list") for name, extractor, paths in expected)
+  # the express resources are found in the worker processes and bundled in this one
+  assert scan(tmp_path, 'process', names) == expected
+
+
+def test_process_backend_cache(tmp_path):
+  create_project(tmp_path / "src")
+  names = ["flask"]
+  location = str(tmp_path / "cache.db")
+  first = scan(tmp_path / "src", 'process', names, cache=ScanCache(location=location, plugin=Dispatcher(names).get_cache_plugin()))
+  cache = ScanCache(location=location, plugin=Dispatcher(names).get_cache_plugin())
+  assert scan(tmp_path / "src", 'process', names, cache=cache) == first
+  assert cache.misses == 0 and cache.hits == 2
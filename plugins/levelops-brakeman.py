@@ -22,10 +22,11 @@ from re import compile, I, M
 from shutil import copyfile, copy
 from ujson import load
 from argparse import ArgumentParser
+from concurrent.futures import as_completed
 
 from sdk.fs_processor import Scanner
 from sdk.wrapper import ToolRunner
-from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options
+from sdk.plugins import Runner, Plugin, labels_parser, default_plugin_options, tool_runner_plugin_options
 
 
 log = logging.getLogger(__name__)
@@ -111,6 +112,8 @@ def validate_args(options, f_targets):
   if options.docker and options.gem:
     log.error("Only one excecution mode can be specified per invocation (--docker or --gem).")
     sys.exit(1)
+  if options.reuse_container and not options.docker:
+    log.warning("--reuse-container is only used in docker mode, ignoring it.")
 
   if len(f_targets) < 1:
     log.error("must provide a list of directories to scan (space separated)")
@@ -124,7 +127,7 @@ def get_options():
   parser.add_argument('--html', dest='html', help='If present, the output of the script will be in html format.', action='store_true')
   parser.add_argument('--table', dest='table', help='If present, the output of the script will be in table format.', action='store_true')
   parser.add_argument('--markdown', dest='markdown', help='If present, the output of the script will be in markdown format.', action='store_true')
-  for parser_option in default_plugin_options:
+  for parser_option in tool_runner_plugin_options + default_plugin_options:
     parser.add_argument(*parser_option['args'], **parser_option['kwords'])
 
   return parser.parse_known_args()
@@ -148,6 +151,15 @@ def get_work_dirs(options):
   return output_location, reports_base
 
 
+def submit_project_results(runner, options, report, elapsed_time):
+  """ Queues the results of every project in the report to be submitted in the background. """
+  labels = options.labels if options.labels and type(options.labels) == dict else {}
+  for project_name in report:
+    project_labels = dict(labels)
+    project_labels.update({'project_name': [project_name]})
+    runner.submit_async(success=True, results=report[project_name], product_id=options.product, token=options.token, plugin=plugin, elapsed_time=elapsed_time, labels=project_labels, tags=options.tags)
+
+
 def get_results_report(p_names, tmp_locations):
   report = {}
   for location in tmp_locations:
@@ -185,29 +197,53 @@ if __name__ == "__main__":
     brakeman_output_dir = reports_tmp
     output_files = get_output_files(brakeman_output_dir, formats)
     params = {"output_files":output_files} 
-  if options.docker:
-    cmd = 'bash -c "docker run --rm -v {base_path}:/code {reports_volume} --user $(id -u):$(id -g) presidentbeef/brakeman --quiet {output_files}"'
+  if options.docker and not options.reuse_container:
+    cmd = 'bash -c "docker run --rm {docker_limits} -v {base_path}:/code {reports_volume} --user $(id -u):$(id -g) presidentbeef/brakeman --quiet {output_files}"'
     brakeman_output_dir = "/reports"
     output_files = get_output_files(brakeman_output_dir, formats)
     params = {"reports_volume": reports_volume, "output_files":output_files}
+  if options.docker and options.reuse_container:
+    # all the scans run in the same container (started below) with the targets mounted in it
+    cmd = 'docker exec -w {container_path} {container} {entrypoint} --quiet {output_files}'
+    if "{base_path}" in reports_tmp:
+      # the reports are written inside of the (mounted) targets
+      brakeman_output_dir = reports_tmp.replace("{base_path}", "{container_path}")
+      container_volumes = []
+    else:
+      brakeman_output_dir = "/reports"
+      container_volumes = ["{reports_tmp}:/reports".format(reports_tmp=os.path.abspath(reports_tmp))]
+    output_files = get_output_files(brakeman_output_dir, formats)
+    params = {"output_files":output_files}
 
 
   success = False
   runner = Runner(base_url=options.endpoint)
   start_time = time.time()
   p_names = set()
+  results = {}
   try:
-    with ToolRunner(command=cmd, max_concurrent=3, error_codes=set([1,126, 127, 128, 130, 137, 139, 143])) as s:
+    memory_limit = options.memory_limit * 1024 * 1024 if options.memory_limit else None
+    with ToolRunner(command=cmd, max_concurrent=options.max_concurrent, error_codes=set([1,126, 127, 128, 130, 137, 139, 143]), cpu_limit=options.cpu_limit, memory_limit=memory_limit, docker=options.docker, cpus=options.cpus) as s:
+      if options.docker and options.reuse_container:
+        if container_volumes:
+          os.makedirs(reports_tmp, exist_ok=True)
+        s.start_container(image="presidentbeef/brakeman", targets=f_targets, volumes=container_volumes, user="%s:%s" % (os.getuid(), os.getgid()))
+      scans = []
       for f_target in f_targets:
         log.info("scanning path: %s" % f_target)
-        project_name, out, errors = s.scan_directory(base_path=f_target, params=params, tmp_location=reports_tmp)
+        scans.append(s.submit(base_path=f_target, params=params, tmp_location=reports_tmp))
+      for scan in as_completed(scans):
+        project_name, out, errors = scan.result()
         p_names.add(project_name)
+        if options.submit and s.is_success(project_name):
+          # submitted in the background while the next targets are scanned
+          submit_project_results(runner, options, get_results_report(set([project_name]), s.get_tmp_locations()), elapsed_time=(time.time() - start_time))
       s.wait_and_finish()
       success = s.are_all_successes()
       if success: 
-        if options.submit:
-          results = get_results_report(p_names, s.get_tmp_locations())
         handle_output(formats, outputs, output_location, s.get_tmp_locations())
+      else:
+        results = "Couldn't successfully scan all the targets: %s" % "; ".join(s.errors)
   except Exception as e:
     message = "Couldn't successfully complete the scanning: %s", e
     log.error(message, exc_info=True)
@@ -220,15 +256,11 @@ if __name__ == "__main__":
   finally:
     end_time = time.time()
     if options.submit:
-      # post success or failure to levelopsfor key in results:
+      # the results of the projects were already queued, post the failure (if any) and wait for the pending submissions
       labels = options.labels if options.labels and type(options.labels) == dict else {}
       if type(results) is not dict:
         runner.submit(success=success, results={"output": results}, product_id=options.product, token=options.token, plugin=plugin, elapsed_time=(end_time - start_time), labels=labels, tags=options.tags)
-      else:
-        for key in results:
-          result = results[key]
-          labels.update({'project_name': [key]})
-          runner.submit(success=success, results=result, product_id=options.product, token=options.token, plugin=plugin, elapsed_time=(end_time - start_time), labels=labels, tags=options.tags)
+      runner.drain()
   if success:
     sys.exit(0)
   else:
@@ -12,16 +12,25 @@ import logging
 import os
 import shlex
 import subprocess
+import sys
+import inspect
 from argparse import ArgumentParser
-from queue import Empty, Queue
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from sys import exit
-from threading import Thread
-from time import sleep
+from threading import BoundedSemaphore, Condition, Lock, local
+from time import time, sleep
 from uuid import uuid4
 from io import StringIO
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
 
 from kubernetes import client as k_client
-from kubernetes import config as k_config
 from kubernetes.client.configuration import Configuration
 from kubernetes.client.rest import ApiException
 try:
@@ -34,14 +43,14 @@ except:
     from json import dumps
     from json import load as jload
     from json import loads
-from yaml import dump as ydump
-from yaml import dump_all, full_load, full_load_all
+from base64 import b64decode
+
+from sdk.plugins import RETRY_STATUS_CODES, get_retry_delay
 
 log = logging.getLogger(__name__)
 excluded_namespaces = ['kube-system']
+excluded_namespaces_selector = ",".join(["metadata.namespace!=%s" % x for x in excluded_namespaces])
 cleanup = []
-p_pool = []
-r_pool = []
 backup = {}
 SUCCESS = 0
 
@@ -82,13 +91,108 @@ items = [
     # ["resource-manager", "folders"]
     ]
 
+# REST list calls that replace the gcloud commands of the items above, a single (paginated) call per project lists the
+# resources of every location: (url, key of the resources in the response, key inside of every scope for aggregated lists).
+# The items without a mapping (the location/region is mandatory or there is no aggregated list) still use the gcloud cli.
+rest_apis = {
+    ("filestore", "instances"): ("https://file.googleapis.com/v1/projects/{project}/locations/-/instances", "instances", None),
+    ("pubsub", "topics"): ("https://pubsub.googleapis.com/v1/projects/{project}/topics", "topics", None),
+    ("bigtable", "instances"): ("https://bigtableadmin.googleapis.com/v2/projects/{project}/instances", "instances", None),
+    ("bigtable", "clusters"): ("https://bigtableadmin.googleapis.com/v2/projects/{project}/instances/-/clusters", "clusters", None),
+    ("compute", "backend-services"): ("https://compute.googleapis.com/compute/v1/projects/{project}/aggregated/backendServices", "items", "backendServices"),
+    ("dataflow", "jobs"): ("https://dataflow.googleapis.com/v1b3/projects/{project}/jobs:aggregated", "jobs", None),
+    ("deployment-manager", "deployments"): ("https://deploymentmanager.googleapis.com/deploymentmanager/v2/projects/{project}/global/deployments", "deployments", None),
+    ("redis", "instances"): ("https://redis.googleapis.com/v1/projects/{project}/locations/-/instances", "instances", None),
+    ("sql", "instances"): ("https://sqladmin.googleapis.com/sql/v1beta4/projects/{project}/instances", "items", None)
+}
+clusters_api = ("https://container.googleapis.com/v1/projects/{project}/locations/-/clusters", "clusters", None)
+services_api = ("https://serviceusage.googleapis.com/v1/projects/{project}/services?filter=state:ENABLED", "services", None)
+# k8s resources listed per cluster and their kind (the items of the list responses don't have it)
+set_names = [
+    "list_deployment_for_all_namespaces", 
+    "list_replica_set_for_all_namespaces", 
+    "list_daemon_set_for_all_namespaces", 
+    "list_stateful_set_for_all_namespaces",
+    "list_service_for_all_namespaces"
+    ]
+set_kinds = {
+    "list_deployment_for_all_namespaces": "Deployment",
+    "list_replica_set_for_all_namespaces": "ReplicaSet",
+    "list_daemon_set_for_all_namespaces": "DaemonSet",
+    "list_stateful_set_for_all_namespaces": "StatefulSet",
+    "list_service_for_all_namespaces": "Service"
+}
+# objects per page of the k8s list calls
+K8S_PAGE_SIZE = 500
+# families of tasks, every family has its own threads
+PROJECTS = "project"
+SERVICES = "service"
+K8S = "k8s"
+# the token is refreshed when it is about to expire (seconds)
+TOKEN_EXPIRY_MARGIN = 60
+# (connect, read) timeouts in seconds and retries of the GCP REST calls
+GOOGLE_API_TIMEOUT = (10, 60)
+GOOGLE_API_RETRIES = 3
+# tasks of a family that can be submitted and not finished (queued or running), per thread of the family
+SCHEDULER_BACKLOG = 2
+
+
+class Scheduler(object):
+    """ Runs the tasks in a bounded thread pool per family of APIs (projects, gcp services, k8s clusters) so one family
+    can't take all the threads. At most SCHEDULER_BACKLOG tasks per thread of a family are queued or running, 'submit'
+    blocks until one of them is done (so the queues don't grow with the number of projects and clusters).
+    The tasks of a family can submit tasks of other families (ex: the projects submit the services and the clusters),
+    those only wait for tasks that don't submit anything. The tasks submitted from a task of the same family don't wait
+    (it could be waiting for itself). 'wait' returns as soon as every task (including the ones submitted by other tasks) is done.
+    """
+    def __init__(self, limits):
+        self.executors = {family: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=family) for family, limit in limits.items()}
+        self.slots = {family: BoundedSemaphore(limit * SCHEDULER_BACKLOG) for family, limit in limits.items()}
+        self.condition = Condition()
+        self.pending = 0
+        # family of the task running in the current thread
+        self.current = local()
+
+    def submit(self, family, action, **kwargs):
+        slots = self.slots[family]
+        acquired = slots.acquire(blocking=getattr(self.current, 'family', None) != family)
+        with self.condition:
+            self.pending += 1
+        try:
+            future = self.executors[family].submit(self._run, family, action, kwargs)
+        except:
+            self._done()
+            if acquired:
+                slots.release()
+            raise
+        if acquired:
+            future.add_done_callback(lambda f: slots.release())
+        return future
+
+    def _run(self, family, action, kwargs):
+        self.current.family = family
+        try:
+            action(**kwargs)
+        except Exception as e:
+            log.error("Task failed", exc_info=True)
+        finally:
+            self.current.family = None
+            self._done()
 
-class Control(object):
-  def __init__(self):
-    self.terminate = False
+    def _done(self):
+        with self.condition:
+            self.pending -= 1
+            if self.pending == 0:
+                self.condition.notify_all()
 
-  def stop(self):
-    self.terminate = True
+    def wait(self):
+        with self.condition:
+            while self.pending > 0:
+                self.condition.wait()
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown()
 
 
 class Report(object):
@@ -113,6 +217,162 @@ class Report(object):
         self.errors.append(error)
 
 
+class ApiError(Exception):
+    def __init__(self, url, status_code, message):
+        super().__init__("%s - %s: %s" % (url, status_code, message))
+        self.status_code = status_code
+
+
+class GoogleCredentials(object):
+    """ The access token of the gcloud user (gcloud config config-helper), kept in memory and refreshed when it expires. """
+    def __init__(self):
+        self.lock = Lock()
+        self.token = None
+        self.expiry = 0
+
+    def get_token(self, refresh=False):
+        with self.lock:
+            if refresh or not self.token or self.expiry - time() < TOKEN_EXPIRY_MARGIN:
+                self.token, self.expiry = _get_access_token()
+            return self.token
+
+
+class GoogleSession(object):
+    """ Authenticated http session for the GCP REST APIs, shared by all the workers (the connections are pooled and kept alive).
+    The calls are retried on connection errors, timeouts and 429/5xx responses, same as the submissions of the Runner
+    (the wait doubles every time starting at 'backoff' seconds unless the server sends a Retry-After).
+    """
+    def __init__(self, credentials, pool_size=10, timeout=GOOGLE_API_TIMEOUT, retries=GOOGLE_API_RETRIES, backoff=1):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=len(rest_apis) + 2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_token(self, refresh=False):
+        return self.credentials.get_token(refresh=refresh)
+
+    def list(self, url, key, scoped_key=None):
+        """ Yields the resources of every page of a list call. """
+        params = {}
+        while True:
+            data = self.get(url, params=params)
+            resources = data.get(key) or []
+            if scoped_key:
+                # aggregated list: {key: {<scope>: {scoped_key: [...]}}}
+                for scope in resources.values():
+                    yield from scope.get(scoped_key, [])
+            else:
+                yield from resources
+            if not data.get('nextPageToken'):
+                break
+            params['pageToken'] = data['nextPageToken']
+
+    def get(self, url, params=None):
+        attempt = 0
+        refresh = False
+        refreshed = False
+        while True:
+            try:
+                response = self.session.get(url, params=params, headers={"Authorization": "Bearer " + self.get_token(refresh=refresh)}, timeout=self.timeout)
+            except (ConnectionError, Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = get_retry_delay(attempt, self.backoff)
+                log.warning("Request to '%s' failed (%s), retrying in %s seconds...", url, e, delay)
+            else:
+                refresh = False
+                if response.status_code == 401 and not refreshed:
+                    # revoked or expired before time, tried again right away with a new token
+                    refresh = refreshed = True
+                    continue
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    break
+                delay = get_retry_delay(attempt, self.backoff, response)
+                log.warning("Request to '%s' returned %s, retrying in %s seconds...", url, response.status_code, delay)
+            sleep(delay)
+            attempt += 1
+        if response.status_code != 200:
+            raise ApiError(url=url, status_code=response.status_code, message=response.text)
+        return loads(response.text)
+
+    def close(self):
+        self.session.close()
+
+
+def _get_access_token():
+    """ Returns the access token of the current gcloud user and its expiration (epoch seconds). """
+    p_credentials = subprocess.run(args=shlex.split("gcloud config config-helper --format=json"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if p_credentials.returncode != SUCCESS:
+        raise Exception("Coudn't get the google credentials for the current user: %s" % p_credentials.stderr)
+    credential = loads(p_credentials.stdout)['credential']
+    expiry = datetime.strptime(credential['token_expiry'], '%Y-%m-%dT%H:%M:%SZ')
+    return credential['access_token'], (expiry - datetime(1970, 1, 1)).total_seconds()
+
+
+class K8sClients(object):
+    """ The kubernetes api clients of the clusters, created once per (project, zone, cluster) and shared by all the calls
+    to the cluster (one connection pool per cluster). The clients are built from the endpoint and the CA of the cluster
+    (no kubeconfig / get-credentials) and get the current google token every time they are used.
+    The list calls of all the clusters run in 'executor', at most max_requests at the same time.
+    """
+    def __init__(self, credentials, max_requests=10):
+        self.credentials = credentials
+        self.lock = Lock()
+        self.clients = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_requests, thread_name_prefix="k8s_list")
+
+    def close(self):
+        self.executor.shutdown()
+
+    def get(self, project, cluster):
+        """ Returns (CoreV1Api, AppsV1Api) for the cluster. """
+        key = (project.name, cluster.zone, cluster.name)
+        with self.lock:
+            clients = self.clients.get(key)
+            if not clients:
+                clients = self._create(cluster)
+                self.clients[key] = clients
+        configuration, core, apps = clients
+        # new dict, the configurations share the api_key dict of the default configuration
+        configuration.api_key = {"authorization": self.credentials.get_token()}
+        return core, apps
+
+    def _create(self, cluster):
+        if not cluster._endpoint or not cluster._ca_certificate:
+            raise Exception("The endpoint or the CA certificate of the cluster '%s' are not available" % cluster.name)
+        ca_file = "/tmp/%s.crt" % str(uuid4())
+        cleanup.append(ca_file)
+        with open(ca_file, 'wb') as f:
+            f.write(b64decode(cluster._ca_certificate))
+        configuration = Configuration()
+        configuration.host = "https://%s" % cluster._endpoint
+        configuration.ssl_ca_cert = ca_file
+        configuration.api_key_prefix = {"authorization": "Bearer"}
+        # enough connections for the list calls of the cluster running at the same time
+        configuration.connection_pool_maxsize = len(set_names)
+        api_client = k_client.ApiClient(configuration=configuration)
+        return configuration, k_client.CoreV1Api(api_client=api_client), k_client.AppsV1Api(api_client=api_client)
+
+
+def get_services(session):
+    """ The services listed for every project: REST calls (one per api, not per region) if there is a session, gcloud commands otherwise. """
+    services = []
+    rest = set()
+    for item in items:
+        key = (item[0], item[1])
+        if session and key in rest_apis:
+            if key not in rest:
+                rest.add(key)
+                services.append({'action': process_gcp_rest_service, 'service': key})
+        else:
+            services.append({'action': process_gcp_service, 'service': item})
+    return services
+
+
 class Resource(object):
     def __init__(self, r_id, name, state=None):
         self.id = r_id
@@ -199,9 +459,12 @@ class KComponent(Resource):
 
 
 class KCluster(Resource):
-    def __init__(self, r_id, name, state, zone, location=None, locations=None, creation_time=None, masters_version=None, nodes_version=None, initial_version=None, resources=None):
+    def __init__(self, r_id, name, state, zone, location=None, locations=None, creation_time=None, masters_version=None, nodes_version=None, initial_version=None, resources=None, endpoint=None, ca_certificate=None):
         super().__init__(r_id=r_id, name=name, state=state)
         self.zone = zone
+        # used to connect to the cluster, not part of the report
+        self._endpoint = endpoint
+        self._ca_certificate = ca_certificate
         self.location = location
         self.locations = locations
         self.creation_time = creation_time
@@ -240,44 +503,35 @@ def _change_apis(apis, project, state):
 
 
 def get_google_credentials(report):
-    config_file = "/tmp/%s.google" % str(uuid4())
-    log.info("google credentials: %s", config_file)
-    p_credentials = subprocess.run(args=shlex.split("gcloud config config-helper --format=json"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    cleanup.append(config_file)
-    if p_credentials.returncode != SUCCESS:
+    """ Returns the credentials of the current user, the token is fetched once and kept in memory (None if it can't be fetched). """
+    credentials = GoogleCredentials()
+    try:
+        credentials.get_token()
+    except Exception as e:
         message = "Coudn't get the google credentials for the current user."
         report.add_error(message)
-        log.debug(message)
-        return None
-    with open(config_file,'w') as f:
-        f.write(p_credentials.stdout)
-    return config_file
-
-
-def get_cluster_credentials(report, project, zone, cluster_name):
-    config_file = "/tmp/%s.config" % str(uuid4())
-    log.info("k8s config file: %s", config_file)
-    env = {}
-    env.update(os.environ)
-    env['KUBECONFIG'] = config_file
-    p_credentials = subprocess.run(args=["gcloud", "container", "clusters", "get-credentials", cluster_name, "--zone", zone, "--project", project.name, "--quiet"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    cleanup.append(config_file)
-    if p_credentials.returncode != SUCCESS:
-        message = "[%s] Coudn't get the cluster credentials for the cluster '%s': %s" % (project.name, cluster_name, p_credentials.stderr)
-        report.add_error(message)
-        log.debug(message)
+        log.debug("%s %s", message, e)
         return None
-    return config_file
+    return credentials
 
 
-def get_k8s_clusters(report, project):
-    p_clusters = subprocess.run(args=["gcloud", "container", "clusters", "list", "--project", project.name, "--format", "json", "--quiet"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    if p_clusters.returncode != SUCCESS:
-        message = "[%s] %s" % (project.name, p_clusters.stderr)
-        report.add_error(message)
-        log.debug(message)
-        return None
-    clusters = loads(p_clusters.stdout)
+def get_k8s_clusters(report, project, session=None):
+    if session:
+        try:
+            clusters = list(session.list(clusters_api[0].format(project=project.name), clusters_api[1]))
+        except ApiError as e:
+            message = "[%s] %s" % (project.name, e)
+            report.add_error(message)
+            log.debug(message)
+            return None
+    else:
+        p_clusters = subprocess.run(args=["gcloud", "container", "clusters", "list", "--project", project.name, "--format", "json", "--quiet"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if p_clusters.returncode != SUCCESS:
+            message = "[%s] %s" % (project.name, p_clusters.stderr)
+            report.add_error(message)
+            log.debug(message)
+            return None
+        clusters = loads(p_clusters.stdout)
     project.k8s_total_count = len(clusters)
     k8s = []
     for cluster in clusters:
@@ -292,100 +546,96 @@ def get_k8s_clusters(report, project):
                 nodes_version=cluster['currentNodeVersion'],
                 initial_version=cluster['initialClusterVersion'],
                 r_id=cluster['labelFingerprint'],
-                creation_time=cluster['createTime']
+                creation_time=cluster['createTime'],
+                endpoint=cluster.get('endpoint'),
+                ca_certificate=cluster.get('masterAuth', {}).get('clusterCaCertificate')
             )
         )
     return k8s
 
 
-def get_k8s_resources(report, cluster, project):
-    config_file = get_cluster_credentials(report=report, project=project, zone=cluster.zone, cluster_name=cluster.name)
-    if not config_file:
-        return None
-    with open(g_credentials, 'r') as f:
-        google = jload(f)
-    with open(config_file, 'r') as f:
-        kcfg = full_load(f)
-    for user in kcfg.get('users'):
-        config = user.get('user').get('auth-provider').get('config')
-        config['expiry'] = google['credential']['token_expiry']
-        config['access-token'] = google['credential']['access_token']
-    with open(config_file, 'w') as f:
-        ydump(kcfg, f)
-    configuration = Configuration()
-    k_config.load_kube_config(config_file=config_file, client_configuration=configuration)
-    api_client = k_client.ApiClient(configuration=configuration)
-    k = k_client.CoreV1Api(api_client=api_client)
-    apps = k_client.AppsV1Api(api_client=api_client)
+def get_k8s_resources(report, cluster, project, clients):
+    k, apps = clients.get(project=project, cluster=cluster)
 
-    resources = []
-    set_names = [
-        "list_deployment_for_all_namespaces", 
-        "list_replica_set_for_all_namespaces", 
-        "list_daemon_set_for_all_namespaces", 
-        "list_stateful_set_for_all_namespaces",
-        "list_service_for_all_namespaces"
-        ]
+    # the list calls of the cluster run at the same time (in the pool shared by all the clusters)
+    sets = []
     for set_name in set_names:
         if set_name.startswith("list_service"):
-            k_set = getattr(k, set_name)()
+            list_call = getattr(k, set_name)
         else:
-            k_set = getattr(apps, set_name)()
-        collection = {}
-        for s in k_set.items:
-            if s.metadata.namespace in excluded_namespaces:
-                log.debug("Skipping resource since it is located in the excluded namespace '%s'", s.metadata.namespace)
-                continue
-            if s.kind:
-                kind = s.kind
-            elif 'deployment' in str(type(s)).lower():
-                kind = "Deployment"
-            elif 'service' in str(type(s)).lower():
-                kind = "Service"
-            elif 'replicaset' in str(type(s)).lower():
-                kind = "ReplicaSet"
-            elif 'daemonset' in str(type(s)).lower():
-                kind = "DaemonSet"
-            elif 'statefulset' in str(type(s)).lower():
-                kind = "StatefulSet"
-            s_type = None
-            ports = None
-            selectors = None
-            meta = None
-            containers = None
-            if kind == "Service":
-                s_type = s.spec.type
-                ports = [{'protocol': port.protocol, 'target': port.target_port, 'port': port.port} for port in s.spec.ports]
-                selectors = s.spec.selector
-                if s_type == 'ExternalName':
-                    meta = {"external_ip": s.spec.externalIPs}
-            elif kind == "Deployment":
-                containers = [x.image for x in s.spec.template.spec.containers]
-            else:
-                containers = [x.image for x in s.spec.template.spec.containers]
-            if kind == "Deployment" or kind == "Service" or not s.metadata.labels:
-                _id = s.metadata.self_link
-            else:
-                _id = s.metadata.self_link.replace('-'+s.metadata.labels.get('pod-template-hash',''),'')
-            version = int(s.metadata.resource_version)
-            ref = collection.get(_id, {"version": -1, "resource": None})
-            if ref['version'] < version:
-                collection[_id] = {"version": version, "resource": KComponent(
-                                                r_id=s.metadata.name, 
-                                                name=s.metadata.name, 
-                                                namespace=s.metadata.namespace, 
-                                                kind=kind, 
-                                                labels=s.metadata.labels, 
-                                                containers=containers, 
-                                                ports=ports,
-                                                selectors=selectors,
-                                                subtype=s_type,
-                                                meta=meta)}
-        for _id in collection:
-            resources.append(collection[_id]["resource"])
+            list_call = getattr(apps, set_name)
+        sets.append(clients.executor.submit(get_k8s_set, list_call=list_call, kind=set_kinds[set_name]))
+    resources = []
+    for k_set in sets:
+        resources.extend(k_set.result())
     return resources
 
 
+def get_k8s_set(list_call, kind):
+    """ Returns the resources of a list call, only the latest version (resource_version) of every resource. """
+    collection = {}
+    for s in list_k8s_objects(list_call):
+        metadata = s['metadata']
+        namespace = metadata.get('namespace')
+        if namespace in excluded_namespaces:
+            log.debug("Skipping resource since it is located in the excluded namespace '%s'", namespace)
+            continue
+        spec = s.get('spec') or {}
+        s_type = None
+        ports = None
+        selectors = None
+        meta = None
+        containers = None
+        if kind == "Service":
+            s_type = spec.get('type')
+            ports = [{'protocol': port.get('protocol'), 'target': port.get('targetPort'), 'port': port.get('port')} for port in spec.get('ports') or []]
+            selectors = spec.get('selector')
+            if s_type == 'ExternalName':
+                meta = {"external_ip": spec.get('externalIPs')}
+        else:
+            containers = [x.get('image') for x in spec['template']['spec']['containers']]
+        labels = metadata.get('labels')
+        # selfLink is not set by the newer api servers
+        _id = metadata.get('selfLink') or "%s/%s/%s" % (kind, namespace, metadata['name'])
+        if kind != "Deployment" and kind != "Service" and labels and labels.get('pod-template-hash'):
+            _id = _id.replace('-'+labels['pod-template-hash'],'')
+        version = int(metadata['resourceVersion'])
+        ref = collection.get(_id, {"version": -1, "resource": None})
+        if ref['version'] < version:
+            collection[_id] = {"version": version, "resource": KComponent(
+                                            r_id=metadata['name'], 
+                                            name=metadata['name'], 
+                                            namespace=namespace, 
+                                            kind=kind, 
+                                            labels=labels, 
+                                            containers=containers, 
+                                            ports=ports,
+                                            selectors=selectors,
+                                            subtype=s_type,
+                                            meta=meta)}
+    return [collection[_id]["resource"] for _id in collection]
+
+
+def list_k8s_objects(list_call, page_size=K8S_PAGE_SIZE):
+    """ Yields the objects of a list call page by page (limit/continue). The excluded namespaces are filtered by the server
+    and the responses are parsed as plain json (dicts) instead of building the client models.
+    """
+    _continue = None
+    while True:
+        kwargs = {"limit": page_size, "field_selector": excluded_namespaces_selector, "_preload_content": False}
+        if _continue:
+            kwargs["_continue"] = _continue
+        response = list_call(**kwargs)
+        try:
+            data = loads(response.data)
+        finally:
+            response.release_conn()
+        yield from data.get('items') or []
+        _continue = (data.get('metadata') or {}).get('continue')
+        if not _continue:
+            break
+
+
 def restore_permisions(backup_file):
     with open(backup_file, 'r') as f:
         backup = jload(f)
@@ -393,40 +643,10 @@ def restore_permisions(backup_file):
     # disable apis that should not be enabled
 
 
-def __boot(name, thread_count, thread_queue_size, pool, control, report, timeout=2):
-    queue = Queue(maxsize=thread_count*thread_queue_size)
-    for i in range(0, thread_count):
-        t = Thread(name=name+"-"+str(i), daemon=True, target=_worker, args=(queue, report, control, timeout))
-        t.start()
-        pool.append(t)
-    return queue
-
-
-def _worker(queue, report, control, timeout=2):
-    log.debug('Starting...')
-    while not control.terminate:
-      try:
-        task = queue.get(block=True, timeout=timeout)
-      except Empty as e:
-        log.debug('Empty response from the queue, will try again...')
-        continue
-      log.debug('Task acquried!')
-      try:
-        action = task.get('action')
-        task.pop('action')
-        # params = 
-        action(**task)
-      except Exception as e:
-        log.error("Task failed", exc_info=True)
-      finally:
-        queue.task_done()
-    log.debug("Stopping....")
-
-
-def process_k8_cluster(cluster, project, report):
+def process_k8_cluster(cluster, project, report, clients):
     log.info("Processing '%s' k8s cluster.", cluster.name)
     try:
-        resources = get_k8s_resources(report=report, cluster=cluster, project=project)
+        resources = get_k8s_resources(report=report, cluster=cluster, project=project, clients=clients)
         cluster.add_resources(resources=resources)
     except Exception as e:
         log.error(e, exc_info=True)
@@ -449,35 +669,63 @@ def process_gcp_service(service, project, report):
             log.debug('')
             return
         resources = loads(p_resources.stdout)
-        for r in resources:
-            if 'databaseVersion' in r:
-                resource = {"type": service[0], "kind": r.get('kind', service[1]), "name": r['name'], "database_version": r['databaseVersion']}
-            else:
-                resource = {"type": service[0], "kind": r.get('kind', service[1]), "name": r['name']}
-            # resource = Resource(r_id=r['name'],name=r['name'])
-            project.add_paas(resource)
-            # print("[%s] %s: %s" % (project.name,service[0],resource))
+        add_paas_resources(service=service, project=project, resources=resources)
+    except Exception as e:
+        log.error(e, exc_info=True)
+        report.add_error("[%s - %s] %s" % (project.name, service[0], str(e)))
+
+
+def process_gcp_rest_service(service, project, report, session):
+    log.info("Processing '%s' gcp service.", service[0])
+    url, key, scoped_key = rest_apis[service]
+    try:
+        add_paas_resources(service=service, project=project, resources=session.list(url.format(project=project.name), key, scoped_key))
+    except ApiError as e:
+        # same as the gcloud errors (ex: the api is not enabled in the project)
+        report.add_error("[%s - %s] %s" % (project.name, service[0], str(e)))
+        log.debug('[%s - %s] Skipping due to an error in the response: %s', project.name, service[0], e)
     except Exception as e:
         log.error(e, exc_info=True)
         report.add_error("[%s - %s] %s" % (project.name, service[0], str(e)))
 
 
-def process_project(project, report, queue):
+def add_paas_resources(service, project, resources):
+    for r in resources:
+        if 'databaseVersion' in r:
+            resource = {"type": service[0], "kind": r.get('kind', service[1]), "name": r['name'], "database_version": r['databaseVersion']}
+        else:
+            resource = {"type": service[0], "kind": r.get('kind', service[1]), "name": r['name']}
+        # resource = Resource(r_id=r['name'],name=r['name'])
+        project.add_paas(resource)
+        # print("[%s] %s: %s" % (project.name,service[0],resource))
+
+
+def process_project(project, report, scheduler, session=None, k8s_clients=None):
     log.info("Processing Project: %s", project.name)
-    for item in items:
-        queue.put({'action': process_gcp_service, 'service': item, 'project': project, 'report': report})
+    for service in get_services(session):
+        task = {'project': project, 'report': report}
+        task.update(service)
+        if service['action'] is process_gcp_rest_service:
+            task['session'] = session
+        scheduler.submit(SERVICES, **task)
     try:
-        clusters = get_k8s_clusters(report=report, project=project)
+        clusters = get_k8s_clusters(report=report, project=project, session=session)
         if clusters:
             project.add_all_k8s_clusters(clusters=clusters)
             for cluster in clusters:
-                queue.put({'action': process_k8_cluster, 'cluster': cluster, 'project': project, 'report': report})
+                if not k8s_clients:
+                    report.add_error("[%s] Skipping the k8s cluster '%s', there are no google credentials." % (project.name, cluster.name))
+                    continue
+                scheduler.submit(K8S, action=process_k8_cluster, cluster=cluster, project=project, report=report, clients=k8s_clients)
     except Exception as e:
         log.error(e, exc_info=True)
         report.add_error('[project] %s' % str(e))
     try:
-        p_services_available = subprocess.run(args=["gcloud", "services", "list", "--enabled", "--project", project.name, "--format", "json", "--quiet"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        s_available = loads(p_services_available.stdout)
+        if session:
+            s_available = session.list(services_api[0].format(project=project.name), services_api[1])
+        else:
+            p_services_available = subprocess.run(args=["gcloud", "services", "list", "--enabled", "--project", project.name, "--format", "json", "--quiet"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            s_available = loads(p_services_available.stdout)
         for service in s_available:
             meta = {}
             project.add_api(Service(r_id=service['config']['name'],name=service['config']['title'],state=service['state'],meta=meta))
@@ -486,25 +734,6 @@ def process_project(project, report, queue):
         report.add_error('[project] %s' % str(e))
 
 
-def wait_and_stop(name, queue, control, pool):
-    attempt = 0
-    while not queue.empty() or attempt < 2:
-      log.info('Waiting for the %s queue to be empty', name)
-      sleep(1)
-      if queue.empty():
-        attempt += 1
-    control.stop()
-    waiting_for_threads = True
-    while waiting_for_threads:
-      for t in pool:
-        waiting_for_threads = t.isAlive()
-        if waiting_for_threads:
-          log.info("Waiting for %s threads to complete....", name)
-          sleep(0.5)
-          break
-    log.info('%s Qsize: %s', name, queue.qsize())
-
-
 def get_orgs(report):
     p_orgs = subprocess.run(args=["gcloud", "organizations", "list", "--format", "json", "--quiet"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     orgs = loads(p_orgs.stdout)
@@ -522,9 +751,8 @@ def get_orgs(report):
             report.add_error("[%s - folders] - %s" % (org.name, str(e)))
 
 
-def process(report, threads, resources_threads, thread_queue_size, resources_thread_queue_size):
-    p_queue = __boot(name="p_worker", report=report, thread_count=threads, thread_queue_size=thread_queue_size, pool=p_pool, control=p_control)
-    r_queue = __boot(name="k_worker", report=report, thread_count=resources_threads, thread_queue_size=resources_thread_queue_size, pool=r_pool, control=r_control)
+def process(report, threads, resources_threads, k8s_threads=None, session=None, k8s_clients=None):
+    scheduler = Scheduler(limits={PROJECTS: threads, SERVICES: resources_threads, K8S: k8s_threads or resources_threads})
 
     try:
         p_projects = subprocess.run(args=["gcloud", "projects", "list", "--format", "json", "--quiet"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
@@ -542,10 +770,10 @@ def process(report, threads, resources_threads, thread_queue_size, resources_thr
     #     log.info("Backup created at %s", backup_file)
 
     for project in report.projects:
-        p_queue.put(item={'action': process_project, 'project': project, 'report': report, 'queue': r_queue}, block=True)
-    
-    wait_and_stop(name="projects", queue=p_queue, control=p_control, pool=p_pool)
-    wait_and_stop(name="resources", queue=r_queue, control=r_control, pool=r_pool)
+        scheduler.submit(PROJECTS, action=process_project, project=project, report=report, scheduler=scheduler, session=session, k8s_clients=k8s_clients)
+
+    scheduler.wait()
+    scheduler.shutdown()
 
 
 def del_nones(doc):
@@ -566,15 +794,14 @@ def del_nones(doc):
     return doc
 
 
-p_control = Control()
-r_control = Control()
-
-
 if __name__ == "__main__":
     logging.basicConfig(level="INFO", format="[%(threadName)s] [%(levelname)s]: %(message)s")
     parser = ArgumentParser(prog="Levelops GCP reporter", usage="gcloud.py (optional <flags>)")
     parser.add_argument('--debug', dest='debug', help='Enables debug logging', action='store_true')
     parser.add_argument('-t', '--threads', dest='threads', help='Number of threads', type=int, default=5)
+    parser.add_argument('--k8s-threads', dest='k8s_threads', help='Number of threads listing the resources of the k8s clusters (default: twice the number of threads)', type=int)
+    parser.add_argument('--k8s-requests', dest='k8s_requests', help='Maximum number of k8s list calls running at the same time across all the clusters (default: twice the number of threads)', type=int)
+    parser.add_argument('--gcloud-cli', dest='gcloud_cli', help='If present, every resource is listed with the gcloud cli (a process per service, project and region) instead of the REST APIs.', action='store_true')
 
     options = parser.parse_args()
     if options.debug:
@@ -601,8 +828,20 @@ if __name__ == "__main__":
     
     report = Report()
     get_orgs(report=report)
-    g_credentials = get_google_credentials(report=report)
-    process(report=report, threads=options.threads, resources_threads=options.threads*2, thread_queue_size=5, resources_thread_queue_size=10)
+    credentials = get_google_credentials(report=report)
+    session = None
+    k8s_clients = None
+    if credentials:
+        k8s_clients = K8sClients(credentials=credentials, max_requests=options.k8s_requests or options.threads*2)
+        if not options.gcloud_cli:
+            session = GoogleSession(credentials=credentials, pool_size=options.threads*3)
+    else:
+        log.warning("The REST APIs can't be used without the google credentials, falling back to the gcloud cli.")
+    process(report=report, threads=options.threads, resources_threads=options.threads*2, k8s_threads=options.k8s_threads, session=session, k8s_clients=k8s_clients)
+    if session:
+        session.close()
+    if k8s_clients:
+        k8s_clients.close()
     
     for f in cleanup:
         log.info("removing %s", f)
@@ -0,0 +1,325 @@
+import os
+import time
+import threading
+
+from importlib.util import spec_from_file_location, module_from_spec
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.exceptions import ConnectionError, Timeout
+from ujson import dumps
+
+spec = spec_from_file_location("levelops_gcloud", os.path.join(os.path.dirname(os.path.abspath(__file__)), "levelops-gcloud.py"))
+gcloud = module_from_spec(spec)
+spec.loader.exec_module(gcloud)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+  """ Records the requests (path and headers) and answers with the next response of the server plan:
+  a status code or a (status code, headers, body, delay) tuple. 200 with the 'default' body when the plan is empty.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.server.requests.append({'path': self.path, 'headers': dict(self.headers)})
+    response = self.server.plan.pop(0) if self.server.plan else (200, {}, self.server.default, 0)
+    if not isinstance(response, tuple):
+      response = (response, {}, b'{}', 0)
+    status, headers, out, delay = response
+    if delay:
+      time.sleep(delay)
+    self.send_response(status)
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.send_header('Content-Length', str(len(out)))
+    self.end_headers()
+    self.wfile.write(out)
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(object):
+  def __init__(self, plan=None, default=b'{}'):
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    self.server.daemon_threads = True
+    self.server.requests = []
+    self.server.plan = list(plan or [])
+    self.server.default = default
+    self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+    threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+  @property
+  def requests(self):
+    return self.server.requests
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+
+class StubCredentials(object):
+  def __init__(self):
+    self.tokens = 0
+
+  def get_token(self, refresh=False):
+    if refresh or not self.tokens:
+      self.tokens += 1
+    return "token%s" % self.tokens
+
+
+def page(items, next_token=None):
+  data = {'items': items}
+  if next_token:
+    data['nextPageToken'] = next_token
+  return (200, {}, dumps(data).encode('utf-8'), 0)
+
+
+def test_list_pages():
+  server = StubServer(plan=[page([1, 2], "p2"), page([3], "p3"), page([])])
+  try:
+    session = gcloud.GoogleSession(credentials=StubCredentials())
+    assert list(session.list(server.url + "/v1/items", "items")) == [1, 2, 3]
+    assert [request['path'] for request in server.requests] == ["/v1/items", "/v1/items?pageToken=p2", "/v1/items?pageToken=p3"]
+    assert server.requests[0]['headers']['Authorization'] == "Bearer token1"
+    session.close()
+  finally:
+    server.close()
+
+
+def test_retry_after():
+  server = StubServer(plan=[(429, {'Retry-After': '0.3'}, b'{}', 0), (503, {'Retry-After': '0'}, b'{}', 0)], default=b'{"a": 1}')
+  try:
+    # without Retry-After the waits would be 10 and 20 seconds
+    session = gcloud.GoogleSession(credentials=StubCredentials(), backoff=10)
+    start = time.time()
+    assert session.get(server.url + "/v1/a") == {'a': 1}
+    assert 0.3 <= time.time() - start < 5
+    assert len(server.requests) == 3
+  finally:
+    server.close()
+
+
+def test_gives_up_after_retries():
+  server = StubServer(plan=[500] * 10)
+  try:
+    session = gcloud.GoogleSession(credentials=StubCredentials(), retries=2, backoff=0)
+    try:
+      session.get(server.url + "/v1/a")
+    except gcloud.ApiError as e:
+      assert e.status_code == 500
+    else:
+      assert False, "the call should fail"
+    assert len(server.requests) == 3
+  finally:
+    server.close()
+
+
+def test_no_retry_on_4xx():
+  server = StubServer(plan=[403])
+  try:
+    session = gcloud.GoogleSession(credentials=StubCredentials(), backoff=0)
+    try:
+      session.get(server.url + "/v1/a")
+    except gcloud.ApiError as e:
+      assert e.status_code == 403
+    else:
+      assert False, "the call should fail"
+    assert len(server.requests) == 1
+  finally:
+    server.close()
+
+
+def test_token_refreshed_once():
+  server = StubServer(plan=[401, 401])
+  try:
+    credentials = StubCredentials()
+    session = gcloud.GoogleSession(credentials=credentials, backoff=0)
+    try:
+      session.get(server.url + "/v1/a")
+    except gcloud.ApiError as e:
+      assert e.status_code == 401
+    else:
+      assert False, "the call should fail"
+    assert [request['headers']['Authorization'] for request in server.requests] == ["Bearer token1", "Bearer token2"]
+    # the new token is used from then on
+    assert session.get(server.url + "/v1/a") == {}
+    assert server.requests[-1]['headers']['Authorization'] == "Bearer token2"
+  finally:
+    server.close()
+
+
+def test_timeout():
+  server = StubServer(plan=[(200, {}, b'{}', 1)] * 2)
+  try:
+    session = gcloud.GoogleSession(credentials=StubCredentials(), timeout=(1, 0.2), retries=1, backoff=0)
+    start = time.time()
+    try:
+      session.get(server.url + "/v1/a")
+    except (ConnectionError, Timeout):
+      pass
+    else:
+      assert False, "the call should time out"
+    assert len(server.requests) == 2
+    assert time.time() - start < 1.5
+  finally:
+    server.close()
+
+
+def test_timeout_then_success():
+  server = StubServer(plan=[(200, {}, b'{}', 1)], default=b'{"a": 1}')
+  try:
+    session = gcloud.GoogleSession(credentials=StubCredentials(), timeout=(1, 0.2), backoff=0)
+    assert session.get(server.url + "/v1/a") == {'a': 1}
+  finally:
+    server.close()
+
+
+def run_with_timeout(target, timeout=10):
+  t = threading.Thread(target=target, daemon=True)
+  t.start()
+  t.join(timeout)
+  assert not t.is_alive(), "deadlock"
+
+
+def test_scheduler_bounds_the_submissions():
+  scheduler = gcloud.Scheduler(limits={'a': 2})
+  release = threading.Event()
+  submitted = []
+
+  def submit_all():
+    for n in range(10):
+      scheduler.submit('a', action=release.wait)
+      submitted.append(n)
+
+  t = threading.Thread(target=submit_all, daemon=True)
+  t.start()
+  time.sleep(0.3)
+  # 2 threads, 2 tasks per thread
+  assert len(submitted) == 2 * gcloud.SCHEDULER_BACKLOG
+  release.set()
+  t.join(10)
+  assert len(submitted) == 10
+  run_with_timeout(scheduler.wait)
+  scheduler.shutdown()
+
+
+def test_scheduler_nested_submissions():
+  scheduler = gcloud.Scheduler(limits={'project': 1, 'service': 1})
+  done = []
+  lock = threading.Lock()
+
+  def service(n):
+    time.sleep(0.001)
+    with lock:
+      done.append(n)
+
+  def fail():
+    raise ValueError("task failed")
+
+  def project(p):
+    for n in range(20):
+      scheduler.submit('service', action=service, n=(p, n))
+    # same family, doesn't wait for the slots
+    if p < 5:
+      scheduler.submit('project', action=project, p=p + 10)
+    scheduler.submit('service', action=fail)
+
+  def submit_projects():
+    for p in range(5):
+      scheduler.submit('project', action=project, p=p)
+    scheduler.wait()
+
+  run_with_timeout(submit_projects)
+  assert len(done) == 10 * 20
+  # the slots are released once the task is done, after wait returns
+  scheduler.shutdown()
+  # no slot was leaked by the failed tasks
+  for family, slots in scheduler.slots.items():
+    assert slots._value == gcloud.SCHEDULER_BACKLOG
+
+
+def test_scheduler_after_shutdown():
+  scheduler = gcloud.Scheduler(limits={'a': 1})
+  scheduler.shutdown()
+  try:
+    scheduler.submit('a', action=lambda: None)
+  except RuntimeError:
+    pass
+  else:
+    assert False, "the executor is shut down"
+  assert scheduler.slots['a']._value == gcloud.SCHEDULER_BACKLOG
+  run_with_timeout(scheduler.wait)
+
+
+class FakeResponse(object):
+  def __init__(self, data):
+    self.data = data
+    self.released = False
+
+  def release_conn(self):
+    self.released = True
+
+
+class FakeListCall(object):
+  """ A kubernetes list call (_preload_content=False) that answers the pages in order, the raw json responses are recorded. """
+  def __init__(self, pages):
+    self.pages = pages
+    self.calls = []
+    self.responses = []
+
+  def __call__(self, **kwargs):
+    self.calls.append(kwargs)
+    page = self.pages[len(self.calls) - 1]
+    data = {'items': page[0]}
+    if page[1]:
+      data['metadata'] = {'continue': page[1]}
+    response = FakeResponse(dumps(data).encode('utf-8'))
+    self.responses.append(response)
+    return response
+
+
+def k8s_object(name, version, namespace="default", kind="Deployment", labels=None, port=80):
+  obj = {'metadata': {'name': name, 'namespace': namespace, 'resourceVersion': str(version), 'labels': labels}}
+  if kind == "Service":
+    obj['spec'] = {'type': 'ClusterIP', 'ports': [{'protocol': 'TCP', 'targetPort': 8080, 'port': port}], 'selector': {'app': name}}
+  else:
+    obj['spec'] = {'template': {'spec': {'containers': [{'image': name + ":1"}]}}}
+  return obj
+
+
+def test_list_k8s_objects_pages():
+  list_call = FakeListCall([([k8s_object("a", 1), k8s_object("b", 1)], "token-1"), ([k8s_object("c", 1)], "token-2"), ([], None)])
+  names = [obj['metadata']['name'] for obj in gcloud.list_k8s_objects(list_call, page_size=2)]
+  assert names == ["a", "b", "c"]
+  assert [call.get('_continue') for call in list_call.calls] == [None, "token-1", "token-2"]
+  for call in list_call.calls:
+    assert call['limit'] == 2
+    assert call['field_selector'] == "metadata.namespace!=kube-system"
+    assert call['_preload_content'] is False
+  assert all(response.released for response in list_call.responses)
+
+
+def test_list_k8s_objects_single_page():
+  list_call = FakeListCall([([k8s_object("a", 1)], None)])
+  assert len(list(gcloud.list_k8s_objects(list_call))) == 1
+  assert list_call.calls[0]['limit'] == gcloud.K8S_PAGE_SIZE
+  assert '_continue' not in list_call.calls[0]
+
+
+def test_get_k8s_set():
+  # the replica sets of the same deployment (pod-template-hash) are the same resource, only the latest version is kept
+  pages = [
+    ([k8s_object("web-abc", 5, kind="ReplicaSet", labels={'pod-template-hash': "abc"}), k8s_object("dns", 1, namespace="kube-system", kind="ReplicaSet")], "next"),
+    ([k8s_object("web-def", 9, kind="ReplicaSet", labels={'pod-template-hash': "def"}), k8s_object("web-abc", 3, kind="ReplicaSet", labels={'pod-template-hash': "abc"})], None)]
+  resources = gcloud.get_k8s_set(FakeListCall(pages), "ReplicaSet")
+  assert [(r.name, r.containers) for r in resources] == [("web-def", ["web-def:1"])]
+
+
+def test_get_k8s_set_versions():
+  # an older version of "api" after the latest one
+  pages = [([k8s_object("api", 7, kind="Service"), k8s_object("db", 2, kind="Service")], "next"), ([k8s_object("api", 4, kind="Service", port=81)], None)]
+  resources = sorted(gcloud.get_k8s_set(FakeListCall(pages), "Service"), key=lambda r: r.name)
+  assert [r.name for r in resources] == ["api", "db"]
+  assert resources[0].ports == [{'protocol': 'TCP', 'target': 8080, 'port': 80}]
+  assert resources[0].selectors == {'app': "api"}
+  assert resources[0].subtype == "ClusterIP"
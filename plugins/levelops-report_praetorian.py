@@ -793,10 +793,14 @@ if __name__ == "__main__":
       if type(results) is not dict:
         runner.submit(success=success, results={"output": results}, product_id=options.product, token=options.token, plugin=plugin, elapsed_time=(end_time - start_time), labels=labels, tags=options.tags)
       else:
+        # one envelope per project, sent in as few requests as possible
+        items = []
         for key in results:
           result = results[key]
-          labels.update({'project_name': [result['project_name']]})
-          runner.submit(success=success, results=result, product_id=options.product, token=options.token, plugin=plugin, elapsed_time=(end_time - start_time), labels=labels, tags=options.tags)
+          item_labels = dict(labels)
+          item_labels.update({'project_name': [result['project_name']]})
+          items.append((result, item_labels))
+        runner.submit_batch(success=success, items=items, product_id=options.product, token=options.token, plugin=plugin, elapsed_time=(end_time - start_time), tags=options.tags)
   if success:
     sys.exit(0)
   else:
@@ -4,12 +4,14 @@ import sys
 import logging
 import re
 
-from time import sleep
-from os import walk, path, listdir
+from os import path, scandir, stat, fstat
+from mmap import mmap, ACCESS_READ
 from threading import Thread
-from queue import Queue, Empty
+from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
 
 from sdk.types import Endpoint, API, Report
+from .cache import ScanCache, get_signature
 
 log = logging.getLogger(__name__)
 
@@ -20,69 +22,182 @@ log = logging.getLogger(__name__)
 # # collect APIs
 # return results
 
+# marker put in the work queue once per worker to tell it to stop
+_STOP = object()
+
+# the files are processed by the worker threads themselves
+THREAD_BACKEND = 'thread'
+# the worker threads hand chunks of files to a pool of processes (not limited by the GIL)
+PROCESS_BACKEND = 'process'
+BACKENDS = [THREAD_BACKEND, PROCESS_BACKEND]
+# default number of files sent to a worker process in a single task
+PROCESS_CHUNK_SIZE = 32
+
+
+class PartialResults(list):
+  """ Results of an action that failed on part of the file, they are collected but not cached. """
+  pass
+
+
 class Scanner(object):
-  def __init__(self, thread_count=5, thread_queue_size=50, default_exclusions=[".git", "build", "target", "bin", "test"], queue_timeout=1):
+  """ Scanner:
+
+      Walks directories and runs an 'action' for every file that matches the filters.
+      Whatever the action returns (if not None) is handed to the 'collector', by default the API objects are added to the report.
+      If the action returns a list, every item is handed to the collector.
+
+      backend: 'thread' runs the actions in the worker threads. 'process' runs the actions in a pool of 'thread_count'
+              processes, the files are sent in chunks of 'chunk_size' files and the results are collected in this process.
+              In this mode the action and its results need to be picklable (module level functions, API objects, etc).
+
+      The directories are listed by 'walker_count' walker threads that stream the matching files into the work queue,
+      so listing and processing overlap. scan_directory only queues the directory, use wait/wait_and_finish to wait for the results.
+
+      cache: optional ScanCache, files that didn't change since they were cached are not processed again and their
+              cached results are handed to the collector instead. The cache is closed by wait_and_finish.
+              An action that fails on part of a file can return a PartialResults list: the results are collected but
+              not cached, so the file is processed again in the next scan.
+
+      include_hidden: if True the hidden directories (name starting with ".") are scanned too, only the exclusions are skipped.
+
+      prefilter: optional argument of scan_directory/scan_files, a bytes literal, a compiled bytes regex or a list of them.
+              The walkers check it against a memory map of every file and only queue the files where any of them is found,
+              the other files never reach the workers. When a prefilter is used the action is called as action(f_path, buffer)
+              where buffer is the (read only) memory map of the file, see get_content.
+  """
+  def __init__(self, thread_count=5, thread_queue_size=50, default_exclusions=[".git", "build", "target", "bin", "test"], queue_timeout=1, backend=THREAD_BACKEND, chunk_size=None, collector=None, walker_count=2, cache=None, include_hidden=False):
+    if backend not in BACKENDS:
+      raise Exception("Unsupported backend '%s', the supported backends are: %s" % (backend, BACKENDS))
     self.thread_count = thread_count
     self.thread_queue_size = thread_queue_size
     self.default_exclusions = default_exclusions
+    self.backend = backend
+    if chunk_size:
+      self.chunk_size = chunk_size
+    elif backend == PROCESS_BACKEND:
+      self.chunk_size = PROCESS_CHUNK_SIZE
+    else:
+      self.chunk_size = 1
+    self.walker_count = walker_count
+    self.cache = cache
+    self.include_hidden = include_hidden
     self.pool = []
+    self.walkers = []
+    self.executor = None
     self.report = Report()
+    if collector:
+      self.collector = collector
+    else:
+      self.collector = self.report.add_api
+    # workers block on the queue until they get a task or the stop marker,
+    # the timeout is no longer used and is kept for backwards compatibility.
     self.timeout = queue_timeout
+    self.finished = False
     self.__boot__()
   
   def get_report(self):
     return self.report
 
-  def scan_directory(self, base_path, filters, action, extra_exclusions=None):
+  def scan_directory(self, base_path, filters, action, extra_exclusions=None, prefilter=None):
     if extra_exclusions:
       exclusions = extra_exclusions + self.default_exclusions
     else:
       exclusions = self.default_exclusions
-    _scan_directory(queue=self.queue, base_path=base_path, filters=filters, action=action, exclusions=exclusions, control=self.control)
+    if not path.isdir(base_path):
+      log.error("Can't scan '%s', it is not a directory.", base_path)
+      raise Exception("Can't scan '%s', it is not a directory." % base_path)
+    self.dirs.put({'base_path': base_path, 'suffixes': _get_suffixes(filters), 'target': action, 'exclusions': frozenset(exclusions), 'prefilter': get_prefilter(prefilter), 'include_hidden': self.include_hidden})
   
+  def scan_files(self, base_path, f_paths, filters, action, extra_exclusions=None, prefilter=None):
+    """ Queues only the given files (ex: the files changed in a commit range) instead of walking base_path.
+    The files are filtered the same way scan_directory would (filters, exclusions and hidden directories).
+    """
+    if extra_exclusions:
+      exclusions = extra_exclusions + self.default_exclusions
+    else:
+      exclusions = self.default_exclusions
+    suffixes = _get_suffixes(filters)
+    selected = []
+    for f_path in f_paths:
+      if not f_path.endswith(suffixes) or not path.isfile(f_path):
+        continue
+      folders = path.dirname(path.relpath(f_path, base_path)).split(path.sep)
+      if any((folder.startswith(".") and not self.include_hidden) or folder in exclusions for folder in folders if folder):
+        continue
+      selected.append(f_path)
+    log.info("[%s] %s files selected out of %s", base_path, len(selected), len(f_paths))
+    _queue_paths(queue=self.queue, control=self.control, action=action, f_paths=selected, chunk_size=self.chunk_size, collector=self.collector, cache=self.cache, prefilter=get_prefilter(prefilter))
+
   def wait(self):
-    attempt = 0
-    while not self.queue.empty() or attempt < 2:
-      log.info('Waiting for the queue to be empty')
-      sleep(1)
-      if self.queue.empty():
-        attempt += 1
+    log.info('Waiting for the directories to be listed')
+    self.dirs.join()
+    log.info('Waiting for the queue to be empty')
+    self.queue.join()
 
   def wait_and_finish(self):
+    if self.finished:
+      return
     self.wait()
     self.control.stop()
-    waiting_for_threads = True
-    while waiting_for_threads:
-      for t in self.pool:
-        waiting_for_threads = t.isAlive()
-        if waiting_for_threads:
-          log.info("Waiting for threads to complete....")
-          sleep(0.5)
-          break
+    for t in self.walkers:
+      self.dirs.put(_STOP)
+    for t in self.pool:
+      self.queue.put(_STOP)
+    log.info("Waiting for threads to complete....")
+    for t in self.walkers + self.pool:
+      t.join()
+    if self.executor:
+      self.executor.shutdown()
+    if self.cache:
+      self.cache.close()
+    self.finished = True
     log.info('Qsize: %s', self.queue.qsize())
 
   def __boot__(self):
     self.queue = Queue(maxsize=self.thread_count*self.thread_queue_size)
     self.control = Control()
-    for i in range(0, self.thread_count):
-      t = Thread(name="Worker-"+str(i), daemon=True, target=run, args=(self.queue, self.report, self.control, self.timeout))
+    workers = self.thread_count
+    if self.backend == PROCESS_BACKEND:
+      self.executor = ProcessPoolExecutor(max_workers=self.thread_count)
+      # the executor starts its processes on the first submit, with the fork start method (linux) all of them at once (then
+      # starts its own management thread). this empty task makes that happen before the worker and walker threads below
+      # exist, so they are not copied into the children. threads started by the caller before the Scanner still are.
+      self.executor.submit(_process_chunk, None, []).result()
+      # two dispatchers per process so a process doesn't idle while the results of its previous chunk are collected.
+      workers = self.thread_count * 2
+    for i in range(0, workers):
+      t = Thread(name="Worker-"+str(i), daemon=True, target=run, args=(self.queue, self.collector, self.executor, self.cache))
       t.start()
       self.pool.append(t)
+    # directories pending to be listed, unbounded so the walkers never wait on each other
+    self.dirs = Queue()
+    for i in range(0, self.walker_count):
+      t = Thread(name="Walker-"+str(i), daemon=True, target=walk_directories, args=(self.dirs, self.queue, self.control, self.chunk_size, self.collector, self.cache))
+      t.start()
+      self.walkers.append(t)
 
 
-def run(queue, report, control, timeout=2):
+def run(queue, collector, executor=None, cache=None):
     log.debug('Starting...')
-    while not control.terminate:
-      try:
-        task = queue.get(block=True, timeout=timeout)
-      except Empty as e:
-        log.debug('Empty response from the queue, will try again...')
-        continue
+    while True:
+      task = queue.get()
+      if task is _STOP:
+        queue.task_done()
+        break
       log.debug('Task acquried!')
       try:
-        api = task.get('target')(task.get('f_path'))
-        if api:
-          report.add_api(api)
+        f_paths = task.get('f_paths')
+        if executor:
+          results, failed = executor.submit(_process_chunk, task.get('target'), f_paths, task.get('mapped')).result()
+        else:
+          results, failed = _process_chunk(task.get('target'), f_paths, task.get('mapped'))
+        for result in results:
+          for item in _as_list(result):
+            collector(item)
+        if cache:
+          for i, signature in enumerate(task.get('signatures')):
+            if i not in failed:
+              cache.put(f_paths[i], signature, _as_list(results[i]))
       except Exception as e:
         log.error("Task failed", exc_info=True)
       finally:
@@ -90,34 +205,175 @@ def run(queue, report, control, timeout=2):
     log.debug("Stopping....")
 
 
-def _queue_file(queue, control, action, f_path):
+def _as_list(result):
+  """ Actions can return None, a single result or a list of results. """
+  if not result:
+    return []
+  if isinstance(result, list):
+    return result
+  return [result]
+
+
+def _process_chunk(action, f_paths, mapped=False):
+  """ Returns the results of the action for every file (None if nothing was found) and the indexes of the files that failed.
+  If mapped is True the action also gets a memory map of the file, which is closed afterwards.
+  """
+  results = []
+  failed = set()
+  for i, f_path in enumerate(f_paths):
+    result = None
+    buffer = None
+    try:
+      if mapped:
+        buffer = _map_file(f_path)
+        result = action(f_path, buffer)
+      else:
+        result = action(f_path)
+      if isinstance(result, PartialResults):
+        failed.add(i)
+    except Exception as e:
+      failed.add(i)
+      log.error("Task failed: %s", f_path, exc_info=True)
+    finally:
+      if buffer is not None:
+        buffer.close()
+    results.append(result)
+  return results, failed
+
+
+def _queue_files(queue, control, action, f_paths, signatures=None, mapped=False):
   if control.terminate:
     log.error('Canot add new task, already terminating...')
   else:
-    queue.put({'target': action, 'f_path': f_path})
+    queue.put({'target': action, 'f_paths': f_paths, 'signatures': signatures, 'mapped': mapped})
 
 
-def _scan_directory(queue, base_path, filters, action, exclusions=None, control=None):
+def walk_directories(dirs, queue, control, chunk_size=1, collector=None, cache=None):
+    log.debug('Starting...')
+    while True:
+      task = dirs.get()
+      if task is _STOP:
+        dirs.task_done()
+        break
+      try:
+        _scan_directory(dirs=dirs, queue=queue, control=control, chunk_size=chunk_size, collector=collector, cache=cache, **task)
+      except Exception as e:
+        log.error("Couldn't list the directory '%s'", task.get('base_path'), exc_info=True)
+      finally:
+        dirs.task_done()
+    log.debug("Stopping....")
+
+
+def _scan_directory(dirs, queue, base_path, suffixes, target, exclusions, control=None, chunk_size=1, collector=None, cache=None, prefilter=None, include_hidden=False):
+  """ Lists a single directory, the matching files are queued in chunks and the sub directories
+  are queued to be listed by the walkers (no recursion). Symlinked directories are not followed.
+  """
   log.debug("scanning '%s'" % base_path)
-  try:
-    dirpath, folders, files = next(walk(top=base_path))
-  except Exception as ex:
-    log.error('Error - base_path: %s, dirpath: %s', base_path, dirpath, exc_info=True)
-    raise ex
-  for file in files:
-    if isinstance(filters, list):
-      for f_filter in filters:
-        if file.endswith(f_filter):
-          _queue_file(queue=queue, control=control, action=action, f_path=path.join(dirpath,file))
-          # queue.put({'target': action, 'f_path': path.join(dirpath,file)})
-          break
-    elif file.endswith(filters):
-      _queue_file(queue=queue, control=control, action=action, f_path=path.join(dirpath,file))
-      # queue.put({'target': action, 'f_path': path.join(dirpath,file)})
-  for folder in folders:
-    if not folder.startswith(".") and folder not in exclusions:
-      log.debug("Folder: %s" % folder)
-      _scan_directory(queue=queue, base_path=path.join(dirpath,folder), filters=filters, action=action, exclusions=exclusions, control=control)
+  f_paths = []
+  with scandir(base_path) as entries:
+    for entry in entries:
+      name = entry.name
+      if entry.is_dir(follow_symlinks=False):
+        if (include_hidden or not name.startswith(".")) and name not in exclusions:
+          log.debug("Folder: %s" % name)
+          dirs.put({'base_path': entry.path, 'suffixes': suffixes, 'target': target, 'exclusions': exclusions, 'prefilter': prefilter, 'include_hidden': include_hidden})
+      elif name.endswith(suffixes):
+        f_paths.append(entry.path)
+  _queue_paths(queue=queue, control=control, action=target, f_paths=f_paths, chunk_size=chunk_size, collector=collector, cache=cache, prefilter=prefilter)
+
+
+def _queue_paths(queue, control, action, f_paths, chunk_size=1, collector=None, cache=None, prefilter=None):
+  """ Queues the files in chunks of chunk_size. If there is a cache, the files that didn't change are not queued
+  and their cached results are handed directly to the collector.
+  If there is a prefilter, only the files that match it are queued. The memory map used for the check is closed right
+  away and the file is mapped again by the worker: every map holds a file descriptor, the queued files would hold
+  thousands of them.
+  """
+  mapped = prefilter is not None
+  chunk = []
+  signatures = [] if cache else None
+  for f_path in f_paths:
+    if cache:
+      try:
+        signature = get_signature(stat(f_path))
+      except OSError as e:
+        # ex: a dangling symlink, the rest of the files are still queued
+        log.error("Couldn't read the file, skipping it: %s - %s", f_path, e)
+        continue
+      cached = cache.get(f_path, signature)
+      if cached is not None:
+        for result in cached:
+          collector(result)
+        continue
+    if mapped:
+      try:
+        buffer = _map_file(f_path)
+      except (OSError, ValueError) as e:
+        log.error("Couldn't read the file, skipping it: %s - %s", f_path, e)
+        continue
+      try:
+        matches = buffer is not None and prefilter_matches(buffer, prefilter)
+      finally:
+        if buffer is not None:
+          buffer.close()
+      if not matches:
+        if cache:
+          # remember that there is nothing in this file so it is not mapped again until it changes
+          cache.put(f_path, signature, [])
+        continue
+    if cache:
+      signatures.append(signature)
+    chunk.append(f_path)
+    if len(chunk) >= chunk_size:
+      _queue_files(queue=queue, control=control, action=action, f_paths=chunk, signatures=signatures, mapped=mapped)
+      chunk = []
+      signatures = [] if cache else None
+  if chunk:
+    _queue_files(queue=queue, control=control, action=action, f_paths=chunk, signatures=signatures, mapped=mapped)
+
+
+def _get_suffixes(filters):
+  if isinstance(filters, list) or isinstance(filters, tuple):
+    return tuple(filters)
+  return (filters,)
+
+
+def get_prefilter(prefilter):
+  """ Returns the prefilter as a tuple of patterns (None if there is no prefilter). """
+  if prefilter is None:
+    return None
+  patterns = tuple(prefilter) if isinstance(prefilter, (list, tuple)) else (prefilter,)
+  for pattern in patterns:
+    if not isinstance(pattern, bytes) and not (isinstance(pattern, re.Pattern) and isinstance(pattern.pattern, bytes)):
+      raise Exception("Unsupported prefilter %r, only bytes literals and compiled bytes regular expressions are supported." % (pattern,))
+  return patterns
+
+
+def _map_file(f_path):
+  """ Returns a read only memory map of the file or None if the file is empty (empty files can't be mapped). """
+  with open(f_path, 'rb') as f:
+    if fstat(f.fileno()).st_size == 0:
+      return None
+    return mmap(f.fileno(), 0, access=ACCESS_READ)
+
+
+def prefilter_matches(buffer, prefilter):
+  """ True if any of the patterns of the prefilter (see get_prefilter) is found in the buffer. """
+  for pattern in prefilter:
+    if isinstance(pattern, bytes):
+      if buffer.find(pattern) != -1:
+        return True
+    elif pattern.search(buffer):
+      return True
+  return False
+
+
+def get_content(f_path, buffer=None):
+  """ Returns the text of the file, from its memory map if the scanner handed one to the action. """
+  if buffer is not None:
+    return buffer[:].decode('utf-8', errors='replace')
+  with open(f_path, 'r', encoding='utf-8', errors='replace') as f:
+    return f.read()
 
 
 class Control(object):
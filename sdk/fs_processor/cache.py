@@ -0,0 +1,111 @@
+import os
+import logging
+import sqlite3
+
+from hashlib import sha1
+from threading import Lock
+from ujson import dumps, loads
+
+from sdk.types import API
+
+log = logging.getLogger(__name__)
+
+# number of pending writes before they are committed to disk
+COMMIT_EVERY = 1000
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS files (
+  plugin TEXT NOT NULL,
+  version TEXT NOT NULL,
+  path TEXT NOT NULL,
+  mtime INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  hash TEXT,
+  results TEXT NOT NULL,
+  PRIMARY KEY (plugin, version, path)
+)"""
+
+
+class ScanCache(object):
+  """ ScanCache:
+
+      On disk (sqlite) cache of the results of a plugin per file. The entries are keyed by the plugin name and version
+      and the path of the file, and are valid as long as the modification time and size of the file don't change.
+      If 'use_hash' is True, a file with the same size but different modification time (ex: a fresh clone) is
+      still considered unchanged if the sha1 of its contents matches the one stored.
+
+      Only API results are cached, files with any other kind of result are processed on every scan.
+  """
+  def __init__(self, location, plugin, use_hash=False):
+    self.location = location
+    self.plugin_name = plugin.name
+    self.plugin_version = str(plugin.version)
+    self.use_hash = use_hash
+    self.lock = Lock()
+    self.pending = 0
+    self.hits = 0
+    self.misses = 0
+    self.connection = sqlite3.connect(location, check_same_thread=False)
+    self.connection.execute(SCHEMA)
+    self.connection.commit()
+
+  def get(self, f_path, signature):
+    """ Returns the list of cached results for the file or None if the file changed or is not in the cache.
+    """
+    mtime, size = signature
+    with self.lock:
+      row = self.connection.execute("SELECT mtime, size, hash, results FROM files WHERE plugin=? AND version=? AND path=?", (self.plugin_name, self.plugin_version, f_path)).fetchone()
+    if not row or row[1] != size or (row[0] != mtime and not self._same_content(f_path, row[2])):
+      with self.lock:
+        self.misses += 1
+      return None
+    with self.lock:
+      if row[0] != mtime:
+        # same content, only the modification time changed
+        self.connection.execute("UPDATE files SET mtime=? WHERE plugin=? AND version=? AND path=?", (mtime, self.plugin_name, self.plugin_version, f_path))
+        self._written()
+      self.hits += 1
+    return [API.from_dict(api) for api in loads(row[3])]
+
+  def put(self, f_path, signature, results):
+    if not all(isinstance(result, API) for result in results):
+      return
+    mtime, size = signature
+    f_hash = _hash_file(f_path) if self.use_hash else None
+    data = dumps([api.to_dict() for api in results], escape_forward_slashes=False)
+    with self.lock:
+      self.connection.execute("INSERT OR REPLACE INTO files (plugin, version, path, mtime, size, hash, results) VALUES (?, ?, ?, ?, ?, ?, ?)", (self.plugin_name, self.plugin_version, f_path, mtime, size, f_hash, data))
+      self._written()
+
+  def close(self):
+    with self.lock:
+      self.connection.commit()
+      self.connection.close()
+    log.info("Scan cache '%s': %s unchanged files, %s new or changed files", self.location, self.hits, self.misses)
+
+  def _same_content(self, f_path, f_hash):
+    if not self.use_hash or not f_hash:
+      return False
+    try:
+      return _hash_file(f_path) == f_hash
+    except OSError:
+      return False
+
+  def _written(self):
+    # must be called holding the lock
+    self.pending += 1
+    if self.pending >= COMMIT_EVERY:
+      self.connection.commit()
+      self.pending = 0
+
+
+def get_signature(stat):
+  return stat.st_mtime_ns, stat.st_size
+
+
+def _hash_file(f_path):
+  digest = sha1()
+  with open(f_path, 'rb') as f:
+    for block in iter(lambda: f.read(1024 * 1024), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
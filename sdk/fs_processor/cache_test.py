@@ -0,0 +1,132 @@
+import os
+
+from sdk.fs_processor.cache import ScanCache, get_signature
+from sdk.plugins.plugins import Plugin
+from sdk.types import API, Endpoint
+
+plugin = Plugin(name="test_plugin", version="1")
+
+
+def write(f_path, content):
+  with open(f_path, 'w') as f:
+    f.write(content)
+  return str(f_path)
+
+
+def signature(f_path):
+  return get_signature(os.stat(f_path))
+
+
+def test_miss(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  assert cache.get(f_path, signature(f_path)) is None
+  assert cache.misses == 1
+  cache.close()
+
+
+def test_hit(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  api = API(name="a", endpoints=[Endpoint(path="/a", method="GET")])
+  cache.put(f_path, signature(f_path), [api])
+  cache.put(str(tmp_path / "empty.py"), (1, 0), [])
+  assert cache.get(f_path, signature(f_path)) == [api]
+  assert cache.get(str(tmp_path / "empty.py"), (1, 0)) == []
+  cache.close()
+  # persisted
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  assert cache.get(f_path, signature(f_path)) == [api]
+  assert cache.hits == 1
+  cache.close()
+
+
+def test_other_plugin_version(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  cache.put(f_path, signature(f_path), [])
+  cache.close()
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=Plugin(name="test_plugin", version="2"))
+  assert cache.get(f_path, signature(f_path)) is None
+  cache.close()
+
+
+def test_non_api_results_are_not_cached(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  cache.put(f_path, signature(f_path), ["not an api"])
+  assert cache.get(f_path, signature(f_path)) is None
+  cache.close()
+
+
+def test_invalidated_on_mtime_change(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  cache.put(f_path, signature(f_path), [])
+  mtime, size = signature(f_path)
+  os.utime(f_path, ns=(mtime + 10**9, mtime + 10**9))
+  assert cache.get(f_path, signature(f_path)) is None
+  cache.close()
+
+
+def test_invalidated_on_size_change(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  mtime, size = signature(f_path)
+  cache.put(f_path, (mtime, size), [])
+  write(f_path, "ab")
+  os.utime(f_path, ns=(mtime, mtime))
+  assert cache.get(f_path, signature(f_path)) is None
+  cache.close()
+
+
+def test_use_hash(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin, use_hash=True)
+  cache.put(f_path, signature(f_path), [])
+  mtime, size = signature(f_path)
+  # same content, new modification time (ex: a fresh clone)
+  os.utime(f_path, ns=(mtime + 10**9, mtime + 10**9))
+  assert cache.get(f_path, signature(f_path)) == []
+  # the new modification time was stored
+  assert cache.get(f_path, signature(f_path)) == []
+  assert cache.hits == 2
+  # different content, same size
+  write(f_path, "b")
+  os.utime(f_path, ns=(mtime + 2 * 10**9, mtime + 2 * 10**9))
+  assert cache.get(f_path, signature(f_path)) is None
+  cache.close()
+
+
+def test_hash_ignored_without_use_hash(tmp_path):
+  f_path = write(tmp_path / "a.py", "a")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin, use_hash=True)
+  cache.put(f_path, signature(f_path), [])
+  cache.close()
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  mtime, size = signature(f_path)
+  os.utime(f_path, ns=(mtime + 10**9, mtime + 10**9))
+  assert cache.get(f_path, signature(f_path)) is None
+  cache.close()
+
+
+def test_partial_results_are_not_cached(tmp_path):
+  from sdk.fs_processor import Scanner, PartialResults
+  write(tmp_path / "a.py", "a")
+  write(tmp_path / "b.py", "b")
+
+  def action(f_path):
+    api = API(name=f_path, endpoints=[Endpoint(path="/" + os.path.basename(f_path), method="GET")])
+    # an extractor failed on b.py
+    return PartialResults([api]) if f_path.endswith("b.py") else [api]
+
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  scanner = Scanner(thread_count=1, default_exclusions=[], cache=cache)
+  scanner.scan_directory(base_path=str(tmp_path), filters=[".py"], action=action)
+  scanner.wait_and_finish()
+  assert len(scanner.get_report().apis) == 2
+
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=plugin)
+  assert cache.get(str(tmp_path / "a.py"), signature(tmp_path / "a.py")) is not None
+  assert cache.get(str(tmp_path / "b.py"), signature(tmp_path / "b.py")) is None
+  cache.close()
@@ -0,0 +1,151 @@
+import os
+import resource
+import time
+
+from sdk.fs_processor import Scanner, ScanCache, get_content
+from sdk.plugins.plugins import Plugin
+from sdk.types import API, Endpoint
+
+
+def write(f_path, content):
+  os.makedirs(os.path.dirname(str(f_path)), exist_ok=True)
+  with open(f_path, 'w') as f:
+    f.write(content)
+  return str(f_path)
+
+
+def action(f_path, buffer=None):
+  get_content(f_path, buffer)
+  return API(name=os.path.basename(f_path), endpoints=[Endpoint(path="/" + os.path.basename(f_path), method="GET")])
+
+
+def scan(base_path, **kwargs):
+  prefilter = kwargs.pop('prefilter', None)
+  scanner = Scanner(thread_count=2, default_exclusions=[], **kwargs)
+  scanner.scan_directory(base_path=str(base_path), filters=[".py"], action=action, prefilter=prefilter)
+  scanner.wait_and_finish()
+  return sorted(api.name for api in scanner.get_report().apis)
+
+
+def create_files(base_path):
+  for name in ("a.py", "b.py", "c.py"):
+    write(base_path / name, "route")
+  os.symlink(str(base_path / "missing.py"), str(base_path / "dangling.py"))
+
+
+def test_dangling_symlink(tmp_path):
+  create_files(tmp_path)
+  assert scan(tmp_path) == ["a.py", "b.py", "c.py"]
+
+
+def test_dangling_symlink_with_prefilter(tmp_path):
+  create_files(tmp_path)
+  assert scan(tmp_path, prefilter=b"route") == ["a.py", "b.py", "c.py"]
+
+
+def test_dangling_symlink_with_cache(tmp_path):
+  create_files(tmp_path / "src")
+  cache = ScanCache(location=str(tmp_path / "cache.db"), plugin=Plugin(name="test_plugin", version="1"))
+  assert scan(tmp_path / "src", cache=cache, prefilter=b"route") == ["a.py", "b.py", "c.py"]
+
+
+def create_hidden(base_path):
+  for f_path in ("a.py", ".hidden/b.py", "src/.config/c.py", ".git/d.py", "build/e.py"):
+    write(base_path / f_path, "route")
+
+
+def test_hidden_directories_skipped(tmp_path):
+  create_hidden(tmp_path)
+  assert scan(tmp_path) == ["a.py", "e.py"]
+
+
+def test_include_hidden(tmp_path):
+  create_hidden(tmp_path)
+  scanner = Scanner(thread_count=2, default_exclusions=[".git", "build"], include_hidden=True)
+  scanner.scan_directory(base_path=str(tmp_path), filters=[".py"], action=action)
+  scanner.wait_and_finish()
+  assert sorted(api.name for api in scanner.get_report().apis) == ["a.py", "b.py", "c.py"]
+
+
+def test_include_hidden_files(tmp_path):
+  create_hidden(tmp_path)
+  f_paths = [str(tmp_path / f_path) for f_path in ("a.py", ".hidden/b.py", "src/.config/c.py", ".git/d.py")]
+  for include_hidden, expected in ((False, ["a.py"]), (True, ["a.py", "b.py", "c.py"])):
+    scanner = Scanner(thread_count=2, default_exclusions=[".git"], include_hidden=include_hidden)
+    scanner.scan_files(base_path=str(tmp_path), f_paths=f_paths, filters=[".py"], action=action)
+    scanner.wait_and_finish()
+    assert sorted(api.name for api in scanner.get_report().apis) == expected
+
+
+def slow_action(f_path, buffer=None):
+  time.sleep(0.01)
+  return action(f_path, buffer)
+
+
+def test_prefilter_with_few_file_descriptors(tmp_path):
+  # the files waiting in the queue must not keep their memory maps (and file descriptors) open
+  for n in range(1500):
+    write(tmp_path / ("f%s.py" % n), "route")
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+  try:
+    scanner = Scanner(thread_count=32, default_exclusions=[])
+    # slow workers, the queue fills up
+    scanner.scan_directory(base_path=str(tmp_path), filters=[".py"], action=slow_action, prefilter=b"route")
+    scanner.wait_and_finish()
+  finally:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+  assert len(scanner.get_report().apis) == 1500
+
+
+def create_routes(base_path):
+  write(base_path / "a.py", "route a")
+  write(base_path / "src" / "b.py", "route b")
+  write(base_path / "src" / "c.py", "nothing here")
+  write(base_path / "d.txt", "route d")
+
+
+def scan_process(base_path, **kwargs):
+  prefilter = kwargs.pop('prefilter', None)
+  scanner = Scanner(thread_count=2, default_exclusions=[], backend='process', chunk_size=2, **kwargs)
+  scanner.scan_directory(base_path=str(base_path), filters=[".py"], action=pid_action, prefilter=prefilter)
+  scanner.wait_and_finish()
+  return scanner.get_report().apis
+
+
+def pid_action(f_path, buffer=None):
+  """ The API (picklable) gets the pid of the process that ran the action as base path. """
+  content = get_content(f_path, buffer)
+  if buffer is not None:
+    assert content.startswith("route")
+  api = API(name=os.path.basename(f_path), endpoints=[Endpoint(path="/" + content.split()[-1], method="GET")], base_path=str(os.getpid()))
+  # hashed (frozen) before it is pickled back
+  hash(api)
+  return api
+
+
+def test_process_backend(tmp_path):
+  create_routes(tmp_path)
+  apis = scan_process(tmp_path)
+  assert sorted((api.name, [e.path for e in api.endpoints]) for api in apis) == [("a.py", ["/a"]), ("b.py", ["/b"]), ("c.py", ["/here"])]
+  # ran in the worker processes
+  assert all(api.base_path != str(os.getpid()) for api in apis)
+
+
+def test_process_backend_prefilter(tmp_path):
+  create_routes(tmp_path)
+  apis = scan_process(tmp_path, prefilter=b"route")
+  assert sorted(api.name for api in apis) == ["a.py", "b.py"]
+  assert all(api.base_path != str(os.getpid()) for api in apis)
+
+
+def test_process_backend_cache(tmp_path):
+  create_routes(tmp_path / "src")
+  location = str(tmp_path / "cache.db")
+  plugin = Plugin(name="test_plugin", version="1")
+  first = scan_process(tmp_path / "src", cache=ScanCache(location=location, plugin=plugin), prefilter=b"route")
+  cache = ScanCache(location=location, plugin=plugin)
+  second = scan_process(tmp_path / "src", cache=cache, prefilter=b"route")
+  assert second == first
+  # a.py, b.py and c.py (no match) come from the cache
+  assert cache.hits == 3 and cache.misses == 0
@@ -1,8 +1,17 @@
 # print("Package: %s" % __package__)
+import os
+import sys
+import logging
+from ujson import load
 from .util import typechecked
 from .results import PluginResults
 from .plugins import Plugin
-from .runner import Runner
+from .runner import Runner, RETRY_STATUS_CODES, get_retry_delay
+from sdk.fs_processor import BACKENDS, THREAD_BACKEND, ScanCache
+from sdk.scm import get_changed_files
+from sdk.types import Report, ReportSink, JSON_FORMAT, CSV_FORMAT, TEXT_FORMAT
+
+log = logging.getLogger(__name__)
 
 
 def labels_parser(labels_str: str):
@@ -29,4 +38,98 @@ default_plugin_options = [
   {'args':['--tag'], 'kwords':{'dest': 'tags', 'help': 'If submit is present, the provided tags will be part of the results sent to levelops (multiple tags can be passed by using the --tag argument multiple times: --tag tag1 --tag tag2).', 'action': 'append'}},
   {'args':['--endpoint'], 'kwords':{'dest': 'endpoint', 'help': 'If submit is present, the hostname and protocol can be customize with this flag (default: https://api.levelops.io).', 'default': 'https://api.levelops.io'}},
   {'args':['-p', '--product'], 'kwords':{'dest': 'product', 'help': '(Required if submit is enabled) The id of the corresponding product for the execution of this script.'}}
-]
\ No newline at end of file
+]
+
+scanner_plugin_options = [
+  {'args':['-t', '--threads', '--workers'], 'kwords':{'dest': 'threads', 'help':'Number of workers (threads or processes depending on the backend) used to process the files.', 'type':int, 'default': 5}},
+  {'args':['--backend'], 'kwords':{'dest': 'backend', 'help':'Execution backend for the file processing: "thread" or "process" (uses all the cores for CPU heavy parsing, default: thread).', 'choices': BACKENDS, 'default': THREAD_BACKEND}}
+]
+
+tool_runner_plugin_options = [
+  {'args':['--max-concurrent'], 'kwords':{'dest': 'max_concurrent', 'help':'Maximum number of tool processes running at the same time (default: 3).', 'type':int, 'default': 3}},
+  {'args':['--cpu-limit'], 'kwords':{'dest': 'cpu_limit', 'help':'Optional limit of cpu time (in seconds) for every tool process (linux only). With --docker it is set as the cpu ulimit of the containers.', 'type':int}},
+  {'args':['--memory-limit'], 'kwords':{'dest': 'memory_limit', 'help':'Optional limit of memory (in MB) for every tool process (linux only). With --docker it is the memory limit of the containers.', 'type':int}},
+  {'args':['--cpus'], 'kwords':{'dest': 'cpus', 'help':'Optional number of cpus for every tool container (only with --docker).', 'type':float}},
+  {'args':['--reuse-container'], 'kwords':{'dest': 'reuse_container', 'help':'With --docker, starts a single container with all the targets mounted and runs the scans in it (docker exec) instead of a container per scan.', 'action': 'store_true'}}
+]
+
+# used when --cache is passed without a location
+DEFAULT_SCAN_CACHE = '.levelops-scan-cache.db'
+
+incremental_scan_plugin_options = [
+  {'args':['--cache'], 'kwords':{'dest': 'cache_file', 'help':'Enables the incremental scan cache, only the files that changed since the previous scan are processed again. Optional path to the cache file (default: "%s" next to the --out file or in the current directory).' % DEFAULT_SCAN_CACHE, 'nargs': '?', 'const': DEFAULT_SCAN_CACHE}},
+  {'args':['--cache-hash'], 'kwords':{'dest': 'cache_hash', 'help':'If present, files whose modification time changed but whose contents (sha1) didn\'t are also considered unchanged by the scan cache (useful for fresh clones).', 'action': 'store_true'}},
+  {'args':['--since'], 'kwords':{'dest': 'since', 'help':'If present, only the files added or modified between this git revision and HEAD are scanned (the targets need to be git repositories).'}},
+  {'args':['--previous-report'], 'kwords':{'dest': 'previous_report', 'help':'Path to the json report of a previous scan. Used with --since, the new results are merged into it: the APIs of the changed and deleted files are replaced by the new results.'}}
+]
+
+streaming_plugin_options = [
+  {'args':['--stream'], 'kwords':{'dest': 'stream', 'help':'If present, the results are written (to the --out file and/or the console with --print-results) as soon as they are found instead of at the end of the scan. With --json the output is one json API per line. Can\'t be used with --submit or --previous-report.', 'action': 'store_true'}}
+]
+
+
+def get_scan_cache(options, plugin: Plugin):
+  if not options.cache_file:
+    return None
+  location = options.cache_file
+  if location == DEFAULT_SCAN_CACHE and options.output_file:
+    location = os.path.join(os.path.dirname(os.path.abspath(options.output_file)), DEFAULT_SCAN_CACHE)
+  return ScanCache(location=location, plugin=plugin, use_hash=options.cache_hash)
+
+
+def get_report_sink(options, extractor=False):
+  """ Returns the ReportSink for the output options if --stream is present, None otherwise. """
+  if not options.stream:
+    return None
+  if options.json:
+    output_format = JSON_FORMAT
+  elif options.csv:
+    output_format = CSV_FORMAT
+  else:
+    output_format = TEXT_FORMAT
+  return ReportSink(output_file=options.output_file, console=options.print_results, output_format=output_format, extractor=extractor)
+
+
+def validate_stream_options(options):
+  """ Exits if --stream is combined with options that need the whole report in memory or has nowhere to write to. """
+  if options.stream and (options.submit or options.previous_report):
+    log.error("The results are not kept in memory with --stream, it can't be combined with --submit or --previous-report.")
+    sys.exit(1)
+  if options.stream and not options.output_file and not options.print_results:
+    log.error("To use --stream, either the --print-results flag (to print to the console) or the --out flag (to write to a file) must be specified.")
+    sys.exit(1)
+
+
+def scan_targets(scanner, f_targets, filters, action, options, prefilter=None):
+  """ Queues every target in the scanner. If --since is present only the files changed since that revision are queued.
+
+  Returns the files changed or deleted since the revision (empty if --since is not present).
+  """
+  stale = set()
+  for f_target in f_targets:
+    log.info("scanning path: %s" % f_target)
+    if options.since:
+      changed, deleted = get_changed_files(base_path=f_target, since=options.since)
+      stale.update(changed)
+      stale.update(deleted)
+      scanner.scan_files(base_path=f_target, f_paths=changed, filters=filters, action=action, prefilter=prefilter)
+    else:
+      scanner.scan_directory(base_path=f_target, filters=filters, action=action, prefilter=prefilter)
+  return stale
+
+
+def merge_previous_report(report: Report, options, stale):
+  """ Merges the results of an incremental scan (--since) into the report passed with --previous-report.
+  """
+  if not options.previous_report:
+    return report
+  if not options.since:
+    log.warning("--previous-report is only used together with --since, ignoring it.")
+    return report
+  with open(options.previous_report) as f:
+    previous = Report.from_dict(load(f))
+  previous.remove_apis(stale)
+  for api in report.apis:
+    previous.add_api(api)
+  log.info("Merged %s APIs into the previous report (%s files changed or deleted)", len(report.apis), len(stale))
+  return previous
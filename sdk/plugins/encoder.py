@@ -0,0 +1,60 @@
+import zlib
+
+from ujson import dumps
+
+# size (in characters) of the pieces of the body handed to the http client
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json(value):
+  """ Yields the json of the value in small fragments so the whole document is never held in memory.
+
+  Dicts, lists, tuples and sets are walked, anything else is serialized with ujson (same output as ujson.dumps of the whole value).
+  """
+  if isinstance(value, dict):
+    yield '{'
+    first = True
+    for key, item in value.items():
+      if first:
+        first = False
+      else:
+        yield ','
+      yield dumps(key if isinstance(key, str) else str(key))
+      yield ':'
+      yield from iter_json(item)
+    yield '}'
+  elif isinstance(value, (list, tuple, set, frozenset)):
+    yield '['
+    first = True
+    for item in value:
+      if first:
+        first = False
+      else:
+        yield ','
+      yield from iter_json(item)
+    yield ']'
+  else:
+    yield dumps(value)
+
+
+def iter_chunks(fragments, compress=False, chunk_size=CHUNK_SIZE):
+  """ Joins the fragments in utf-8 chunks of about chunk_size, gzipped on the fly if compress is True. """
+  compressor = zlib.compressobj(wbits=31) if compress else None
+  buffer = []
+  size = 0
+  for fragment in fragments:
+    buffer.append(fragment)
+    size += len(fragment)
+    if size >= chunk_size:
+      data = ''.join(buffer).encode('utf-8')
+      buffer = []
+      size = 0
+      if compressor:
+        data = compressor.compress(data)
+      if data:
+        yield data
+  data = ''.join(buffer).encode('utf-8')
+  if compressor:
+    data = compressor.compress(data) + compressor.flush()
+  if data:
+    yield data
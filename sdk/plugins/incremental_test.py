@@ -0,0 +1,73 @@
+import os
+from argparse import Namespace
+
+from ujson import dump
+
+from sdk.plugins import merge_previous_report, scan_targets
+from sdk.scm.git.git_tools_test import create_repo, commit_all, git, write
+from sdk.types import API, Endpoint, Report
+
+
+class RecordingScanner(object):
+  def __init__(self):
+    self.files = []
+
+  def scan_files(self, base_path, f_paths, filters, action, prefilter=None):
+    self.files.extend(f_paths)
+
+
+def api(f_path, path):
+  return API(name=f_path, endpoints=[Endpoint(path=path, method="GET")])
+
+
+def write_report(f_path, apis):
+  with open(f_path, 'w') as f:
+    dump({'project_name': 'test', 'apis': [a.to_dict() for a in apis]}, f)
+  return f_path
+
+
+def test_renames_and_deletes(tmp_path):
+  base_path = str(tmp_path / "repo")
+  os.makedirs(base_path)
+  since = create_repo(base_path)
+  f_a, f_b, f_c, f_renamed = [os.path.join(base_path, "src", n) for n in ("a.py", "b.py", "c.py", "renamed.py")]
+  f_d = os.path.join(base_path, "docs", "d.md")
+  previous_report = write_report(str(tmp_path / "previous.json"), [api(f_a, "/a"), api(f_b, "/b"), api(f_c, "/c"), api(f_d, "/d")])
+
+  write(f_a, "a = 2\n" * 20)
+  os.remove(f_b)
+  git(base_path, "mv", "src/c.py", "src/renamed.py")
+  commit_all(base_path, "changes")
+
+  options = Namespace(since=since, previous_report=previous_report)
+  scanner = RecordingScanner()
+  stale = scan_targets(scanner, [base_path], filters=None, action=None, options=options)
+  assert sorted(scanner.files) == sorted([f_a, f_renamed])
+  assert stale == set([f_a, f_b, f_c, f_renamed])
+
+  # what the scan of the changed files found
+  report = Report(apis=set([api(f_a, "/a2"), api(f_renamed, "/c")]))
+  merged = merge_previous_report(report, options, stale)
+
+  assert merged.project_name == 'test'
+  assert merged.apis == set([api(f_a, "/a2"), api(f_renamed, "/c"), api(f_d, "/d")])
+
+
+def test_changed_file_without_apis(tmp_path):
+  f_a = str(tmp_path / "a.py")
+  previous_report = write_report(str(tmp_path / "previous.json"), [api(f_a, "/a")])
+  options = Namespace(since="HEAD~1", previous_report=previous_report)
+  # a.py changed and no longer has APIs
+  merged = merge_previous_report(Report(), options, set([f_a]))
+  assert merged.apis == set()
+
+
+def test_without_previous_report():
+  report = Report(apis=set([api("a.py", "/a")]))
+  assert merge_previous_report(report, Namespace(since="HEAD~1", previous_report=None), set()) is report
+
+
+def test_previous_report_without_since(tmp_path):
+  previous_report = write_report(str(tmp_path / "previous.json"), [api("b.py", "/b")])
+  report = Report(apis=set([api("a.py", "/a")]))
+  assert merge_previous_report(report, Namespace(since=None, previous_report=previous_report), set()) is report
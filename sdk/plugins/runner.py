@@ -1,16 +1,50 @@
 import logging
-from requests import post
+from itertools import islice
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
 from ujson import dumps
 from . import Plugin
-from time import gmtime, strftime, time
+from .encoder import iter_json, iter_chunks
+from time import gmtime, strftime, time, sleep
+from queue import Queue
+from threading import Thread
 
 log = logging.getLogger(__name__)
 
 # YYYY-MM-DDThh:mm:ssTZD
 
+# responses worth retrying (throttled or server side errors)
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+# upper limit for the wait between retries (including the Retry-After of the server)
+MAX_RETRY_DELAY = 60
+# limits of a single request of submit_batch (the size is measured before compression)
+MAX_BATCH_ITEMS = 100
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+# a 4xx response to a batch (endpoint missing in older servers, request too large, body not understood...) makes
+# submit_batch fall back to individual submissions, except for these: sending the results one by one doesn't help
+BATCH_NO_FALLBACK_STATUS_CODES = frozenset([401, 403, 429])
+# marker put in the upload queue to stop the uploader thread
+_STOP = object()
+
 
 class Runner(object):
-  def __init__(self, base_url=None):
+  """ Runner:
+
+      Submits the results of the plugins to levelops. The connections are kept alive and reused between submissions.
+
+      timeout: (connect, read) timeouts in seconds for every request.
+      retries: number of retries for connection errors, timeouts and 429/5xx responses. The wait between retries
+              doubles every time starting at 'backoff' seconds, unless the server asks for a specific wait (Retry-After).
+      compress: if True the request body is gzipped.
+
+      The request bodies are streamed (chunked transfer encoding): the json is encoded and compressed while it is sent,
+      so the submissions don't need a serialized copy of the results in memory.
+
+      submit_async queues the results to be submitted by a background thread, so the submissions overlap with the
+      scan of the next targets. drain waits for the queued submissions.
+  """
+  def __init__(self, base_url=None, timeout=(10, 300), retries=3, backoff=1, compress=True, pool_size=4):
     if not base_url or len(base_url.strip()) <= 0:
       self.base_url = "https://api.levelops.io"
     else:
@@ -19,6 +53,7 @@ class Runner(object):
       self.api_endpoint = self.base_url
     else:
       self.api_endpoint = '{base_url}/v1/plugins/results'.format(base_url=self.base_url)
+    self.batch_endpoint = self.api_endpoint + '/batch'
     self.metadata = {
         "version": "<runner version>",
         "os": "redhat8",
@@ -26,14 +61,124 @@ class Runner(object):
         "available_cores": "3ecu",
         "available_memory": "4GB"
     }
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.compress = compress
+    self.pool_size = pool_size
+    # created on the first submission, most runs never submit
+    self.session = None
+    self.uploader = None
+    self.uploads = None
+    self.upload_statuses = []
 
   def submit(self, plugin: Plugin, product_id: str, success: bool, results: dict, labels: dict, elapsed_time: int, token: str = None, tags: list = None):
-    self.metadata['execution'] = elapsed_time
+    """ Returns True if the results were accepted. """
     # for key in results:
     #   if not data[key]:
     #     data.pop(key, None)
-    log.debug(dumps(results, indent=2))
-    data = dumps({
+    if log.isEnabledFor(logging.DEBUG):
+      log.debug(dumps(results, indent=2))
+    envelope = self._get_envelope(plugin=plugin, product_id=product_id, success=success, results=results, labels=labels, elapsed_time=elapsed_time, tags=tags)
+
+    response = self._post(url=self.api_endpoint, body=lambda: iter_json(envelope), headers=self._get_headers(token))
+    if response.status_code == 202:
+      log.info("Results submited to the endpoint '%s'", self.api_endpoint)
+      log.debug("Response: %s", response.text)
+      return True
+    log.error("Results not accepted by the endpoint '%s': %s - %s : %s", self.api_endpoint, response.status_code, response.text, response.reason)
+    return False
+
+  def submit_batch(self, plugin: Plugin, product_id: str, success: bool, items: list, elapsed_time: int, token: str = None, tags: list = None):
+    """ Submits several results (ex: one per project) in as few requests as possible.
+
+    items: list of (results, labels) tuples, every item is sent as a full envelope (same as submit) in the 'items' of the request.
+    The items are streamed in the body of a request until MAX_BATCH_ITEMS items or MAX_BATCH_BYTES bytes are sent,
+    the rest go in the next requests. If the server rejects the batch with a 4xx response (other than 401, 403 and 429)
+    the items are submitted one by one, and so are the items of the later calls.
+    Returns the status of every item (True if accepted) in the same order as the items.
+    """
+    headers = self._get_headers(token)
+    envelopes = [self._get_envelope(plugin=plugin, product_id=product_id, success=success, results=results, labels=labels, elapsed_time=elapsed_time, tags=tags) for results, labels in items]
+    statuses = []
+    while len(statuses) < len(envelopes):
+      statuses.extend(self._submit_chunk(envelopes, len(statuses), headers))
+    endpoint = self.batch_endpoint or self.api_endpoint
+    if statuses.count(True) == len(statuses):
+      log.info("%s results submited to the endpoint '%s'", len(statuses), endpoint)
+    else:
+      log.error("%s out of %s results not accepted by the endpoint '%s'", statuses.count(False), len(statuses), endpoint)
+    return statuses
+
+  def submit_async(self, plugin: Plugin, product_id: str, success: bool, results: dict, labels: dict, elapsed_time: int, token: str = None, tags: list = None):
+    """ Queues the results to be submitted (same as submit) by the uploader thread and returns right away. """
+    if not self.uploader:
+      self.uploads = Queue()
+      self.uploader = Thread(name="Uploader", daemon=True, target=self._upload)
+      self.uploader.start()
+    self.uploads.put({'plugin': plugin, 'product_id': product_id, 'success': success, 'results': results, 'labels': labels, 'elapsed_time': elapsed_time, 'token': token, 'tags': tags})
+
+  def drain(self):
+    """ Waits for the results queued with submit_async to be submitted and stops the uploader thread.
+    Returns the status of every submission (True if accepted) in the order they were queued.
+    """
+    if not self.uploader:
+      return []
+    log.info("Waiting for the pending submissions...")
+    self.uploads.put(_STOP)
+    self.uploader.join()
+    self.uploader = None
+    # left behind if the uploader thread died
+    while not self.uploads.empty():
+      if self.uploads.get() is not _STOP:
+        log.error("The uploader stopped unexpectedly, the results were not submitted.")
+        self.upload_statuses.append(False)
+    statuses = self.upload_statuses
+    self.upload_statuses = []
+    return statuses
+
+  def _upload(self):
+    while True:
+      task = self.uploads.get()
+      if task is _STOP:
+        break
+      status = False
+      try:
+        status = self.submit(**task)
+      except Exception as e:
+        log.error("Couldn't submit the results", exc_info=True)
+      finally:
+        # recorded even if the thread dies, the statuses stay in the order of the submissions
+        self.upload_statuses.append(status)
+
+  def _submit_chunk(self, envelopes, start, headers):
+    """ Posts as many envelopes (from start) as fit in a request, returns the status of every envelope sent. """
+    if self.batch_endpoint is None:
+      return [self._post_single(envelopes[start], headers)]
+    # the number of envelopes sent is known once the body was streamed, retries send the same envelopes
+    sent = {'count': None}
+    response = self._post(url=self.batch_endpoint, body=lambda: _iter_batch(envelopes, start, sent), headers=headers)
+    count = sent['count']
+    if 400 <= response.status_code < 500 and response.status_code not in BATCH_NO_FALLBACK_STATUS_CODES:
+      log.warning("The endpoint '%s' didn't accept the batch (%s), submitting the results one by one.", self.batch_endpoint, response.status_code)
+      self.batch_endpoint = None
+      return [self._post_single(envelope, headers) for envelope in envelopes[start:start + count]]
+    if response.status_code not in (200, 202, 207):
+      log.error("Results not accepted by the endpoint '%s': %s - %s : %s", self.batch_endpoint, response.status_code, response.text, response.reason)
+      return [False] * count
+    return _get_item_statuses(response, count)
+
+  def _post_single(self, envelope, headers):
+    response = self._post(url=self.api_endpoint, body=lambda: iter_json(envelope), headers=headers)
+    if response.status_code != 202:
+      log.error("Results not accepted by the endpoint '%s': %s - %s : %s", self.api_endpoint, response.status_code, response.text, response.reason)
+    return response.status_code == 202
+
+  def _get_envelope(self, plugin, product_id, success, results, labels, elapsed_time, tags):
+    # copy, the uploader thread builds envelopes while the plugin submits others
+    metadata = dict(self.metadata)
+    metadata['execution'] = elapsed_time
+    return {
         "tool" : plugin.name,
         "version" : plugin.version,
         "timestamp": strftime('%Y-%m-%dT%H:%M:%S%z', gmtime(time()) ),
@@ -42,15 +187,102 @@ class Runner(object):
         "product_ids": product_id.split(','),
         "successful": success,
         "results": results,
-        "metadata": self.metadata
-    })
+        "metadata": metadata
+    }
+
+  def _get_headers(self, token):
     headers = {"Content-Type": "application/json"}
     if token:
         headers['Authorization'] = 'ApiKey ' + token
-    
-    response = post(url=self.api_endpoint, data=data, headers=headers)
-    if response.status_code == 202:
-      log.info("Results submited to the endpoint '%s'", self.api_endpoint)
-      log.debug("Response: %s", response.text)
-    else:
-      log.error("Results not accepted by the endpoint '%s': %s - %s : %s", self.api_endpoint, response.status_code, response.text, response.reason)
+    return headers
+
+  def close(self):
+    if self.session:
+      self.session.close()
+      self.session = None
+
+  def _get_session(self):
+    if not self.session:
+      session = Session()
+      adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      self.session = session
+    return self.session
+
+  def _post(self, url, body, headers):
+    """ Posts the json fragments returned by body() retrying on connection errors, timeouts and 429/5xx responses.
+    body is called for every attempt (a consumed generator can't be sent again).
+    Returns the last response, raises the last error if the request never got a response.
+    """
+    headers = dict(headers)
+    if self.compress:
+      headers['Content-Encoding'] = 'gzip'
+    attempt = 0
+    while True:
+      try:
+        response = self._get_session().post(url=url, data=iter_chunks(body(), compress=self.compress), headers=headers, timeout=self.timeout)
+      except (ConnectionError, Timeout) as e:
+        if attempt >= self.retries:
+          raise
+        delay = get_retry_delay(attempt, self.backoff)
+        log.warning("Request to '%s' failed (%s), retrying in %s seconds...", url, e, delay)
+      else:
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+          return response
+        delay = get_retry_delay(attempt, self.backoff, response)
+        log.warning("Request to '%s' returned %s, retrying in %s seconds...", url, response.status_code, delay)
+      sleep(delay)
+      attempt += 1
+
+
+def get_retry_delay(attempt, backoff, response=None):
+  """ Seconds to wait before retrying a request (attempt starts at 0): the Retry-After of the response if it has one,
+  otherwise backoff doubled on every attempt. Never more than MAX_RETRY_DELAY.
+  """
+  delay = backoff * (2 ** attempt)
+  retry_after = response.headers.get('Retry-After') if response is not None else None
+  if retry_after:
+    try:
+      delay = float(retry_after)
+    except ValueError:
+      # http date, not worth parsing
+      pass
+  return max(0, min(delay, MAX_RETRY_DELAY))
+
+
+def _get_item_statuses(response, count):
+  """ The batch response has the status of every item: {"items": [{"status": 202}, ...]}.
+  If the per item statuses are missing the status of the response applies to all of them.
+  """
+  try:
+    items = response.json().get('items')
+  except ValueError:
+    items = None
+  if not isinstance(items, list) or len(items) != count:
+    return [response.status_code in (200, 202)] * count
+  return [isinstance(item, dict) and item.get('status') in (200, 201, 202) for item in items]
+
+
+def _iter_batch(envelopes, start, sent):
+  """ Yields the json of a batch request with the envelopes from start until MAX_BATCH_ITEMS items or MAX_BATCH_BYTES
+  bytes (at least one envelope). The number of envelopes is stored in sent['count'], if it is already set
+  (retry) exactly that many envelopes are sent.
+  """
+  limit = sent['count']
+  count = 0
+  size = 0
+  yield '{"items":['
+  for envelope in islice(envelopes, start, None):
+    if limit is not None and count >= limit:
+      break
+    if limit is None and count > 0 and (count >= MAX_BATCH_ITEMS or size >= MAX_BATCH_BYTES):
+      break
+    if count > 0:
+      yield ','
+    for fragment in iter_json(envelope):
+      size += len(fragment)
+      yield fragment
+    count += 1
+  yield ']}'
+  sent['count'] = count
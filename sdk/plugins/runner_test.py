@@ -0,0 +1,381 @@
+import gzip
+import time
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.exceptions import ConnectionError, Timeout
+from ujson import dumps, loads
+
+from sdk.plugins import Plugin
+from sdk.plugins import runner as runner_module
+from sdk.plugins.runner import Runner
+
+plugin = Plugin(name="test_plugin", version="1")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+  """ Records the requests (path, headers, decoded body) and answers with the next response of the server plan:
+  a status code or a (status code, headers, body, delay) tuple. 202 when the plan is empty.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    if self.headers.get('Transfer-Encoding') == 'chunked':
+      body = b''
+      while True:
+        size = int(self.rfile.readline().strip(), 16)
+        if size == 0:
+          self.rfile.readline()
+          break
+        body += self.rfile.read(size)
+        self.rfile.readline()
+    else:
+      body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    raw = body
+    if self.headers.get('Content-Encoding') == 'gzip':
+      body = gzip.decompress(body)
+    self.server.requests.append({'path': self.path, 'headers': dict(self.headers), 'raw': raw, 'body': loads(body)})
+    response = self.server.plan.pop(0) if self.server.plan else 202
+    if callable(response):
+      response = response(self.server.requests[-1])
+    if not isinstance(response, tuple):
+      response = (response, {}, b'{}', 0)
+    status, headers, out, delay = response
+    if delay:
+      time.sleep(delay)
+    self.send_response(status)
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.send_header('Content-Length', str(len(out)))
+    self.end_headers()
+    self.wfile.write(out)
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(object):
+  def __init__(self, plan=None):
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    self.server.daemon_threads = True
+    self.server.requests = []
+    self.server.plan = list(plan or [])
+    self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+    threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+  @property
+  def requests(self):
+    return self.server.requests
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+
+def submit(runner, results=None, token="token"):
+  return runner.submit(plugin=plugin, product_id="1,2", success=True, results=results or {'a': [1, 2]}, labels={'l': 'v'}, elapsed_time=3, token=token, tags=['t'])
+
+
+def test_gzip_chunked_body():
+  server = StubServer()
+  try:
+    runner = Runner(base_url=server.url, backoff=0)
+    assert submit(runner)
+    request = server.requests[0]
+    assert request['path'] == '/v1/plugins/results'
+    assert request['headers']['Transfer-Encoding'] == 'chunked'
+    assert request['headers']['Content-Encoding'] == 'gzip'
+    assert request['headers']['Authorization'] == 'ApiKey token'
+    assert request['raw'][:2] == b'\x1f\x8b'
+    body = request['body']
+    assert body['tool'] == "test_plugin"
+    assert body['product_ids'] == ["1", "2"]
+    assert body['results'] == {'a': [1, 2]}
+    assert body['metadata']['execution'] == 3
+  finally:
+    server.close()
+
+
+def test_uncompressed_body():
+  server = StubServer()
+  try:
+    runner = Runner(base_url=server.url + '/v1/plugins/results', compress=False)
+    # big enough to be sent in several chunks
+    results = {'items': ["x" * 1000] * 200}
+    assert submit(runner, results=results)
+    request = server.requests[0]
+    assert request['path'] == '/v1/plugins/results'
+    assert 'Content-Encoding' not in request['headers']
+    assert request['headers']['Transfer-Encoding'] == 'chunked'
+    assert request['body']['results'] == results
+  finally:
+    server.close()
+
+
+def test_connections_are_reused():
+  server = StubServer()
+  try:
+    runner = Runner(base_url=server.url)
+    for _ in range(3):
+      assert submit(runner)
+    assert runner.session is not None
+    runner.close()
+    assert runner.session is None
+    assert len(server.requests) == 3
+  finally:
+    server.close()
+
+
+def test_retry_on_5xx():
+  server = StubServer(plan=[500, 503, 202])
+  try:
+    runner = Runner(base_url=server.url, backoff=0.01)
+    assert submit(runner)
+    assert len(server.requests) == 3
+    # the same body is sent again
+    assert server.requests[0]['body']['results'] == server.requests[2]['body']['results']
+  finally:
+    server.close()
+
+
+def test_retry_after():
+  server = StubServer(plan=[(429, {'Retry-After': '0.3'}, b'{}', 0), 202])
+  try:
+    # without Retry-After the wait would be 10 seconds
+    runner = Runner(base_url=server.url, backoff=10)
+    start = time.time()
+    assert submit(runner)
+    elapsed = time.time() - start
+    assert 0.3 <= elapsed < 5
+    assert len(server.requests) == 2
+  finally:
+    server.close()
+
+
+def test_retry_after_date_uses_backoff():
+  server = StubServer(plan=[(503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, b'{}', 0), 202])
+  try:
+    runner = Runner(base_url=server.url, backoff=0.01)
+    assert submit(runner)
+    assert len(server.requests) == 2
+  finally:
+    server.close()
+
+
+def test_gives_up_after_retries():
+  server = StubServer(plan=[503] * 10)
+  try:
+    runner = Runner(base_url=server.url, retries=2, backoff=0)
+    assert not submit(runner)
+    assert len(server.requests) == 3
+  finally:
+    server.close()
+
+
+def test_no_retry_on_4xx():
+  server = StubServer(plan=[400, 202])
+  try:
+    runner = Runner(base_url=server.url, backoff=0)
+    assert not submit(runner)
+    assert len(server.requests) == 1
+  finally:
+    server.close()
+
+
+def test_timeout():
+  server = StubServer(plan=[(202, {}, b'{}', 1)] * 3)
+  try:
+    runner = Runner(base_url=server.url, timeout=(1, 0.2), retries=1, backoff=0)
+    start = time.time()
+    try:
+      submit(runner)
+    except (ConnectionError, Timeout):
+      pass
+    else:
+      assert False, "the request should time out"
+    # tried twice, not waiting for the responses
+    assert len(server.requests) == 2
+    assert time.time() - start < 1.5
+  finally:
+    server.close()
+
+
+def test_timeout_then_success():
+  server = StubServer(plan=[(202, {}, b'{}', 1), 202])
+  try:
+    runner = Runner(base_url=server.url, timeout=(1, 0.2), backoff=0)
+    assert submit(runner)
+    assert len(server.requests) == 2
+  finally:
+    server.close()
+
+
+def test_connection_refused():
+  server = StubServer()
+  url = server.url
+  server.close()
+  runner = Runner(base_url=url, retries=1, backoff=0)
+  try:
+    submit(runner)
+  except ConnectionError:
+    pass
+  else:
+    assert False, "the request should fail"
+
+
+def submit_batch(runner, count):
+  items = [({'n': i}, {'project': str(i)}) for i in range(count)]
+  return runner.submit_batch(plugin=plugin, product_id="1", success=True, items=items, elapsed_time=3, token="token")
+
+
+def batch_response(request):
+  # 202 for every item but the second one
+  statuses = [{'status': 400 if i == 1 else 202} for i in range(len(request['body']['items']))]
+  return (207, {}, dumps({'items': statuses}).encode('utf-8'), 0)
+
+
+def test_batch():
+  server = StubServer(plan=[batch_response])
+  try:
+    runner = Runner(base_url=server.url)
+    assert submit_batch(runner, 3) == [True, False, True]
+    assert len(server.requests) == 1
+    request = server.requests[0]
+    assert request['path'] == '/v1/plugins/results/batch'
+    assert [item['results'] for item in request['body']['items']] == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert [item['labels'] for item in request['body']['items']] == [{'project': "0"}, {'project': "1"}, {'project': "2"}]
+  finally:
+    server.close()
+
+
+def test_batch_split(monkeypatch):
+  monkeypatch.setattr(runner_module, 'MAX_BATCH_ITEMS', 2)
+  server = StubServer()
+  try:
+    runner = Runner(base_url=server.url)
+    # 202 without per item statuses, applies to all the items of the request
+    assert submit_batch(runner, 5) == [True] * 5
+    assert [len(request['body']['items']) for request in server.requests] == [2, 2, 1]
+  finally:
+    server.close()
+
+
+def test_batch_retry_sends_the_same_items(monkeypatch):
+  monkeypatch.setattr(runner_module, 'MAX_BATCH_ITEMS', 2)
+  server = StubServer(plan=[503])
+  try:
+    runner = Runner(base_url=server.url, backoff=0)
+    assert submit_batch(runner, 3) == [True] * 3
+    assert [[item['results']['n'] for item in request['body']['items']] for request in server.requests] == [[0, 1], [0, 1], [2]]
+  finally:
+    server.close()
+
+
+def test_batch_fallback():
+  for status in (404, 405, 400, 413, 422):
+    server = StubServer(plan=[status, 202, 400, 202])
+    try:
+      runner = Runner(base_url=server.url)
+      assert submit_batch(runner, 3) == [True, False, True]
+      assert [request['path'] for request in server.requests] == ['/v1/plugins/results/batch'] + ['/v1/plugins/results'] * 3
+      assert [request['body']['results'] for request in server.requests[1:]] == [{'n': 0}, {'n': 1}, {'n': 2}]
+      # the batch endpoint is not tried again
+      assert submit_batch(runner, 1) == [True]
+      assert server.requests[-1]['path'] == '/v1/plugins/results'
+    finally:
+      server.close()
+
+
+def test_batch_no_fallback():
+  for status in (401, 403):
+    server = StubServer(plan=[status])
+    try:
+      runner = Runner(base_url=server.url)
+      assert submit_batch(runner, 2) == [False, False]
+      assert [request['path'] for request in server.requests] == ['/v1/plugins/results/batch']
+      assert runner.batch_endpoint is not None
+    finally:
+      server.close()
+
+
+def test_batch_server_error():
+  server = StubServer(plan=[500] * 3)
+  try:
+    runner = Runner(base_url=server.url, retries=2, backoff=0)
+    assert submit_batch(runner, 2) == [False, False]
+    assert len(server.requests) == 3
+  finally:
+    server.close()
+
+
+def submit_async(runner, n):
+  runner.submit_async(plugin=plugin, product_id="1", success=True, results={'n': n}, labels={}, elapsed_time=1, token="token")
+
+
+def test_drain_waits_for_the_submissions():
+  server = StubServer(plan=[(202, {}, b'{}', 0.2)] * 3)
+  try:
+    runner = Runner(base_url=server.url)
+    start = time.time()
+    for n in range(3):
+      submit_async(runner, n)
+    # queued, not sent yet
+    assert time.time() - start < 0.2
+    assert runner.drain() == [True, True, True]
+    assert [request['body']['results'] for request in server.requests] == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert runner.uploader is None
+    # nothing pending
+    assert runner.drain() == []
+  finally:
+    server.close()
+
+
+def test_drain_reports_failures():
+  server = StubServer(plan=[202, 400, 202])
+  try:
+    runner = Runner(base_url=server.url)
+    for n in range(3):
+      submit_async(runner, n)
+    assert runner.drain() == [True, False, True]
+  finally:
+    server.close()
+
+
+def test_drain_after_errors():
+  server = StubServer()
+  url = server.url
+  server.close()
+  runner = Runner(base_url=url, retries=0)
+  # connection refused
+  submit_async(runner, 0)
+  assert runner.drain() == [False]
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_drain_after_the_uploader_died(monkeypatch):
+  server = StubServer()
+  try:
+    runner = Runner(base_url=server.url)
+    submit = runner.submit
+    calls = []
+
+    def failing_submit(**kwargs):
+      calls.append(kwargs)
+      if len(calls) == 2:
+        # not an Exception, the thread dies
+        raise SystemExit()
+      return submit(**kwargs)
+
+    monkeypatch.setattr(runner, 'submit', failing_submit)
+    for n in range(4):
+      submit_async(runner, n)
+    result = {}
+    t = threading.Thread(target=lambda: result.update(statuses=runner.drain()), daemon=True)
+    t.start()
+    t.join(10)
+    assert not t.is_alive(), "drain didn't return"
+    assert result['statuses'] == [True, False, False, False]
+  finally:
+    server.close()
@@ -0,0 +1,24 @@
+from argparse import Namespace
+
+import pytest
+
+from sdk.plugins import validate_stream_options
+
+
+def options(**kwargs):
+  values = {'stream': True, 'submit': False, 'previous_report': None, 'output_file': "out.json", 'print_results': False}
+  values.update(kwargs)
+  return Namespace(**values)
+
+
+def test_valid():
+  validate_stream_options(options())
+  validate_stream_options(options(output_file=None, print_results=True))
+  # nothing to check without --stream
+  validate_stream_options(options(stream=False, submit=True, output_file=None))
+
+
+@pytest.mark.parametrize("kwargs", [{'submit': True}, {'previous_report': "previous.json"}, {'output_file': None}])
+def test_invalid(kwargs):
+  with pytest.raises(SystemExit):
+    validate_stream_options(options(**kwargs))
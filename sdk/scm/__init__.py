@@ -1,5 +1,6 @@
 import os
 from .git import get_project_name as get_git_project_name
+from .git import get_changed_files, get_head_commit, commit_exists, get_config_values
 
 
 def get_project_name(base_path):
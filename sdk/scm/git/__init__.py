@@ -1 +1 @@
-from .git_tools import get_project_name
\ No newline at end of file
+from .git_tools import get_project_name, get_changed_files, get_head_commit, commit_exists, get_config_values
\ No newline at end of file
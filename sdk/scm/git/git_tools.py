@@ -1,5 +1,6 @@
 import os
 import logging
+import subprocess
 from configparser import ConfigParser, DuplicateOptionError
 
 log = logging.getLogger(__name__)
@@ -41,4 +42,65 @@ def _extract_project_name_from_git_remote(section):
   project_name = url[url.rfind('/') + 1:].strip().replace('.git', '')
   if len(project_name) > 0:
     return project_name
-  return None
\ No newline at end of file
+  return None
+
+
+def get_changed_files(base_path, since, until='HEAD'):
+  """ Returns the files added or modified and the files deleted between the revisions 'since' and 'until'.
+  Only changes under base_path are considered, the paths are joined with base_path. Renamed files are reported
+  as a deletion of the old path and an addition of the new one.
+  """
+  args = ["git", "diff", "--name-status", "--no-color", "-z", "--relative", since, until, "--"]
+  p_diff = subprocess.run(args=args, cwd=base_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+  if p_diff.returncode != 0:
+    raise Exception("Couldn't get the changes between '%s' and '%s' for '%s': %s" % (since, until, base_path, p_diff.stderr.strip()))
+  changed = []
+  deleted = []
+  records = p_diff.stdout.split('\0')
+  i = 0
+  while i < len(records) - 1:
+    status = records[i][0]
+    if status in ('R', 'C'):
+      old_path, new_path = records[i + 1], records[i + 2]
+      if status == 'R':
+        deleted.append(os.path.join(base_path, old_path))
+      changed.append(os.path.join(base_path, new_path))
+      i += 3
+      continue
+    f_path = os.path.join(base_path, records[i + 1])
+    if status == 'D':
+      deleted.append(f_path)
+    else:
+      changed.append(f_path)
+    i += 2
+  log.debug("[%s] changed: %s, deleted: %s", base_path, len(changed), len(deleted))
+  return changed, deleted
+
+
+def get_head_commit(base_path):
+  """ Returns the commit (sha) of HEAD, None if base_path is not a git repository or it has no commits. """
+  p_rev = subprocess.run(args=["git", "rev-parse", "--verify", "-q", "HEAD"], cwd=base_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+  if p_rev.returncode != 0:
+    log.debug("[%s] Couldn't get the HEAD commit: %s", base_path, p_rev.stderr.strip())
+    return None
+  return p_rev.stdout.strip()
+
+
+def commit_exists(base_path, commit):
+  """ True if the commit is in the repository at base_path (ex: it wasn't lost with a force push or a shallow clone). """
+  p_cat = subprocess.run(args=["git", "cat-file", "-e", "%s^{commit}" % commit], cwd=base_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  return p_cat.returncode == 0
+
+
+def get_config_values(base_path, key):
+  """ Returns all the values of the git config key for the repository at base_path (including the global and system
+  configuration), an empty list if the key is not set or git is not available.
+  """
+  try:
+    p_config = subprocess.run(args=["git", "config", "--get-all", key], cwd=base_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+  except FileNotFoundError:
+    log.debug("git is not available, couldn't read the config key '%s'", key)
+    return []
+  if p_config.returncode != 0:
+    return []
+  return [x for x in p_config.stdout.splitlines() if x]
@@ -0,0 +1,90 @@
+import os
+import subprocess
+
+from sdk.scm.git.git_tools import get_changed_files, get_config_values
+
+
+def git(base_path, *args):
+  env = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@test", GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@test")
+  return subprocess.run(args=["git"] + list(args), cwd=base_path, env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+def write(f_path, content):
+  os.makedirs(os.path.dirname(f_path), exist_ok=True)
+  with open(f_path, 'w') as f:
+    f.write(content)
+
+
+def commit_all(base_path, message):
+  git(base_path, "add", "-A")
+  git(base_path, "commit", "-q", "-m", message)
+  return git(base_path, "rev-parse", "HEAD")
+
+
+def create_repo(base_path):
+  git(base_path, "init", "-q")
+  write(os.path.join(base_path, "src", "a.py"), "a = 1\n" * 20)
+  write(os.path.join(base_path, "src", "b.py"), "b = 1\n" * 20)
+  write(os.path.join(base_path, "src", "c.py"), "c = 1\n" * 20)
+  write(os.path.join(base_path, "docs", "d.md"), "d\n")
+  return commit_all(base_path, "initial")
+
+
+def test_changes(tmp_path):
+  base_path = str(tmp_path)
+  since = create_repo(base_path)
+  write(os.path.join(base_path, "src", "a.py"), "a = 2\n" * 20)
+  write(os.path.join(base_path, "src", "new file.py"), "n = 1\n")
+  os.remove(os.path.join(base_path, "src", "b.py"))
+  git(base_path, "mv", "src/c.py", "src/renamed.py")
+  commit_all(base_path, "changes")
+
+  changed, deleted = get_changed_files(base_path=base_path, since=since)
+
+  assert sorted(changed) == sorted([
+    os.path.join(base_path, "src", "a.py"),
+    os.path.join(base_path, "src", "new file.py"),
+    os.path.join(base_path, "src", "renamed.py")])
+  assert sorted(deleted) == sorted([
+    os.path.join(base_path, "src", "b.py"),
+    os.path.join(base_path, "src", "c.py")])
+
+
+def test_no_changes(tmp_path):
+  base_path = str(tmp_path)
+  since = create_repo(base_path)
+  assert get_changed_files(base_path=base_path, since=since) == ([], [])
+
+
+def test_relative_to_base_path(tmp_path):
+  base_path = str(tmp_path)
+  since = create_repo(base_path)
+  git(base_path, "mv", "src/c.py", "docs/c.py")
+  os.remove(os.path.join(base_path, "docs", "d.md"))
+  commit_all(base_path, "changes")
+
+  sub_path = os.path.join(base_path, "src")
+  changed, deleted = get_changed_files(base_path=sub_path, since=since)
+  # the rename out of src is only a deletion, docs is not under the base path
+  assert changed == []
+  assert deleted == [os.path.join(sub_path, "c.py")]
+
+
+def test_unknown_revision(tmp_path):
+  base_path = str(tmp_path)
+  create_repo(base_path)
+  try:
+    get_changed_files(base_path=base_path, since="0000000000000000000000000000000000000000")
+  except Exception as e:
+    assert "Couldn't get the changes" in str(e)
+  else:
+    assert False, "an unknown revision should raise"
+
+
+def test_get_config_values(tmp_path):
+  base_path = str(tmp_path)
+  create_repo(base_path)
+  assert get_config_values(base_path, "secrets.allowed") == []
+  git(base_path, "config", "--add", "secrets.allowed", "EXAMPLE")
+  git(base_path, "config", "--add", "secrets.allowed", "TEST[0-9]+")
+  assert get_config_values(base_path, "secrets.allowed") == ["EXAMPLE", "TEST[0-9]+"]
@@ -1,2 +1,3 @@
 from .api import API, Endpoint
-from .report import Report
\ No newline at end of file
+from .report import Report
+from .sink import ReportSink, JSON_FORMAT, CSV_FORMAT, TEXT_FORMAT
\ No newline at end of file
@@ -1,13 +1,27 @@
-from functools import reduce
+from sys import intern
+
 
 class Endpoint(object):
+  """ Immutable, the path and method are interned as the same values repeat a lot across the APIs of a scan. """
+  __slots__ = ('path', 'method', '_hash')
+
   def __init__(self, path, headers=None, params=None, produced_type=None, accepted_type=None, method=''):
-    self.path=path
     # self.headers=headers
     # self.params=params
     # self.produced_type=produced_type
     # self.accepted_type=accepted_type
-    self.method = method
+    path = intern(path) if type(path) is str else path
+    method = intern(method) if type(method) is str else method
+    object.__setattr__(self, 'path', path)
+    object.__setattr__(self, 'method', method)
+    object.__setattr__(self, '_hash', hash((path, method)))
+
+  def __setattr__(self, name, value):
+    raise Exception("Endpoint objects are immutable, create a new Endpoint instead.")
+
+  def __reduce__(self):
+    # the hash is not pickled, string hashes are different in every process
+    return (Endpoint, (self.path, None, None, None, None, self.method))
   
   def __eq__(self, other):
     # type: (API) -> bool
@@ -20,23 +34,55 @@ class Endpoint(object):
   
   def __hash__(self):
     # return hash((self.path, self.headers, self.params, self.produced_type, self.accepted_type))
-    return hash((self.path))
+    return self._hash
 
   def __str__(self):
-    return "path=%s, headers=%s, params=%s, produced_type=%s, accepted_type=%s" % (self.path, self.headers, self.params, self.produced_type, self.accepted_type)
+    return "path=%s, method=%s" % (self.path, self.method)
 
 
 class API(object):
-  def __init__(self, name, endpoints=None, base_path='', repo=None):
+  """ The endpoints can be added until the API is hashed (ex: added to a Report), from then on the API is frozen:
+  the endpoints become a frozenset and the hash is cached. 'extractor' is not part of the hash and can still be set.
+  """
+  __slots__ = ('name', 'base_path', 'endpoints', 'extractor', '_hash')
+
+  def __init__(self, name, endpoints=None, base_path='', repo=None, extractor=None):
     self.name = name
     self.base_path = base_path
-    if not endpoints:
-      endpoints = set()
-    self.endpoints = endpoints
+    self.endpoints = set(endpoints) if endpoints else set()
+    # name of the plugin that found the API, set when several extractors contribute to the same report
+    self.extractor = extractor
+    self._hash = None
     # self.repo = repo
   
   def add_endpoint(self, endpoint):
+    if self._hash is not None:
+      raise Exception("Can't add endpoints to the API '%s', it is frozen (already hashed)." % self.name)
     self.endpoints.add(endpoint)
+
+  def freeze(self):
+    if self._hash is None:
+      self.endpoints = frozenset(self.endpoints)
+      self._hash = hash((self.name, self.base_path, self.endpoints))
+
+  def __reduce__(self):
+    # the hash is not pickled, string hashes are different in every process
+    return (API, (self.name, list(self.endpoints), self.base_path, None, self.extractor))
+
+  def to_dict(self):
+    data = {'name': self.name, 'base_path': self.base_path, 'endpoints': [{'path': e.path, 'method': e.method} for e in self.endpoints]}
+    if self.extractor is not None:
+      data['extractor'] = self.extractor
+    return data
+
+  def toDict(self):
+    # used by ujson.dumps (instead of the attributes) so the extractor is omitted when it is not set
+    return self.to_dict()
+
+  @staticmethod
+  def from_dict(data):
+    endpoints = [Endpoint(path=endpoint['path'], method=endpoint.get('method', '')) for endpoint in data.get('endpoints', [])]
+    return API(name=data['name'], endpoints=endpoints, base_path=data.get('base_path', ''), extractor=data.get('extractor'))
   
   def __eq__(self, other):
     # type: (API) -> bool
@@ -46,16 +92,14 @@ class API(object):
             # and self.repo == other.repo \
   
   def __hash__(self):
-    if len(self.endpoints) > 0:
-      end_h = reduce(lambda x,y: x.__hash__() + y.__hash__(), self.endpoints)
-    else:
-      end_h = ""
     # return hash((self.name, self.base_path, self.repo, end_h ))
-    return hash((self.name, self.base_path, end_h ))
+    if self._hash is None:
+      self.freeze()
+    return self._hash
   
   def __str__(self):
     # return "name=%s, base_path=%s, repo=%s, endpoints=%s" % (self.name, self.base_path, self.repo, [str(x) for x in self.endpoints])
-    return "name=%s, base_path=%s, repo=%s, endpoints=%s" % (self.name, self.base_path, [str(x) for x in self.endpoints])
+    return "name=%s, base_path=%s, endpoints=%s" % (self.name, self.base_path, [str(x) for x in self.endpoints])
 
 
 
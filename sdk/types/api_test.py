@@ -0,0 +1,117 @@
+import os
+import sys
+import pickle
+import subprocess
+
+from ujson import dumps, loads
+
+from sdk.types import API, Endpoint, Report
+
+
+def test_to_dict():
+  api = API(name="a.py", endpoints=[Endpoint(path="/a", method="GET")], base_path="/api", extractor="flask")
+  assert api.to_dict() == {'name': "a.py", 'base_path': "/api", 'extractor': "flask", 'endpoints': [{'path': "/a", 'method': "GET"}]}
+  assert API.from_dict(api.to_dict()).extractor == "flask"
+
+
+def test_to_dict_without_extractor():
+  api = API(name="a.py", endpoints=[Endpoint(path="/a", method="GET")])
+  assert api.to_dict() == {'name': "a.py", 'base_path': "", 'endpoints': [{'path': "/a", 'method': "GET"}]}
+  assert API.from_dict(api.to_dict()).extractor is None
+
+
+def test_dumps():
+  report = Report()
+  report.project_name = "p"
+  report.add_api(API(name="a.py", endpoints=[Endpoint(path="/a", method="GET")]))
+  report.add_api(API(name="b.py", endpoints=[Endpoint(path="/b", method="POST")], extractor="flask"))
+  data = loads(dumps(report))
+  assert data['project_name'] == "p"
+  assert sorted(data['apis'], key=lambda api: api['name']) == [
+    {'name': "a.py", 'base_path': "", 'endpoints': [{'path': "/a", 'method': "GET"}]},
+    {'name': "b.py", 'base_path': "", 'extractor': "flask", 'endpoints': [{'path': "/b", 'method': "POST"}]}]
+  assert Report.from_dict(data).apis == report.apis
+
+
+def test_endpoint_is_immutable():
+  endpoint = Endpoint(path="/a", method="GET")
+  try:
+    endpoint.path = "/b"
+  except Exception as e:
+    assert "immutable" in str(e)
+  else:
+    assert False, "an Endpoint should be immutable"
+  assert endpoint.path == "/a"
+
+
+def test_endpoint_hash():
+  assert Endpoint(path="/a", method="GET") == Endpoint(path="/a", method="GET")
+  assert hash(Endpoint(path="/a", method="GET")) == hash(Endpoint(path="/a", method="GET"))
+  assert Endpoint(path="/a", method="GET") != Endpoint(path="/a", method="POST")
+  assert len(set([Endpoint(path="/a"), Endpoint(path="/a"), Endpoint(path="/b")])) == 2
+
+
+def test_endpoint_strings_are_interned():
+  path = "".join(["/a/", "long/", "path"])
+  assert Endpoint(path=path).path is Endpoint(path="/a/long/path").path
+
+
+def test_api_freeze():
+  api = API(name="a.py")
+  api.add_endpoint(Endpoint(path="/a"))
+  h = hash(api)
+  assert isinstance(api.endpoints, frozenset)
+  try:
+    api.add_endpoint(Endpoint(path="/b"))
+  except Exception as e:
+    assert "frozen" in str(e)
+  else:
+    assert False, "a hashed API should be frozen"
+  # the extractor is not part of the hash
+  api.extractor = "flask"
+  assert hash(api) == h
+  assert api == API(name="a.py", endpoints=[Endpoint(path="/a")])
+
+
+def test_api_hash():
+  a = API(name="a.py", endpoints=[Endpoint(path="/a"), Endpoint(path="/b")])
+  b = API(name="a.py", endpoints=[Endpoint(path="/b"), Endpoint(path="/a")], extractor="flask")
+  assert a == b and hash(a) == hash(b)
+  assert len(set([a, b, API(name="a.py", endpoints=[Endpoint(path="/a")]), API(name="b.py", endpoints=[Endpoint(path="/a")])])) == 3
+  assert API(name="a.py", base_path="/api") != API(name="a.py")
+
+
+def test_api_has_no_dict():
+  api = API(name="a.py")
+  try:
+    api.other = 1
+  except AttributeError:
+    pass
+  else:
+    assert False, "API uses slots"
+
+
+def test_pickle():
+  api = API(name="a.py", endpoints=[Endpoint(path="/a", method="GET")], base_path="/api", extractor="flask")
+  hash(api)
+  copy = pickle.loads(pickle.dumps(api))
+  assert copy == api
+  assert copy.extractor == "flask"
+  assert copy.base_path == "/api"
+  # the copy is not frozen, the hash is computed again in the process that loads it
+  assert copy._hash is None
+  assert hash(copy) == hash(api)
+  assert isinstance(pickle.loads(pickle.dumps(Endpoint(path="/a", method="GET"))), Endpoint)
+
+
+def test_pickle_other_process():
+  # string hashes differ between processes, the hash must not travel with the pickle
+  api = API(name="a.py", endpoints=[Endpoint(path="/a", method="GET")])
+  hash(api)
+  code = "import pickle, sys; api = pickle.loads(sys.stdin.buffer.read()); sys.stdout.buffer.write(pickle.dumps(api))"
+  env = dict(os.environ, PYTHONHASHSEED="123", PYTHONPATH=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+  p = subprocess.run([sys.executable, "-c", code], input=pickle.dumps(api), stdout=subprocess.PIPE, env=env, check=True)
+  copy = pickle.loads(p.stdout)
+  assert copy == api
+  assert hash(copy) == hash(api)
+  assert api in set([copy])
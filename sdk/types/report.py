@@ -1,3 +1,7 @@
+from threading import Lock
+
+from .api import API
+
 
 class Report(object):
   def __init__(self, apis=None, repo=None, commit=None, tags=None):
@@ -8,9 +12,34 @@ class Report(object):
       apis = set()
     self.apis = apis
     self.project_name = ''
+    # the workers add APIs concurrently (underscore so it is not part of the json output)
+    self._lock = Lock()
   
   def add_api(self, api):
-    self.apis.add(api)
+    # hashed (and frozen) outside of the lock
+    hash(api)
+    with self._lock:
+      self.apis.add(api)
+
+  def remove_apis(self, names):
+    """ Removes the APIs with the given names (the file they were extracted from). """
+    names = set(names)
+    with self._lock:
+      self.apis = set([api for api in self.apis if api.name not in names])
+
+  def to_dict(self):
+    return {'apis': [api.to_dict() for api in self.apis], 'project_name': self.project_name}
+
+  def toDict(self):
+    # used by ujson.dumps instead of the attributes
+    return self.to_dict()
+
+  @staticmethod
+  def from_dict(data):
+    """ Loads a report previously written as json. """
+    report = Report(apis=set([API.from_dict(api) for api in data.get('apis', [])]))
+    report.project_name = data.get('project_name', '')
+    return report
   
   def __str__(self):
     # return "repo=%s, commit=%s, tags=%s, apis=%s" % (self.repo, self.commit, self.tags, [str(x) for x in self.apis])
@@ -0,0 +1,89 @@
+import sys
+import logging
+
+from threading import Lock
+from ujson import dumps
+
+log = logging.getLogger(__name__)
+
+JSON_FORMAT = 'json'
+CSV_FORMAT = 'csv'
+TEXT_FORMAT = 'text'
+SINK_FORMATS = [JSON_FORMAT, CSV_FORMAT, TEXT_FORMAT]
+
+
+class ReportSink(object):
+  """ ReportSink:
+
+      Writes the APIs as soon as they are emitted instead of collecting them in a Report, so the memory used doesn't
+      grow with the size of the scan and the output can be consumed while the scan is still running.
+
+      json: one API per line (NDJSON) with the endpoints that were not written before.
+      csv / text: one line per endpoint, same columns as the (non streaming) output of the plugins.
+              If 'extractor' is True the name of the plugin that found the API is added as a last column.
+
+      An endpoint (API name, path and method) is only written once, only the hash of the endpoints already written is kept.
+      'emit' is thread safe so it can be used as the Scanner collector.
+  """
+  def __init__(self, output_file=None, console=False, output_format=TEXT_FORMAT, extractor=False):
+    if output_format not in SINK_FORMATS:
+      raise Exception("Unsupported output format '%s', the supported formats are: %s" % (output_format, SINK_FORMATS))
+    self.output_file = output_file
+    self.output_format = output_format
+    self.extractor = extractor
+    self.streams = []
+    if output_file:
+      self.streams.append(open(output_file, 'w'))
+    if console:
+      self.streams.append(sys.stdout)
+    self.lock = Lock()
+    self.seen = set()
+    self.closed = False
+    if output_format == CSV_FORMAT:
+      self._write("reference, api_endpoint, extractor\n" if extractor else "reference, api_endpoint\n")
+
+  def emit(self, api):
+    with self.lock:
+      endpoints = [endpoint for endpoint in api.endpoints if self._first_time(api, endpoint)]
+      if not endpoints:
+        return
+      self._write(self._format(api, endpoints))
+
+  def close(self):
+    with self.lock:
+      if self.closed:
+        return
+      self.closed = True
+      for stream in self.streams:
+        if stream is sys.stdout:
+          stream.flush()
+        else:
+          stream.close()
+    log.info("%s endpoints written", len(self.seen))
+
+  def _first_time(self, api, endpoint):
+    # must be called holding the lock
+    key = hash((api.name, endpoint.path, endpoint.method))
+    if key in self.seen:
+      return False
+    self.seen.add(key)
+    return True
+
+  def _format(self, api, endpoints):
+    if self.output_format == JSON_FORMAT:
+      data = api.to_dict()
+      data['endpoints'] = [{'path': e.path, 'method': e.method} for e in endpoints]
+      return dumps(data, escape_forward_slashes=False) + "\n"
+    if self.output_format == CSV_FORMAT:
+      line = "%s,%s,%s\n" if self.extractor else "%s,%s\n"
+    else:
+      line = "%s     %s     %s\n" if self.extractor else "%s     %s\n"
+    if self.extractor:
+      return "".join([line % (api.name, e.path, api.extractor) for e in endpoints])
+    return "".join([line % (api.name, e.path) for e in endpoints])
+
+  def _write(self, data):
+    # must be called holding the lock, flushed so the output can be consumed during the scan
+    for stream in self.streams:
+      stream.write(data)
+      stream.flush()
@@ -0,0 +1,95 @@
+import threading
+
+from ujson import loads
+
+from sdk.types import API, Endpoint, ReportSink, JSON_FORMAT, CSV_FORMAT, TEXT_FORMAT
+
+
+def api(name, paths, extractor=None):
+  return API(name=name, endpoints=[Endpoint(path=p, method="GET") for p in paths], extractor=extractor)
+
+
+def read(f_path):
+  with open(f_path) as f:
+    return f.read()
+
+
+def test_json(tmp_path):
+  f_out = str(tmp_path / "out.json")
+  sink = ReportSink(output_file=f_out, output_format=JSON_FORMAT)
+  sink.emit(api("a.py", ["/a"]))
+  sink.emit(api("b.py", ["/b1", "/b2"], extractor="flask"))
+  sink.close()
+  lines = [loads(line) for line in read(f_out).splitlines()]
+  assert lines[0] == {'name': "a.py", 'base_path': "", 'endpoints': [{'path': "/a", 'method': "GET"}]}
+  assert lines[1]['extractor'] == "flask"
+  assert sorted(e['path'] for e in lines[1]['endpoints']) == ["/b1", "/b2"]
+
+
+def test_json_dedup(tmp_path):
+  f_out = str(tmp_path / "out.json")
+  sink = ReportSink(output_file=f_out, output_format=JSON_FORMAT)
+  sink.emit(api("a.py", ["/a1"]))
+  # only the new endpoint is written
+  sink.emit(api("a.py", ["/a1", "/a2"]))
+  # nothing new, no line
+  sink.emit(api("a.py", ["/a2"]))
+  # same path, different file
+  sink.emit(api("b.py", ["/a1"]))
+  sink.close()
+  lines = [loads(line) for line in read(f_out).splitlines()]
+  assert [(line['name'], [e['path'] for e in line['endpoints']]) for line in lines] == [("a.py", ["/a1"]), ("a.py", ["/a2"]), ("b.py", ["/a1"])]
+  assert len(sink.seen) == 3
+
+
+def test_csv(tmp_path):
+  f_out = str(tmp_path / "out.csv")
+  sink = ReportSink(output_file=f_out, output_format=CSV_FORMAT)
+  sink.emit(api("a.py", ["/a"]))
+  sink.emit(api("a.py", ["/a"]))
+  sink.close()
+  assert read(f_out) == "reference, api_endpoint\na.py,/a\n"
+
+
+def test_csv_extractor(tmp_path):
+  f_out = str(tmp_path / "out.csv")
+  sink = ReportSink(output_file=f_out, output_format=CSV_FORMAT, extractor=True)
+  sink.emit(api("a.py", ["/a"], extractor="flask"))
+  sink.close()
+  assert read(f_out) == "reference, api_endpoint, extractor\na.py,/a,flask\n"
+
+
+def test_text_console(capsys):
+  sink = ReportSink(console=True, output_format=TEXT_FORMAT)
+  sink.emit(api("a.py", ["/a"]))
+  sink.close()
+  sink.close()
+  assert capsys.readouterr().out == "a.py     /a\n"
+
+
+def test_concurrent_emit(tmp_path):
+  f_out = str(tmp_path / "out.csv")
+  sink = ReportSink(output_file=f_out, output_format=CSV_FORMAT)
+
+  def emit():
+    for i in range(200):
+      sink.emit(api("a.py", ["/%s" % i]))
+
+  threads = [threading.Thread(target=emit) for _ in range(4)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  sink.close()
+  lines = read(f_out).splitlines()
+  assert lines[0] == "reference, api_endpoint"
+  assert sorted(lines[1:]) == sorted("a.py,/%s" % i for i in range(200))
+
+
+def test_unsupported_format():
+  try:
+    ReportSink(output_format="xml")
+  except Exception as e:
+    assert "Unsupported output format" in str(e)
+  else:
+    assert False, "an unsupported format should raise"
@@ -1,10 +1,13 @@
 
 import logging
+import json
 import shlex
 import subprocess
 import os
 
 from shutil import rmtree
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
 
 from sdk.scm import get_project_name
 
@@ -23,20 +26,50 @@ class ToolRunner(object):
         Global vars for replacement:
             - base_path = the path to the directory being scanned
             - project_name = the name of the project being scanned. the name is obtainned from the git config file or from the name of the directory.
+
+        max_concurrent: maximum number of tool processes running at the same time for the scans queued with 'submit'.
+        cpu_limit: optional limit of cpu time (seconds) for every tool process.
+        memory_limit: optional limit of memory (address space, bytes) for every tool process.
+                The limits are set by a shell (ulimit) that then executes the command, they are inherited by the
+                children of the tool (posix only).
+        docker: if True the command runs the tool in a container (docker run / docker exec). The limits are not applied to
+                the docker client, they are passed to docker instead: the 'docker_limits' variable has the docker run
+                arguments (--memory, --cpus, --ulimit cpu) and 'start_container' applies them to the container.
+        cpus: optional number of cpus for the tool containers (docker only).
+
+        Container reuse: instead of a 'docker run' per scan, 'start_container' starts a single container of the tool image
+        with all the targets mounted and the command runs the scans in it with 'docker exec'. Extra vars for replacement:
+            - container = the id of the container
+            - container_path = the path where the directory being scanned is mounted in the container
+            - entrypoint = the entrypoint of the image (the container itself runs an idle process)
+        The container is removed by 'cleanup'. The memory and cpus limits of a reused container are shared by all the scans.
     """
-    def __init__(self, command: str, max_concurrent: int = 2, error_codes: set = None, keep_tmp_files=False):
+    def __init__(self, command: str, max_concurrent: int = 2, error_codes: set = None, keep_tmp_files=False, cpu_limit: int = None, memory_limit: int = None, docker: bool = False, cpus: float = None):
         self.command = command
         self.tmp_locations = set()
         self.everything_ok = True
         self.errors = []
+        self.failed_projects = set()
         self.error_codes = set()
         self.keep_tmp_files = keep_tmp_files
         if error_codes:
             self.error_codes.update(error_codes)
         else:
             self.error_codes.update(ERRORS)
+        self.max_concurrent = max_concurrent
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.docker = docker
+        self.cpus = cpus
+        # the scans submitted run in parallel and share the state above
+        self.lock = Lock()
+        self.executor = None
+        self.futures = []
+        self.container = None
+        self.container_paths = {}
+        self.entrypoint = ""
 
-    def scan_directory(self, base_path: str, params: dict, tmp_location: str):
+    def scan_directory(self, base_path: str, params: dict, tmp_location: str, line_handler=None):
         """ Scans a directory.
             the params will be used to dynamnicaly replace the command template provided during the instantiation of the class ToolRunner.
 
@@ -44,37 +77,182 @@ class ToolRunner(object):
                 * base_path = the path to the directory being scanned
                 * project_name = the name of the project being scanned. the name is obtainned from the git config file or from the name of the directory.
                 * params = all variables/values passed as parameters will be used to replace vars in the command template
+
+            Runs the tool in the calling thread, use 'submit' to run several scans in parallel.
+
+            line_handler: optional callable, if present it gets every line of the output of the tool as soon as it is
+                    written (the output is not kept and the returned stdout is None).
         """
         # Get project name
         project_name = get_project_name(base_path=base_path)
+        variables = self._get_variables(base_path=base_path, project_name=project_name)
         # Add tmp location
-        t_location = tmp_location.format(base_path=base_path, project_name=project_name , **params).format(base_path=base_path, project_name=project_name)
-        self.tmp_locations.add(t_location)
-        if not os.path.exists(t_location):
-            os.mkdir(t_location)
+        t_location = tmp_location.format(**variables, **params).format(**variables)
+        with self.lock:
+            self.tmp_locations.add(t_location)
+        # several scans can share the location
+        os.makedirs(t_location, exist_ok=True)
         # parse cmd template
-        cmd = self.command.format(base_path=base_path, project_name=project_name, **params).format(base_path=base_path, project_name=project_name)
+        cmd = self.command.format(**variables, **params).format(**variables)
         log.debug("Command -> %s", cmd)
         # run command
-        tool = subprocess.run(args=shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        tool = subprocess.Popen(args=self._get_limits_prefix() + shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if line_handler:
+            stdout = None
+            stderr = self._stream_output(tool, line_handler)
+        else:
+            stdout, stderr = tool.communicate()
         log.debug("Args: %s", tool.args)
         if tool.returncode in self.error_codes:
-            message = "[%s] %s. scan path: %s" % (project_name, tool.stderr, base_path)
-            self.errors.append(message)
+            message = "[%s] %s. scan path: %s" % (project_name, stderr, base_path)
             log.debug(message)
-            self.everything_ok = False
-        return project_name, tool.stdout, tool.stderr
+            with self.lock:
+                self.errors.append(message)
+                self.everything_ok = False
+                self.failed_projects.add(project_name)
+        return project_name, stdout, stderr
+
+    def submit(self, base_path: str, params: dict, tmp_location: str, line_handler=None):
+        """ Queues the scan of a directory (same as scan_directory), up to 'max_concurrent' scans run at the same time.
+            Returns a Future with the result of the scan: (project_name, stdout, stderr).
+        """
+        with self.lock:
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="ToolRunner")
+            future = self.executor.submit(self.scan_directory, base_path, params, tmp_location, line_handler)
+            self.futures.append(future)
+        return future
+
+    def start_container(self, image: str, targets: list, volumes: list = None, user: str = None, mount_base: str = "/code"):
+        """ Starts a container of the image that stays alive until 'cleanup', every target is mounted at <mount_base>/<n>.
+            volumes: extra volumes ("<host path>:<container path>").
+            user: optional user (uid:gid) the container runs as.
+        """
+        inspect = subprocess.run(args=["docker", "inspect", "--format", "{{json .Config.Entrypoint}}", image], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if inspect.returncode != 0:
+            raise Exception("Couldn't inspect the image '%s': %s" % (image, inspect.stderr.strip()))
+        entrypoint = json.loads(inspect.stdout.strip() or "null") or []
+        self.entrypoint = " ".join([shlex.quote(x) for x in entrypoint])
+        args = ["docker", "run", "-d", "--rm", "--entrypoint", "tail"]
+        for n, target in enumerate(targets):
+            self.container_paths[target] = "%s/%s" % (mount_base, n)
+            args.extend(["-v", "%s:%s" % (os.path.abspath(target), self.container_paths[target])])
+        for volume in volumes or []:
+            args.extend(["-v", volume])
+        if user:
+            args.extend(["--user", user])
+        args.extend(self._get_docker_limits())
+        args.extend([image, "-f", "/dev/null"])
+        log.debug("Container args: %s", args)
+        run = subprocess.run(args=args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if run.returncode != 0:
+            raise Exception("Couldn't start a container of the image '%s': %s" % (image, run.stderr.strip()))
+        self.container = run.stdout.strip()
+        log.info("Started the container %s (%s) for %s targets", self.container[:12], image, len(targets))
+        return self.container
+
+    def stop_container(self):
+        if not self.container:
+            return
+        stop = subprocess.run(args=["docker", "rm", "-f", self.container], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if stop.returncode != 0:
+            log.warning("Couldn't remove the container %s: %s", self.container, stop.stderr.strip())
+        self.container = None
+
+    def _get_variables(self, base_path, project_name):
+        variables = {"base_path": base_path, "project_name": project_name, "docker_limits": " ".join([shlex.quote(x) for x in self._get_docker_limits()])}
+        if self.container:
+            variables.update({"container": self.container, "container_path": self.container_paths.get(base_path, base_path), "entrypoint": self.entrypoint})
+        return variables
+
+    def _stream_output(self, tool, line_handler):
+        """ Hands the stdout lines to the handler while stderr is collected by another thread (so neither pipe fills up).
+            Returns the stderr. If the handler fails the tool is killed.
+        """
+        stderr_lines = []
+        reader = Thread(name="ToolRunner-stderr", daemon=True, target=_read_lines, args=(tool.stderr, stderr_lines))
+        reader.start()
+        try:
+            for line in tool.stdout:
+                line_handler(line)
+        except:
+            tool.kill()
+            raise
+        finally:
+            tool.stdout.close()
+            tool.wait()
+            reader.join()
+        return ''.join(stderr_lines)
+
+    def _get_limits_prefix(self):
+        """ Returns the args that run the command in a shell with the limits set (ulimit), empty if there are no limits.
+
+            The limits are not set with a preexec_fn since running python code between fork and exec is not safe when
+            the process has threads (the scans run in a thread pool).
+        """
+        if self.docker or (not self.cpu_limit and not self.memory_limit):
+            return []
+        if os.name != "posix":
+            log.warning("The cpu and memory limits are not supported in this platform, ignoring them.")
+            return []
+        limits = []
+        if self.cpu_limit:
+            limits.append("ulimit -t %d" % self.cpu_limit)
+        if self.memory_limit:
+            # ulimit -v is in kilobytes
+            limits.append("ulimit -v %d" % (self.memory_limit // 1024))
+        return ["sh", "-c", "%s && exec \"$@\"" % " && ".join(limits), "sh"]
+
+    def _get_docker_limits(self):
+        """ The limits as docker run arguments (empty if docker is False). """
+        if not self.docker:
+            return []
+        args = []
+        if self.memory_limit:
+            # same value for the swap so the limit is not doubled by it
+            args.extend(["--memory", str(self.memory_limit), "--memory-swap", str(self.memory_limit)])
+        if self.cpus:
+            args.extend(["--cpus", str(self.cpus)])
+        if self.cpu_limit:
+            args.extend(["--ulimit", "cpu=%s:%s" % (self.cpu_limit, self.cpu_limit)])
+        return args
     
     def get_tmp_locations(self):
-        return self.tmp_locations
+        # copy, the running scans keep adding locations
+        with self.lock:
+            return set(self.tmp_locations)
 
     def are_all_successes(self):
         return self.everything_ok
+
+    def is_success(self, project_name: str):
+        """ True if none of the scans of the project failed so far. """
+        return project_name not in self.failed_projects
     
     def wait_and_finish(self):
-        pass
+        """ Waits for the scans queued with 'submit', returns their results (project_name, stdout, stderr) in the order they were submitted. """
+        results = []
+        while True:
+            with self.lock:
+                futures = self.futures
+                self.futures = []
+            if not futures:
+                break
+            results.extend([future.result() for future in futures])
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+        return results
 
     def cleanup(self):
+        if self.executor:
+            # stop the pending scans and wait for the running ones before removing their files
+            with self.lock:
+                for future in self.futures:
+                    future.cancel()
+            self.executor.shutdown()
+            self.executor = None
+        self.stop_container()
         if self.keep_tmp_files:
             return
         for location in self.tmp_locations:
@@ -85,3 +263,9 @@ class ToolRunner(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cleanup()
+
+
+def _read_lines(stream, lines):
+    for line in stream:
+        lines.append(line)
+    stream.close()
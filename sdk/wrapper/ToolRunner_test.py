@@ -0,0 +1,161 @@
+import os
+import time
+
+import pytest
+
+from sdk.wrapper import ToolRunner
+
+
+def run(tmp_path, command, **kwargs):
+  with ToolRunner(command=command, **kwargs) as runner:
+    project_name, stdout, stderr = runner.scan_directory(base_path=str(tmp_path), params={}, tmp_location=str(tmp_path / "tmp"))
+  return stdout
+
+
+def test_limits(tmp_path):
+  stdout = run(tmp_path, "sh -c 'ulimit -t; ulimit -v'", cpu_limit=30, memory_limit=512 * 1024 * 1024)
+  # ulimit -v is in KB
+  assert stdout.split() == ["30", str(512 * 1024)]
+
+
+def test_limits_with_submit(tmp_path):
+  # the scans run in the thread pool, the args are passed as they are to the tool
+  with ToolRunner(command="sh -c 'ulimit -t; echo \"$0\"' 'a b'", cpu_limit=30) as runner:
+    future = runner.submit(base_path=str(tmp_path), params={}, tmp_location=str(tmp_path / "tmp"))
+    project_name, stdout, stderr = future.result()
+  assert stdout.splitlines() == ["30", "a b"]
+
+
+def test_no_limits(tmp_path):
+  stdout = run(tmp_path, "sh -c 'ulimit -t; ulimit -v'")
+  assert stdout.split() == ["unlimited", "unlimited"]
+
+
+def test_docker_limits(tmp_path):
+  command = "sh -c 'echo {docker_limits}; ulimit -t; ulimit -v'"
+  stdout = run(tmp_path, command, cpu_limit=30, memory_limit=1024, cpus=1.5, docker=True)
+  # the docker client itself is not limited
+  assert stdout.splitlines() == ["--memory 1024 --memory-swap 1024 --cpus 1.5 --ulimit cpu=30:30", "unlimited", "unlimited"]
+
+
+def test_no_docker_limits(tmp_path):
+  assert run(tmp_path, "echo x{docker_limits}x", docker=True).strip() == "xx"
+  assert run(tmp_path, "echo x{docker_limits}x", memory_limit=512 * 1024 * 1024).strip() == "xx"
+
+
+
+def test_line_handler(tmp_path):
+  # the tool waits for the file created by the handler of the first line: the lines are handled while it runs
+  marker = tmp_path / "marker"
+  command = "sh -c 'echo first; echo error >&2; i=0; while [ ! -f %s ] && [ $i -lt 100 ]; do sleep 0.1; i=$((i+1)); done; [ -f %s ] && echo handled'" % (marker, marker)
+  lines = []
+
+  def handler(line):
+    lines.append(line)
+    marker.touch()
+
+  with ToolRunner(command=command) as runner:
+    project_name, stdout, stderr = runner.scan_directory(base_path=str(tmp_path), params={}, tmp_location=str(tmp_path / "tmp"), line_handler=handler)
+  assert lines == ["first\n", "handled\n"]
+  assert stdout is None
+  assert stderr == "error\n"
+
+
+def test_line_handler_error(tmp_path):
+  def handler(line):
+    raise ValueError("bad line")
+
+  start = time.time()
+  with ToolRunner(command="sh -c 'echo first; exec sleep 30'") as runner:
+    with pytest.raises(ValueError):
+      runner.scan_directory(base_path=str(tmp_path), params={}, tmp_location=str(tmp_path / "tmp"), line_handler=handler)
+  # the tool was killed
+  assert time.time() - start < 10
+
+# fake docker: logs its arguments, 'run -d' prints a container id and 'exec' runs the command locally
+FAKE_DOCKER = """#!/bin/sh
+echo "$*" >> "$FAKE_DOCKER_LOG"
+case "$1" in
+  inspect) echo '["/bin/tool", "--flag"]';;
+  run) [ -n "$FAKE_DOCKER_FAIL_RUN" ] && { echo "no such image" >&2; exit 1; }; echo container123;;
+  exec) shift 2; exec "$@";;
+  rm) ;;
+esac
+"""
+
+
+@pytest.fixture
+def docker(tmp_path, monkeypatch):
+  bin_path = tmp_path / "bin"
+  bin_path.mkdir()
+  f_docker = bin_path / "docker"
+  f_docker.write_text(FAKE_DOCKER)
+  f_docker.chmod(0o755)
+  f_log = tmp_path / "docker.log"
+  f_log.write_text("")
+  monkeypatch.setenv("PATH", "%s:%s" % (bin_path, os.environ["PATH"]))
+  monkeypatch.setenv("FAKE_DOCKER_LOG", str(f_log))
+  return lambda: f_log.read_text().splitlines()
+
+
+def targets(tmp_path):
+  f_targets = []
+  for name in ("a", "b"):
+    (tmp_path / name).mkdir()
+    f_targets.append(str(tmp_path / name))
+  return f_targets
+
+
+def test_container(tmp_path, docker):
+  f_targets = targets(tmp_path)
+  command = "echo {container} {container_path} {entrypoint}"
+  with ToolRunner(command=command, memory_limit=1024, docker=True) as runner:
+    assert runner.start_container(image="tool/image", targets=f_targets, volumes=["/reports:/reports"], user="1000:1000") == "container123"
+    outputs = [runner.scan_directory(base_path=f_target, params={}, tmp_location=str(tmp_path / "tmp"))[1] for f_target in f_targets]
+  assert outputs == ["container123 /code/0 /bin/tool --flag\n", "container123 /code/1 /bin/tool --flag\n"]
+  assert docker() == [
+    "inspect --format {{json .Config.Entrypoint}} tool/image",
+    "run -d --rm --entrypoint tail -v %s:/code/0 -v %s:/code/1 -v /reports:/reports --user 1000:1000 --memory 1024 --memory-swap 1024 tool/image -f /dev/null" % tuple(f_targets),
+    "rm -f container123"]
+  assert runner.container is None
+
+
+def test_container_exec(tmp_path, docker):
+  f_targets = targets(tmp_path)
+  command = "docker exec {container} echo {project_name} {container_path}"
+  with ToolRunner(command=command, max_concurrent=2) as runner:
+    runner.start_container(image="tool/image", targets=f_targets, mount_base="/src")
+    for f_target in f_targets:
+      runner.submit(base_path=f_target, params={}, tmp_location=str(tmp_path / "tmp"))
+    results = runner.wait_and_finish()
+  assert [stdout for project_name, stdout, stderr in results] == ["a /src/0\n", "b /src/1\n"]
+  assert sorted(line for line in docker() if line.startswith("exec")) == ["exec container123 echo a /src/0", "exec container123 echo b /src/1"]
+  assert docker()[-1] == "rm -f container123"
+
+
+def test_container_stopped_on_error(tmp_path, docker):
+  f_targets = targets(tmp_path)
+  try:
+    with ToolRunner(command="echo {container}") as runner:
+      runner.start_container(image="tool/image", targets=f_targets)
+      raise ValueError("scan failed")
+  except ValueError:
+    pass
+  else:
+    assert False, "the error should be raised"
+  assert docker()[-1] == "rm -f container123"
+  assert runner.container is None
+
+
+def test_container_not_started(tmp_path, docker, monkeypatch):
+  monkeypatch.setenv("FAKE_DOCKER_FAIL_RUN", "1")
+  f_targets = targets(tmp_path)
+  try:
+    with ToolRunner(command="echo {container}") as runner:
+      runner.start_container(image="tool/image", targets=f_targets)
+  except Exception as e:
+    assert "no such image" in str(e)
+  else:
+    assert False, "the error should be raised"
+  # nothing to remove
+  assert not any(line.startswith("rm") for line in docker())